@@ -0,0 +1,282 @@
+# chimi: a companion tool for ChaNGa: build artifact store
+# Copyright (C) 2014 Collin J. Sutton
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# The GNU General Public License version 2 may be found at
+# <http://www.gnu.org/licenses/gpl-2.0.html>.
+
+"""
+A store of packed build products, shared by all of a user's (or a site's)
+workspaces.
+
+Each entry is a compressed tarball of a completed build's products -- e.g. a
+Charm++ build's "bin", "include", and "lib" directories -- kept under a key
+computed from the package, build configuration, and source commits (see
+`chimi.core.PackageDefinition.get_artifact_key`), along with a small JSON file
+describing the build.  An identical build requested later, in any workspace,
+is then unpacked from the store instead of being compiled again.
+
+"""
+
+__author__    = 'Collin J. Sutton'
+__copyright__ = 'Copyright (C) 2014 Collin J. Sutton'
+__license__   = 'GPLv2'
+
+import os
+import json
+import time
+import shutil
+import tarfile
+import tempfile
+
+import chimi
+import chimi.util
+import chimi.settings
+
+__all__ = ['ArtifactStoreError', 'ArtifactStore']
+
+
+class ArtifactStoreError(chimi.Error):
+    """Raised for malformed or unsafe artifact archives."""
+    def __init__(self, message):
+        self.message = message
+
+
+class ArtifactStore(object):
+    """A directory of packed build products, indexed by artifact key."""
+
+    COMPRESS_LEVEL = 6
+    """gzip compression level for new entries."""
+
+    STALE_TEMPORARY_AGE = 86400
+    """Age, in seconds, after which `gc` removes abandoned temporary files."""
+
+    @classmethod
+    def default(self):
+        """
+        Get the store at `chimi.settings.artifact_directory`, or None if the
+        store is disabled.
+
+        """
+        if chimi.settings.artifact_directory == None:
+            return None
+        return ArtifactStore(chimi.settings.artifact_directory)
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def archive_path(self, key):
+        """Path of the archive for the entry with the given key."""
+        return os.path.join(self.directory, key[:2], key + '.tar.gz')
+
+    def metadata_path(self, key):
+        """Path of the metadata file for the entry with the given key."""
+        return os.path.join(self.directory, key[:2], key + '.json')
+
+    def has(self, key):
+        """Check whether the store has an entry for `key`."""
+        return os.path.exists(self.metadata_path(key)) and \
+            os.path.exists(self.archive_path(key))
+
+    def entries(self):
+        """
+        Get the metadata for every entry in the store, as dicts that include
+        the entry's 'key', archive 'size' in bytes, and 'last_used' time.
+
+        """
+        out = []
+        if not os.path.isdir(self.directory):
+            return out
+        for subdir in sorted(os.listdir(self.directory)):
+            path = os.path.join(self.directory, subdir)
+            if not os.path.isdir(path):
+                continue
+            for name in sorted(os.listdir(path)):
+                if not name.endswith('.json') or name.startswith('.'):
+                    continue
+                key = name[:-len('.json')]
+                if not os.path.exists(self.archive_path(key)):
+                    continue
+                try:
+                    metadata = chimi.util.json_loads(file(os.path.join(path, name), 'r').read())
+                except (IOError, ValueError):
+                    continue
+                metadata['key'] = key
+                metadata['size'] = os.path.getsize(self.archive_path(key))
+                metadata['last_used'] = os.path.getmtime(self.archive_path(key))
+                out.append(metadata)
+        return out
+
+    def find(self, prefix):
+        """Get the keys of all entries whose keys start with `prefix`."""
+        return [e['key'] for e in self.entries() if e['key'].startswith(prefix)]
+
+    def _temporary(self, key, suffix):
+        directory = os.path.dirname(self.archive_path(key))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        fd, path = tempfile.mkstemp(prefix='.tmp-', suffix=suffix, dir=directory)
+        os.close(fd)
+        return path
+
+    def pack(self, key, directory, paths, metadata):
+        """
+        Add an entry to the store.
+
+        directory: build directory containing the products.
+
+        paths: paths, relative to `directory`, of the files and directories
+            to pack.  Symbolic links are followed, since build trees often
+            link into directories that aren't packed.
+
+        metadata: plain-data description of the build.
+
+        """
+        archive = self._temporary(key, '.tar.gz')
+        try:
+            with tarfile.open(archive, 'w:gz', compresslevel=ArtifactStore.COMPRESS_LEVEL,
+                              dereference=True) as tar:
+                for path in paths:
+                    tar.add(os.path.join(directory, path), path)
+            # Publish the archive before the metadata, since entries without
+            # metadata are ignored.
+            os.chmod(archive, 0644)
+            os.rename(archive, self.archive_path(key))
+            metadata = dict(metadata, created=time.time())
+            chimi.util.write_file_atomically(self.metadata_path(key),
+                                             json.dumps(metadata, sort_keys=True, indent=1))
+        finally:
+            if os.path.exists(archive):
+                os.unlink(archive)
+
+    @classmethod
+    def check_members(self, tar):
+        """
+        Make sure that no member of an archive would be extracted outside the
+        destination directory.
+
+        """
+        def escapes(path):
+            path = os.path.normpath(path)
+            return os.path.isabs(path) or path == os.pardir or \
+                path.startswith(os.pardir + os.sep)
+
+        for member in tar.getmembers():
+            # Symbolic-link targets are relative to the link's directory, and
+            # hard-link targets to the archive root.
+            if escapes(member.name) or \
+                    (member.issym() and
+                     (os.path.isabs(member.linkname) or
+                      escapes(os.path.join(os.path.dirname(member.name), member.linkname)))) or \
+                    (member.islnk() and escapes(member.linkname)):
+                raise ArtifactStoreError('refusing to extract unsafe archive member "%s"'
+                                         % member.name)
+
+    def restore(self, key, directory):
+        """
+        Unpack the entry for `key` into `directory`, and mark the entry as
+        recently used.
+
+        """
+        archive = self.archive_path(key)
+        with tarfile.open(archive, 'r:gz') as tar:
+            ArtifactStore.check_members(tar)
+            tar.extractall(directory)
+        os.utime(archive, None)
+
+    def remove(self, key):
+        """Remove an entry from the store."""
+        for path in (self.metadata_path(key), self.archive_path(key)):
+            if os.path.exists(path):
+                os.unlink(path)
+
+    def gc(self, max_age=None, max_size=None):
+        """
+        Remove entries not used within `max_age` seconds and then, least
+        recently used first, entries beyond a total size of `max_size` bytes.
+        Abandoned temporary files are removed as well.
+
+        return: list of the metadata of removed entries.
+
+        """
+        now = time.time()
+        if os.path.isdir(self.directory):
+            for subdir in os.listdir(self.directory):
+                path = os.path.join(self.directory, subdir)
+                if not os.path.isdir(path):
+                    continue
+                for name in os.listdir(path):
+                    if name.startswith('.tmp-') and \
+                            now - os.path.getmtime(os.path.join(path, name)) > \
+                            ArtifactStore.STALE_TEMPORARY_AGE:
+                        os.unlink(os.path.join(path, name))
+
+        removed = []
+        entries = sorted(self.entries(), key=lambda e: e['last_used'])
+        if max_age != None:
+            for entry in list(entries):
+                if now - entry['last_used'] > max_age:
+                    entries.remove(entry)
+                    removed.append(entry)
+        if max_size != None:
+            total = sum(e['size'] for e in entries)
+            while total > max_size and len(entries) > 0:
+                entry = entries.pop(0)
+                total -= entry['size']
+                removed.append(entry)
+        for entry in removed:
+            self.remove(entry['key'])
+        return removed
+
+    def export(self, keys, filename):
+        """
+        Write the entries for `keys` to a single (uncompressed) tar file, e.g.
+        for copying to another host's store.
+
+        """
+        with tarfile.open(filename, 'w') as tar:
+            for key in keys:
+                for path in (self.metadata_path(key), self.archive_path(key)):
+                    tar.add(path, os.path.relpath(path, self.directory))
+
+    def import_archive(self, filename):
+        """
+        Add the entries in a file written by `export` that aren't already in
+        the store.
+
+        return: list of the keys of the entries added.
+
+        """
+        added = []
+        with tarfile.open(filename, 'r') as tar:
+            ArtifactStore.check_members(tar)
+            members = dict((m.name, m) for m in tar.getmembers() if m.isfile())
+            for name in sorted(members):
+                if not name.endswith('.json'):
+                    continue
+                key = os.path.basename(name)[:-len('.json')]
+                archive_name = os.path.relpath(self.archive_path(key), self.directory)
+                if self.has(key) or not archive_name in members:
+                    continue
+                for member, path in ((members[archive_name], self.archive_path(key)),
+                                     (members[name], self.metadata_path(key))):
+                    temporary = self._temporary(key, os.path.splitext(path)[1])
+                    try:
+                        with open(temporary, 'wb') as out:
+                            shutil.copyfileobj(tar.extractfile(member), out)
+                        os.chmod(temporary, 0644)
+                        os.rename(temporary, path)
+                    finally:
+                        if os.path.exists(temporary):
+                            os.unlink(temporary)
+                added.append(key)
+        return added
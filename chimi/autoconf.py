@@ -0,0 +1,188 @@
+# chimi: a companion tool for ChaNGa: shared autoconf caches
+# Copyright (C) 2014 Collin J. Sutton
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# The GNU General Public License version 2 may be found at
+# <http://www.gnu.org/licenses/gpl-2.0.html>.
+
+"""
+Caches of `configure` test results shared between builds.
+
+Most of the time spent running ChaNGa's `configure` goes to compiler and
+library probes whose results depend on the compilers, the Charm++ build used,
+the host, and the options given to `configure` -- feature options included,
+since they may change the flags with which the probes are compiled.  A
+`ConfigureCache` keeps one autoconf cache file (see `--cache-file` in the
+autoconf manual) for each distinct set of those inputs.  Each build is given
+its own copy of the matching file, and a successful `configure` run's copy
+replaces the shared one; builds configured at the same time never write to the
+same file.
+
+"""
+
+__author__    = 'Collin J. Sutton'
+__copyright__ = 'Copyright (C) 2014 Collin J. Sutton'
+__license__   = 'GPLv2'
+
+import os
+import re
+import glob
+import json
+import socket
+import hashlib
+
+import chimi.util
+import chimi.settings
+
+__all__ = ['ConfigureCache']
+
+
+class ConfigureCache(object):
+    """A directory of autoconf cache files, indexed by key."""
+
+    CACHE_FILE = 'config.cache'
+    """Name of a build's own copy of its cache file, in the build directory."""
+
+    PRECIOUS_VARIABLES = ('CC', 'CFLAGS', 'CXX', 'CXXFLAGS', 'CPP', 'CXXCPP',
+                          'CPPFLAGS', 'LDFLAGS', 'LIBS')
+    """
+    Environment variables that autoconf records in its cache, and refuses to
+    run if they differ from the recorded values.
+
+    """
+
+    COMPILER_REGEXP = re.compile(r'^\s*CMK_(?:SEQ_)?(?:CC|CXX|LD|LDXX)=[\'"]?\s*([^\s\'"]+)',
+                                 re.MULTILINE)
+    """
+    Regular expression matching the compiler commands set in Charm++'s
+    "conv-mach" and "cc-" shell fragments.
+
+    """
+
+    @classmethod
+    def default(self):
+        """
+        Get the cache at `chimi.settings.configure_cache_directory`, or None if
+        caching is disabled.
+
+        """
+        if chimi.settings.configure_cache_directory == None:
+            return None
+        return ConfigureCache(chimi.settings.configure_cache_directory)
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    @classmethod
+    def compiler_identity(self, charm_directory, fragment_directories=('include',)):
+        """
+        Describe the compilers used through the Charm++ build in
+        `charm_directory`: the contents of the shell fragments in which
+        Charm++ records its compiler settings, and the location, size, and
+        modification time of each compiler they name (and of any given in the
+        environment), so that reinstalling or upgrading a compiler changes the
+        identity.
+
+        fragment_directories: directories, relative to `charm_directory`, in
+            which to look for the shell fragments.  The default suits a
+            completed Charm++ build; those of a build not yet compiled are
+            found in its source tree's "src/arch" directories.
+
+        """
+        fragments = {}
+        commands = set()
+        for directory in fragment_directories:
+            for pattern in ('conv-*.sh', 'cc-*.sh'):
+                for path in glob.glob(os.path.join(charm_directory, directory, pattern)):
+                    text = file(path, 'r').read()
+                    fragments[os.path.relpath(path, charm_directory)] = hashlib.sha1(text).hexdigest()
+                    commands.update(ConfigureCache.COMPILER_REGEXP.findall(text))
+        for var in ('CC', 'CXX'):
+            if var in os.environ and os.environ[var].split():
+                commands.add(os.environ[var].split()[0])
+
+        compilers = {}
+        for command in sorted(commands):
+            path = chimi.util.which(command)
+            if path == None:
+                compilers[command] = None
+            else:
+                path = os.path.realpath(path)
+                st = os.stat(path)
+                compilers[command] = [path, st.st_size, int(st.st_mtime)]
+        return { 'fragments': fragments, 'compilers': compilers }
+
+    def get_key(self, charmc, charm_directory, flags, host=None):
+        """
+        Compute the key of the cache file for a `configure` run.
+
+        charmc: path to the `charmc` passed to `configure`.
+
+        charm_directory: directory of the Charm++ build containing `charmc`.
+
+        flags: the arguments passed to `configure`, all of which are part of
+            the key: feature options ("--enable-"/"--disable-") may add to
+            CPPFLAGS, CXXFLAGS, or LIBS and so change the results of the
+            cached tests, as may package locations and variable assignments.
+
+        host: host name; default: that of the current host.
+
+        """
+        if host == None:
+            host = socket.gethostname()
+        environment = dict((var, os.environ[var]) for var in ConfigureCache.PRECIOUS_VARIABLES
+                           if var in os.environ)
+        return hashlib.sha1(json.dumps([host, os.path.realpath(charmc),
+                                        ConfigureCache.compiler_identity(charm_directory),
+                                        list(flags), environment],
+                                       sort_keys=True)).hexdigest()
+
+    def path(self, key):
+        """Path of the shared cache file for `key`."""
+        return os.path.join(self.directory, key + '.cache')
+
+    def checkout(self, key, build_dir):
+        """
+        Give a build its own copy of the cache file for `key`, if there is
+        one.
+
+        return: path of the build's copy, relative to `build_dir`.
+
+        """
+        local = os.path.join(build_dir, ConfigureCache.CACHE_FILE)
+        if os.path.exists(self.path(key)):
+            chimi.util.write_file_atomically(local, file(self.path(key), 'r').read())
+        elif os.path.exists(local):
+            os.unlink(local)
+        return ConfigureCache.CACHE_FILE
+
+    def publish(self, key, build_dir):
+        """
+        Replace the shared cache file for `key` with the copy updated by a
+        successful `configure` run in `build_dir`.
+
+        """
+        local = os.path.join(build_dir, ConfigureCache.CACHE_FILE)
+        if not os.path.exists(local):
+            return
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        chimi.util.write_file_atomically(self.path(key), file(local, 'r').read())
+
+    def discard(self, key):
+        """
+        Remove the shared cache file for `key`, e.g. after a `configure` run
+        using it failed.
+
+        """
+        if os.path.exists(self.path(key)):
+            os.unlink(self.path(key))
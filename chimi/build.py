@@ -26,15 +26,18 @@ __license__   = 'GPLv2'
 
 import os
 import sys
+import json
 import time
 import uuid
+import hashlib
 import datetime
 
 import chimi
+import chimi.util
 import chimi.settings
 
 __all__ = [ 'InvalidArchitectureError', 'InvalidBuildOptionError',
-            'BuildMessage', 'BuildStatus', 'BuildConfig', 'Build' ]
+            'StepTiming', 'BuildMessage', 'BuildStatus', 'BuildConfig', 'Build' ]
 
 class InvalidArchitectureError(chimi.Error):
     """
@@ -73,17 +76,42 @@ class InvalidBuildOptionError(chimi.Error):
                  self.package.definition == chimi.core.CharmDefinition \
                  else 'Charm++ component or ChaNGa configuration option')
 
+StepTiming = chimi.util.create_struct(__name__, 'StepTiming',
+                                      'wall', 'user', 'system', 'max_rss')
+"""
+Resources used by a build step: wall-clock time and the user and system CPU
+time of the step's commands, in seconds, and the peak resident set size of the
+largest of those processes, in KiB.
+
+"""
+
 class BuildMessage(object):
     """A recorded build message"""
     time = None
     status = None
     message = None
+    log = None
+    """Path of the file holding the output of the step the message reports."""
+    timing = None
+    """StepTiming for the step whose outcome the message reports."""
+    sources = None
+    """
+    Fingerprint of the sources compiled, for messages reporting a completed
+    build; see `chimi.core.PackageDefinition.get_source_fingerprint`.
 
-    def __init__(self, status, message=None):
+    """
+
+    def __init__(self, status, message=None, log=None, timing=None, sources=None):
         self.time = time.time()
         self.status = status
         if message != None:
             self.message = message
+        if log != None:
+            self.log = log
+        if timing != None:
+            self.timing = timing
+        if sources != None:
+            self.sources = sources
 
     def __str__(self):
         time_string = None
@@ -113,6 +141,37 @@ class BuildMessage(object):
     def __lt__(self, other):
         return self.time < other.time
 
+    def to_record(self):
+        """Get a plain-data representation of the message."""
+        use_time = self.time
+        if isinstance(self.time, time.struct_time):
+            use_time = time.mktime(self.time)
+        record = { 'time': use_time, 'status': self.status.value,
+                   'message': self.message }
+        if self.log != None:
+            record['log'] = self.log
+        if self.timing != None:
+            record['timing'] = dict(self.timing)
+        if self.sources != None:
+            record['sources'] = self.sources
+        return record
+
+    @classmethod
+    def from_record(self, record):
+        """Re-create a message from the output of `to_record`."""
+        msg = BuildMessage.__new__(BuildMessage)
+        msg.time = record['time']
+        msg.status = BuildStatus(record['status'])
+        if record.get('message') != None:
+            msg.message = record['message']
+        if record.get('log') != None:
+            msg.log = record['log']
+        if record.get('timing') != None:
+            msg.timing = StepTiming(**record['timing'])
+        if record.get('sources') != None:
+            msg.sources = record['sources']
+        return msg
+
 class BuildStatus:
     """A recorded build status"""
     value = None
@@ -449,15 +508,88 @@ class BuildConfig(object):
                 self.branch == other.branch and \
                 self.package.definition.name == other.package.definition.name
 
+    @property
+    def fingerprint(self):
+        """
+        Canonical, order-independent hash of the build configuration,
+        including the package it's for.  Configurations with equal fingerprints
+        compare equal, so the fingerprint can stand in for the configuration
+        as a lookup or cache key.
+
+        """
+        return BuildConfig.fingerprint_record(self.package.definition.name,
+                                              self.to_record())
+
+    @classmethod
+    def fingerprint_record(self, package_name, record, branch=True):
+        """
+        Compute the fingerprint of a build-configuration record (as produced
+        by `to_record`) for the package definition named `package_name`.  If
+        `branch` is False, the configuration's branch is ignored.
+
+        """
+        canonical = json.dumps([package_name,
+                                record['architecture'],
+                                sorted(set(record['components'])),
+                                sorted(record['features'].items()),
+                                sorted(record['settings'].items()),
+                                sorted(set(record['extras'])),
+                                record['branch'] if branch else None])
+        return hashlib.sha1(canonical).hexdigest()
+
+    def to_record(self):
+        """
+        Get a plain-data representation of the build configuration.  The
+        owning package is not included.
+
+        """
+        out = { 'architecture': str(self.architecture),
+                'components': list(self.components),
+                'features': dict(self.features),
+                'settings': dict(self.settings),
+                'extras': list(self.extras),
+                'branch': self.branch }
+        if 'source_opts' in self.__dict__:
+            out['source_opts'] = self.source_opts
+        return out
+
+    @classmethod
+    def from_record(self, package, record):
+        """
+        Re-create a build configuration for `package` from the output of
+        `to_record`.  Unlike `__init__`, this neither consults the host
+        configuration nor queries the package's repository.
+
+        """
+        config = BuildConfig.__new__(BuildConfig)
+        config.package = package
+        config.architecture = record['architecture']
+        config.components = list(record['components'])
+        config.features = dict(record['features'])
+        config.settings = dict(record['settings'])
+        config.extras = list(record['extras'])
+        config.branch = record['branch']
+        if 'source_opts' in record:
+            config.source_opts = record['source_opts']
+        return config
+
 class Build(object):
     """Information about a build of a particular Package instance"""
 
+    LOG_FILE = 'chimi-build.log'
+    """
+    Name of the file, in the build directory, to which the output of each build
+    step is appended.
+
+    """
+
     def __init__(self, pkg, config,
                  initial_status=BuildStatus.Unconfigured, initial_message=None,
                  _uuid=None, name=None, messages=None):
         self.uuid = _uuid if _uuid != None else uuid.uuid1()
         self.package = pkg
         self.config = config
+        self.commit = None
 
         # Ensure the build configuration has a repository branch selected.
         # If it doesn't, use the currently checked-out branch.
@@ -487,6 +619,33 @@ class Build(object):
         self.directory = pkg.definition.get_build_directory(self)
         assert(os.path.basename(self.directory) == self.name)
 
+    def __setstate__(self, state):
+        # Builds serialized as objects store their messages directly.
+        if 'messages' in state:
+            state['_messages'] = state.pop('messages')
+        state.setdefault('_messages', None)
+        state.setdefault('_message_records', None)
+        state.setdefault('commit', None)
+        self.__dict__ = state
+
+    @property
+    def messages(self):
+        """
+        List of status messages for the build, oldest first.  For builds
+        created with `from_record` the messages are only instantiated when
+        first accessed.
+
+        """
+        if self._messages is None:
+            self._messages = [BuildMessage.from_record(r) for r in self._message_records]
+            self._message_records = None
+        return self._messages
+
+    @messages.setter
+    def messages(self, value):
+        self._messages = value
+        self._message_records = None
+
     @property
     def status(self):
         """
@@ -510,21 +669,101 @@ class Build(object):
 
     @property
     def version(self):
-        """Source-package version used for the build"""
+        """
+        Source-package version used for the build.  This is the commit recorded
+        when the build last completed, if any; otherwise it is resolved by the
+        package definition.
+
+        """
+        if self.commit != None:
+            return self.commit
         return self.package.definition.get_build_version(self)
 
-    def update(self, status, message=None):
-        """Update the build's status."""
+    @property
+    def log_file(self):
+        """Path of the build's log file."""
+        return os.path.join(self.directory, Build.LOG_FILE)
+
+    @property
+    def last_log(self):
+        """
+        Path of the log recorded by the build's most recent message that has
+        one, or None.
+
+        """
+        for msg in reversed(self.messages):
+            if msg.log != None:
+                return msg.log
+        return None
+
+    @property
+    def source_fingerprint(self):
+        """
+        Fingerprint of the sources compiled when the build last completed, or
+        None if none was recorded.
+
+        """
+        for msg in reversed(self.messages):
+            if msg.sources != None:
+                return msg.sources
+        return None
+
+    def update(self, status, message=None, log=None, timing=None, sources=None):
+        """
+        Update the build's status.  `log`, if given, is the path of the file
+        holding the output of the step the new status reports, `timing` a
+        StepTiming for a step that has just finished, and `sources` the source
+        fingerprint of a completed build.
+
+        """
         if message == None:
             message = BuildStatus.default_message(status)
-        msg = BuildMessage(status, message)
+        msg = BuildMessage(status, message, log, timing, sources)
         self.messages.append(msg)
 
+        if status == BuildStatus.Complete:
+            # Record the source version now, so it needn't be resolved every
+            # time the build is listed.
+            self.commit = self.package.definition.get_build_version(self)
+
         if not chimi.settings.noact:
-            self.package.package_set.save_flag = True
+            self.package.package_set.record_message(self, msg)
 
         sys.stderr.write(str(msg) + "\n")
+        if status.failure and log != None:
+            sys.stderr.write("%12s output is in %s\n" % ('', log))
 
     def __lt__(self, other):
         """Provides comparison based on time of most-recent build message."""
         return self.messages[-1].time < other.messages[-1].time
+
+    def to_record(self):
+        """
+        Get a plain-data representation of the build, suitable for writing
+        with any serializer.  The owning package is not included.
+
+        """
+        if self._messages is None:
+            messages = list(self._message_records)
+        else:
+            messages = [msg.to_record() for msg in self._messages]
+        return { 'uuid': str(self.uuid),
+                 'name': self.name,
+                 'directory': self.directory,
+                 'config': self.config.to_record(),
+                 'commit': self.commit,
+                 'messages': messages }
+
+    @classmethod
+    def from_record(self, pkg, record):
+        """Re-create a build of package `pkg` from the output of `to_record`."""
+        _build = Build.__new__(Build)
+        _build.uuid = uuid.UUID(record['uuid'])
+        _build.package = pkg
+        _build.config = BuildConfig.from_record(pkg, record['config'])
+        _build.name = record['name']
+        _build.directory = record['directory']
+        _build._messages = None
+        _build._message_records = record['messages']
+        _build.commit = record.get('commit')
+        return _build
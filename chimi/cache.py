@@ -0,0 +1,101 @@
+# chimi: a companion tool for ChaNGa: persistent caches
+# Copyright (C) 2014 Collin J. Sutton
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# The GNU General Public License version 2 may be found at
+# <http://www.gnu.org/licenses/gpl-2.0.html>.
+
+"""
+Persistent caches for expensive-to-compute data, stored under a workspace's
+"chimi-tmp" directory.
+
+Each cache file holds a single pickled value along with the key it was
+computed for; a value is only returned by `load` when the caller's key is
+equal to the stored one, so callers invalidate entries simply by deriving
+keys from whatever the cached data depends on (file sizes, mtimes, content
+hashes...).
+
+"""
+
+__author__    = 'Collin J. Sutton'
+__copyright__ = 'Copyright (C) 2014 Collin J. Sutton'
+__license__   = 'GPLv2'
+
+import os
+import cPickle
+import hashlib
+
+import chimi.util
+import chimi.settings
+
+__all__ = ['CACHE_DIR', 'path', 'file_key', 'load', 'store', 'invalidate']
+
+CACHE_DIR = os.path.join('chimi-tmp', 'cache')
+"""Location of cache files relative to the workspace directory."""
+
+
+def path(directory, name):
+    """Get the path of the cache file `name` for the workspace at `directory`."""
+    return os.path.join(directory, CACHE_DIR, name)
+
+def file_key(filename, data=None):
+    """
+    Compute a cache key for the contents of a file: its size, modification
+    time, and SHA-1 hash.  If the file's contents have already been read, pass
+    them as `data` to avoid reading it again.
+
+    """
+    st = os.stat(filename)
+    if data == None:
+        data = file(filename, 'rb').read()
+    return (st.st_size, st.st_mtime, hashlib.sha1(data).hexdigest())
+
+def load(filename, key):
+    """
+    Load the value cached in `filename`.  Returns None if the file doesn't
+    exist, can't be read, or was stored under a different key.
+
+    """
+    try:
+        stored_key, value = cPickle.load(file(filename, 'rb'))
+    except Exception:
+        return None
+    if stored_key != key:
+        return None
+    return value
+
+def store(filename, key, value):
+    """
+    Store `value` under `key` in `filename`.  The file is replaced atomically,
+    so concurrent readers never see a partial entry.  Nothing is written when
+    `chimi.settings.noact` is set.
+
+    Caching is best-effort: returns False (leaving any previous entry in
+    place) if the value could not be written, and True otherwise.
+
+    """
+    if chimi.settings.noact:
+        return False
+    directory = os.path.dirname(filename)
+    try:
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        chimi.util.write_file_atomically(filename,
+                                         cPickle.dumps((key, value), cPickle.HIGHEST_PROTOCOL))
+    except (OSError, IOError, TypeError, cPickle.PicklingError):
+        return False
+    return True
+
+def invalidate(filename):
+    """Remove a cache file, if it exists."""
+    if not chimi.settings.noact and os.path.exists(filename):
+        os.unlink(filename)
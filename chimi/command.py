@@ -26,14 +26,23 @@ __license__   = 'GPLv2'
 import os
 import re
 import sys
+import time
+import datetime
+import tempfile
 
 import chimi
 import chimi.job
 import chimi.core
+import chimi.config
+import chimi.journal
+import chimi.artifacts
+import chimi.runner
 import chimi.settings
+import chimi.scheduler
 import chimi.dependency
 
 from chimi.core import PackageSet
+from chimi.build import BuildStatus
 from chimi.option import Option, OptionParser
 
 basename = os.path.basename(sys.argv[0])
@@ -62,7 +71,13 @@ class Command(object):
 
     def __init__(self, name, args, brief, options, detail,
                  callback=None,
-                 subcommands=None):
+                 subcommands=None, callback_is_default=False):
+        """
+        callback_is_default: if True, `callback` handles invocations whose
+            first argument isn't the name of a subcommand, and is not called
+            when a subcommand is invoked.
+
+        """
         self.name = name
         self.arguments_usage = args
         self.options = options
@@ -72,6 +87,7 @@ class Command(object):
         self.hidden = name[0] == '*'
         self.required_arg_count = 0
         self.subcommands=subcommands
+        self.callback_is_default = callback_is_default
         self.parent = None
 
         if subcommands != None:
@@ -190,7 +206,9 @@ class Command(object):
             sys.stderr.write('%s: %s\n' % (self.name, str(err)))
             return 3;
 
-        if len(self.subcommands) == 0:
+        if len(self.subcommands) == 0 or \
+                (self.callback_is_default and
+                 (len(args) == 0 or not args[0] in self.subcommand_dict)):
             # Primary-command invocation.
             if len(args) < self.required_arg_count:
                 raise CommandUsageError(self)
@@ -205,7 +223,7 @@ class Command(object):
 
                 if len(args) < cmd.required_arg_count:
                     raise CommandUsageError(cmd)
-                elif self.callback != None:
+                elif self.callback != None and not self.callback_is_default:
                     # Invoke the parent command's handler to do e.g. common
                     # initialization for subcommands, and then invoke the
                     # subcommand using the results of that call.
@@ -242,6 +260,11 @@ def load_platform_resources():
 def is_root_dir(_dir):
     return os.path.dirname(_dir) == _dir
 
+def is_package_dir(_dir):
+    """Check if `_dir` contains a Chimi database file."""
+    return os.path.exists(os.path.join(_dir, PackageSet.SET_FILE)) or \
+        chimi.core.SQLiteStore.exists(_dir)
+
 def find_current_package_dir():
     """
     Search up the directory hierarchy from the current directory for
@@ -250,17 +273,15 @@ def find_current_package_dir():
     """
 
     _dir = os.getcwd()
-    check = os.path.join(_dir, PackageSet.SET_FILE)
-    if os.path.exists(check):
+    if is_package_dir(_dir):
         return _dir
     else:
-        while not os.path.exists(check):
+        while not is_package_dir(_dir):
             if os.path.ismount(_dir):
                 break
             else:
                 _dir = os.path.dirname(_dir)
-                check = os.path.join(_dir, PackageSet.SET_FILE)
-        if os.path.exists(check):
+        if is_package_dir(_dir):
             return _dir
         else:
             if is_root_dir(os.getcwd()):
@@ -290,8 +311,49 @@ def fetch_sources(opts, which='all'):
     if not isinstance(which, list):
         which = [which]
 
-    for proj in which:
-        ps.packages[proj].fetch()
+    # Instantiate the packages up front; the package set isn't safe to load
+    # from several threads.
+    packages = [(proj, ps.packages[proj]) for proj in which]
+    host = chimi.config.HostConfig.load()
+    fetch_options = host.fetch if host != None else {}
+
+    def fetch_one(item):
+        proj, pkg = item
+        sys.stderr.write('%s: fetching...\n' % proj)
+        # Buffer Git's output so concurrent fetches don't interleave.
+        log = None if chimi.settings.noact else tempfile.TemporaryFile()
+        try:
+            status = pkg.fetch(out=log, err=log, options=fetch_options.get(proj))
+            if log != None:
+                log.seek(0)
+                output = log.read()
+            else:
+                output = ''
+        finally:
+            if log != None:
+                log.close()
+        return status, output
+
+    results = chimi.util.parallel_map(fetch_one, packages, chimi.settings.fetch_jobs)
+
+    failed = 0
+    for (proj, pkg), (result, error) in zip(packages, results):
+        if error != None:
+            failed += 1
+            sys.stderr.write('%s: \033[1;31mfailed:\033[0m %s\n' % (proj, error))
+            continue
+        status, output = result
+        if status != 0:
+            failed += 1
+            sys.stderr.write('%s: \033[1;31mfailed\033[0m (exit status %d)\n' % (proj, status))
+            sys.stderr.write(''.join('  ' + line for line in output.splitlines(True)))
+        else:
+            sys.stderr.write('%s: \033[1;32mdone\033[0m\n' % proj)
+
+    if failed > 0:
+        sys.stderr.write('%d of %d fetches failed.\n' % (failed, len(packages)))
+        return 1
+    return 0
 
 
 def helpfn(opts, *args, **kwargs):
@@ -395,6 +457,25 @@ def build(config, which=None, *args):
         purge = config['purge']
         del config['purge']
 
+    pipeline = True
+    if 'no-pipeline' in config:
+        pipeline = False
+        del config['no-pipeline']
+
+    if 'no-artifact-cache' in config:
+        chimi.settings.artifact_directory = None
+        del config['no-artifact-cache']
+
+    jobs = None
+    if 'jobs' in config:
+        try:
+            jobs = int(config['jobs'])
+        except ValueError:
+            jobs = 0
+        if jobs < 1:
+            raise CommandError('Invalid job count: %s' % config['jobs'])
+        del config['jobs']
+
     arch = config['arch'] if 'arch' in config else None
     opts = config['options'] if 'options' in config else []
     branch = config['branch'] if 'branch' in config else None
@@ -421,49 +502,182 @@ def build(config, which=None, *args):
                                                      else 'would purge',
                                                      x.name))
 
-    for item in which:
-        package = ps.packages[item]
-        config = chimi.build.BuildConfig.create(package, arch=arch, opts=opts,
-                                                extras=extras, branch=branch)
-        if purge == 'all':
-            package.purge_builds()
-        elif isinstance(purge,bool) and purge:
-            sys.stderr.write('Purging from %s:\n'%package.definition.name)
-            n = package.purge_builds(config=config, callback=purge_callback)
-            if not n:
-                sys.stderr.write('  hmmm, no builds matched.\n')
-        elif isinstance(purge,str):
-            purge_builds = purge.split(',')
-            hd = r'[a-fA-F0-9]'
-            uuid_re=re.compile(r'^%s{8}-%s{4}-%s{4}-%s{4}-%s{12}$'%(hd,hd,hd,hd,hd))
-            names = []
-            uuids = []
-            for s in purge_builds:
-                if uuid_re.match(s):
-                    uuids.append(s)
-                else:
-                    names.append(s)
-            sys.stderr.write('Purging from %s:\n'%package.definition.name)
-            n = package.purge_builds(names=names, uuids=uuids,
-                                     callback=purge_callback)
-            if not n:
-                sys.stderr.write('  hmmm, no builds matched.\n')
-        else:               # We're actually building something.
+    # Each (architecture, option set) pair is a separate configuration to
+    # build (or purge).
+    option_sets = [opts]
+    if 'variant' in config:
+        option_sets = [opts + ([] if variant in ('', 'none') else [variant])
+                       for variant in config['variant']]
+    variants = [(arch_name, option_set)
+                for arch_name in (arch.split(',') if arch else [None])
+                for option_set in option_sets]
+
+    if purge:
+        for item in which:
+            package = ps.packages[item]
+            if purge == 'all':
+                package.purge_builds()
+            elif isinstance(purge,bool):
+                sys.stderr.write('Purging from %s:\n'%package.definition.name)
+                n = 0
+                for arch_name, option_set in variants:
+                    config = chimi.build.BuildConfig.create(package, arch=arch_name, opts=option_set,
+                                                            extras=extras, branch=branch)
+                    n += package.purge_builds(config=config, callback=purge_callback)
+                if not n:
+                    sys.stderr.write('  hmmm, no builds matched.\n')
+            elif isinstance(purge,str):
+                purge_builds = purge.split(',')
+                hd = r'[a-fA-F0-9]'
+                uuid_re=re.compile(r'^%s{8}-%s{4}-%s{4}-%s{4}-%s{12}$'%(hd,hd,hd,hd,hd))
+                names = []
+                uuids = []
+                for s in purge_builds:
+                    if uuid_re.match(s):
+                        uuids.append(s)
+                    else:
+                        names.append(s)
+                sys.stderr.write('Purging from %s:\n'%package.definition.name)
+                n = package.purge_builds(names=names, uuids=uuids,
+                                         callback=purge_callback)
+                if not n:
+                    sys.stderr.write('  hmmm, no builds matched.\n')
+        if not chimi.settings.noact:
+            ps.save()
+        return
+
+    # We're actually building something.  Resolve the requested builds, and
+    # the Charm++ builds needed by any ChaNGa builds, into a dependency graph;
+    # independent builds then run concurrently, sharing the job-slot budget.
+    host = chimi.config.HostConfig.load()
+    host_build = host.build if host != None else chimi.config.HostBuildConfig({})
+    jobs = host_build.get_make_jobs(jobs)
+
+    requested = set()
+    def run(node, node_jobs):
+        return node.package.build(node.config, _continue=_continue and node in requested,
+                                  replace=replace, force=force, jobs=node_jobs)
+
+    def early_start(node):
+        # ChaNGa builds may be configured as soon as the Charm++ build they
+        # use has installed `charmc' and its headers; they wait for the rest
+        # of it before compiling.
+        if node.package_name != 'charm':
+            return False
+        _build = node.package.find_build(node.config)
+        if _build == None:
+            return False
+        since = node.package.building_since(_build.config)
+        return since != None and chimi.core.CharmDefinition.ready_for_configure(_build, since)
+
+    scheduler = chimi.scheduler.BuildScheduler(jobs, run, early_start if pipeline else None)
+
+    for arch_name, option_set in variants:
+        for item in which:
+            package = ps.packages[item]
+            config = chimi.build.BuildConfig.create(package, arch=arch_name, opts=option_set,
+                                                    extras=extras, branch=branch)
             _build = package.find_build(config)
-
             if _build and _build.config.branch == config.branch and _build.compiled and not force:
                 sys.stderr.write("Skipping build of \"%s\": already built: %s\n" % (item, _build.name))
-            else:
-                try:
-                    ps[item].build(config, _continue=_continue, replace=replace, force=force)
-                except KeyboardInterrupt:
-                    ps[item].find_build(config).update(BuildStatus.InterruptedByUser)
-                    if not chimi.settings.noact:
-                        ps.save_flag = True
-                        ps.save()
-                    exit(1)
+                continue
+
+            dependencies = []
+            if item == 'changa':
+                charm_config = chimi.core.ChaNGaDefinition.get_charm_config(package, config)
+                if charm.find_build(charm_config) == None:
+                    dependencies.append(scheduler.add('charm', charm, charm_config))
+            requested.add(scheduler.add(item, package, config, dependencies))
+
+    if len(scheduler.nodes) > 1:
+        # Keep concurrent builds' output out of each other's way: it goes only
+        # to their log files.
+        chimi.settings.echo_build_output = False
+
+    try:
+        success = scheduler.run()
+    except KeyboardInterrupt:
+        chimi.runner.cancel_all()
+        for node in scheduler.running:
+            _build = node.package.find_build(node.config)
+            if _build != None:
+                _build.update(BuildStatus.InterruptedByUser)
+        if not chimi.settings.noact:
+            ps.save_flag = True
+            ps.save()
+        exit(1)
+
+    if len(scheduler.nodes) > 1:
+        for node in scheduler.nodes:
+            sys.stderr.write('  %-9s %s\n' % (node.state, node.description))
+            if node.state == 'failed' and node.build != None and node.build.last_log:
+                sys.stderr.write('  %-9s output is in %s\n' % ('', node.build.last_log))
+
     if not chimi.settings.noact:
         ps.save()
+    return 0 if success else 1
+
+def find_build_by_name(ps, name):
+    """
+    Find a build of any package by name or UUID.  Raises CommandError if there
+    is no such build or the name is ambiguous.
+
+    """
+    matches = []
+    for package_name in ('changa', 'charm'):
+        matches.extend(ps.find_builds(package_name, name=name) or
+                       ps.find_builds(package_name, _uuid=name))
+    if len(matches) == 0:
+        raise CommandError('No build with name or UUID `%s\'.' % name)
+    elif len(matches) > 1:
+        raise CommandError('More than one build is named `%s\'; use a UUID instead.' % name)
+    return matches[0]
+
+def build_log(opts, name):
+    ps = find_current_package_set()
+    _build = find_build_by_name(ps, name)
+    log = _build.last_log
+    if log == None or not os.path.exists(log):
+        raise CommandError('No log has been recorded for build `%s\'.' % _build.name)
+
+    follow = 'follow' in opts
+    lines = 10 if follow else None
+    if 'lines' in opts:
+        try:
+            lines = int(opts['lines'])
+        except ValueError:
+            raise CommandError('Invalid line count: %s' % opts['lines'])
+
+    # Copy the log from the starting offset and, when following, whatever is
+    # appended after that offset.
+    logfile = open(log, 'rb')
+    offset = chimi.util.tail_offset(logfile, lines) if lines != None else 0
+    try:
+        while True:
+            size = os.stat(log).st_size
+            if size < offset:
+                # Truncated or replaced; start over.
+                logfile.close()
+                logfile = open(log, 'rb')
+                offset = 0
+            if size > offset:
+                logfile.seek(offset)
+                while offset < size:
+                    chunk = logfile.read(min(chimi.runner.LOG_CHUNK_SIZE, size - offset))
+                    if len(chunk) == 0:
+                        break
+                    sys.stdout.write(chunk)
+                    offset += len(chunk)
+                sys.stdout.flush()
+            elif not follow:
+                break
+            else:
+                time.sleep(0.5)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        logfile.close()
+    return 0
 
 def bootstrap(opts, directory):
     directory = os.path.abspath(directory)
@@ -474,6 +688,130 @@ def bootstrap(opts, directory):
         ps.save_flag = True
         ps.save()
 
+def database_import(opts, *args):
+    ps = find_current_package_set()
+    if 'store' in ps.__dict__:
+        raise CommandError('%s is already using an SQLite database.' % ps.directory)
+    if chimi.settings.noact:
+        sys.stderr.write('would import %s into %s\n' % (PackageSet.SET_FILE,
+                                                         chimi.core.SQLiteStore.FILE))
+        return
+    # Fold the journal into "chimi.yaml" first, so the file left behind is
+    # current as of the import.
+    ps.save_flag = True
+    ps.save()
+    chimi.core.SQLiteStore(ps.directory).write(ps)
+
+def database_export(opts, *args):
+    ps = find_current_package_set()
+    if not 'store' in ps.__dict__:
+        raise CommandError('%s is not using an SQLite database.' % ps.directory)
+    if chimi.settings.noact:
+        sys.stderr.write('would export %s to %s\n' % (chimi.core.SQLiteStore.FILE,
+                                                       PackageSet.SET_FILE))
+        return
+    store = ps.store
+    del ps.store
+    ps.journal = chimi.journal.Journal(ps.directory)
+    ps.save_flag = True
+    # The existing snapshot and journal are out of date, so replace them
+    # rather than merging.
+    ps.save(merge=False)
+    if 'remove' in opts:
+        store.connection.close()
+        os.unlink(store.path)
+
+def parse_size(text):
+    """Parse a size in bytes, with an optional K, M, G, or T suffix."""
+    m = re.match(r'^\s*([0-9.]+)\s*([kKmMgGtT]?)i?[bB]?\s*$', text)
+    if not m:
+        raise CommandError('Invalid size: %s' % text)
+    return int(float(m.group(1)) * 1024 ** ' KMGT'.index(m.group(2).upper() or ' '))
+
+def format_size(size):
+    """Format a size in bytes for display."""
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if size < 1024:
+            return ('%d %s' if unit == 'B' else '%.1f %s') % (size, unit)
+        size /= 1024.0
+    return '%.1f TiB' % size
+
+def get_artifact_store():
+    store = chimi.artifacts.ArtifactStore.default()
+    if store == None:
+        raise CommandError('The artifact store is disabled; set CHIMI_ARTIFACT_DIR to enable it.')
+    return store
+
+def cache_list(opts, *args):
+    store = get_artifact_store()
+    entries = store.entries()
+    if len(entries) == 0:
+        sys.stderr.write('The artifact store (%s) is empty.\n' % store.directory)
+        return 0
+
+    t = chimi.util.Table(cols=('Key', 'Package', 'Build', 'Version', 'Size', 'Last used'))
+    for entry in sorted(entries, key=lambda e: (e.get('package'), e.get('name'))):
+        last_used = datetime.datetime.fromtimestamp(entry['last_used'])
+        t.append((entry['key'][:12], entry.get('package'), entry.get('name'), entry.get('commit'),
+                  format_size(entry['size']),
+                  chimi.util.relative_datetime_string(last_used) + ' ago'))
+    print(t.render(use_color=sys.stdout.isatty()))
+    sys.stdout.write('%d entr%s, %s in %s\n' % (len(entries), 'y' if len(entries) == 1 else 'ies',
+                                                  format_size(sum(e['size'] for e in entries)),
+                                                  store.directory))
+    return 0
+
+def cache_gc(opts, *args):
+    store = get_artifact_store()
+    max_age = None
+    if 'max-age' in opts:
+        try:
+            max_age = float(opts['max-age']) * 86400
+        except ValueError:
+            raise CommandError('Invalid age: %s' % opts['max-age'])
+    max_size = parse_size(opts['max-size']) if 'max-size' in opts else None
+
+    if chimi.settings.noact:
+        sys.stderr.write('would remove unused entries from %s\n' % store.directory)
+        return 0
+    removed = store.gc(max_age=max_age, max_size=max_size)
+    for entry in removed:
+        sys.stderr.write('  removed %s (%s %s, %s)\n' % (entry['key'][:12], entry.get('package'),
+                                                        entry.get('name'),
+                                                        format_size(entry['size'])))
+    sys.stderr.write('Removed %d entr%s (%s).\n' % (len(removed), 'y' if len(removed) == 1 else 'ies',
+                                                     format_size(sum(e['size'] for e in removed))))
+    return 0
+
+def cache_export(opts, filename, *keys):
+    store = get_artifact_store()
+    selected = []
+    for prefix in keys:
+        matches = store.find(prefix)
+        if len(matches) == 0:
+            raise CommandError('No artifact-store entry matches `%s\'.' % prefix)
+        elif len(matches) > 1:
+            raise CommandError('More than one artifact-store entry matches `%s\'.' % prefix)
+        selected.extend(matches)
+    if len(keys) == 0:
+        selected = [e['key'] for e in store.entries()]
+
+    if chimi.settings.noact:
+        sys.stderr.write('would export %d entries to %s\n' % (len(selected), filename))
+        return 0
+    store.export(selected, filename)
+    sys.stderr.write('Exported %d entries to %s.\n' % (len(selected), filename))
+    return 0
+
+def cache_import(opts, filename):
+    store = get_artifact_store()
+    if chimi.settings.noact:
+        sys.stderr.write('would import entries from %s into %s\n' % (filename, store.directory))
+        return 0
+    added = store.import_archive(filename)
+    sys.stderr.write('Imported %d new entries into %s.\n' % (len(added), store.directory))
+    return 0
+
 def make_colored_build_status_string(status):
     """Create a color-coded build-status name string."""
     status_color = 'yellow'
@@ -498,8 +836,8 @@ def list_items(opts, directory=None):
         sys.stdout.write("  current branch: %s\n" % pkg.branch)
         sys.stdout.write("  remotes:\n")
         remotes = pkg.remotes
-        max_name_len = max([len(name) for name, url in remotes])
-        for name, url in pkg.remotes:
+        max_name_len = max([len(name) for name, url in remotes] + [0])
+        for name, url in remotes:
             sys.stdout.write("    %%-%ds   %%s\n" % max_name_len % (name, url))
         for build in pkg.builds:
             sys.stdout.write("  build \033[1m%s\033[0m:\n" % build.name)
@@ -609,14 +947,13 @@ def show_builds(opts, *args):
 
     package = 'changa'
     branch = None
+    arch_names = None
 
     if 'package' in opts:
         package = opts['package']
 
-    _builds = ps.packages[package].builds
-
     if 'branch' in opts:
-        _builds = filter(lambda x: x.config.branch == opts['branch'], _builds)
+        branch = opts['branch']
 
     if 'arch' in opts:
         archname = opts['arch']
@@ -634,7 +971,8 @@ def show_builds(opts, *args):
                                 ])
                 return out
             arch_names = gather_names(chimi.core.CharmArchitecture.architectures[archname])
-            _builds = filter(lambda x: x.config.architecture in arch_names, _builds)
+
+    _builds = ps.find_builds(package, branch=branch, architectures=arch_names)
 
     if len(_builds) > 0:
         _builds.sort(cmp=lambda x, y: cmp(x.name,y.name))
@@ -660,6 +998,47 @@ def show_builds(opts, *args):
         sys.stderr.write('No matching builds.\n')
     return 0
 
+def format_seconds(seconds):
+    """Format a duration in seconds, with a decimal place if it's short."""
+    if seconds < 60:
+        return '%.1fs' % seconds
+    return chimi.util.format_duration(int(round(seconds)), -1)
+
+def show_timings(opts, *args):
+    ps = chimi.command.find_current_package_set()
+    if len(args) > 0:
+        _builds = [find_build_by_name(ps, name) for name in args]
+    else:
+        _builds = [b for package_name in ('charm', 'changa')
+                   for b in sorted(ps.packages[package_name].builds,
+                                   cmp=lambda x, y: cmp(x.name, y.name))]
+
+    use_color = sys.stdout.isatty()
+    t = chimi.util.Table(cols=('Build', 'Step', 'Result', 'Wall', 'User', 'System',
+                               'CPU/Wall', 'Peak RSS'))
+    for _build in _builds:
+        for msg in _build.messages:
+            timing = msg.timing
+            if timing == None:
+                continue
+            step = 'configure' if msg.status in (BuildStatus.Configured,
+                                                 BuildStatus.ConfigureFailed) \
+                else 'compile'
+            status = make_colored_build_status_string(msg.status) if use_color \
+                else msg.status.name
+            # Average number of CPUs kept busy; compare with the job count.
+            parallelism = (timing.user + timing.system) / timing.wall if timing.wall else 0
+            t.append((_build.name, step, status, format_seconds(timing.wall),
+                      format_seconds(timing.user), format_seconds(timing.system),
+                      '%.1f' % parallelism, '%d MiB' % (timing.max_rss // 1024)))
+
+    if len(t.rows) > 0:
+        print(t.render(use_color=use_color))
+    else:
+        sys.stderr.write('No timing information recorded for %s.\n' %
+                         ('those builds' if len(args) > 0 else 'any build'))
+    return 0
+
 def show_configure_options(opts, *args):
     which = 'all'
     if len(args) > 0:
@@ -703,15 +1082,24 @@ COMMAND_LIST = [
     # Build.
     Command('build', ['[all|changa|charm]'], 'Build a package.',
             [('Configuration options',
-              Option(None, 'arch', 'Specify Charm++ build architecture.', 'ARCH').store(),
+              Option(None, 'arch', 'Specify Charm++ build architecture(s).', 'ARCH[,ARCH]...').store(),
               Option('b', 'branch', 'Check out BRANCH in the package repository before building.',
                      'BRANCH').store(),
               Option('o', 'options', 'Specify additional Charm++ build "options"',
                      'OPT[,OPT]...').store(multiple=True),
+              Option('V', 'variant', 'Build once for each VARIANT, adding its options to '
+                     'those given with -o (`none\' adds none).',
+                     'OPT[,OPT]...').store(multiple=True),
               Option('I', None, 'specify additional include directories for Charm builds',
                      'DIR').store(multiple=True),
               Option('L', None, 'specify additional library directories for Charm builds',
                      'DIR').store(multiple=True),
+              Option('j', 'jobs', 'Run up to N `make\' jobs at once. [default: from host '
+                     'configuration, or based on available CPUs and memory]', 'N').store(),
+              Option(None, 'no-pipeline', 'Don\'t configure ChaNGa until the Charm++ build it '
+                     'uses is complete.').store(),
+              Option(None, 'no-artifact-cache', 'Neither restore builds from the artifact store '
+                     'nor save them to it.').store(),
               ),
              ('Builds management options',
               Option(None, 'continue', 'Attempt to continue an aborted or failed build').store(),
@@ -727,7 +1115,8 @@ COMMAND_LIST = [
                      '[all|BUILD[,BUILD]...]').store(),
               ),
              ('Misc. options',
-              Option(None, 'force', 'Force build even if arguments to -I or -L don\'t exist.').store(),
+              Option(None, 'force', 'Force build even if arguments to -I or -L don\'t exist, and '
+                     'compile it even if the artifact store holds a matching build.').store(),
               ),
              ],
             """
@@ -739,7 +1128,18 @@ case, the `--arch' option accepts base architectures as well
 (`%s show arch -lt base\'); when a base architecture name is given, an attempt
 is made to automatically determine the appropriate build architecture.
 
-""" % (basename, basename), build),
+The output of each build step is appended to the file "%s" in the build's
+directory; use `%s build log' to view it.
+
+""" % (basename, basename, chimi.build.Build.LOG_FILE, basename), build,
+            subcommands=[
+            Command('log', ['BUILD'], 'Show the log of a build, given by name or UUID.',
+                    [Option('f', 'follow', 'Keep showing output as it is written to the log, '
+                            'until interrupted.').store(),
+                     Option('n', 'lines', 'Show only the last N lines of the log. '
+                            '[default: all, or 10 with --follow]', 'N').store()],
+                    None, callback=build_log),
+            ], callback_is_default=True),
     # Job
     Command('job', ['CMD', '[ARG]...'], 'Manage job(s) on local or remote nodes.',
             [Option('H', 'host', 'Manipulate jobs on remote HOST via SSH [default: local]',
@@ -797,6 +1197,53 @@ http://saga-project.github.io/saga-python/doc/adaptors/saga.adaptor.index.html
             Command('list', [], 'List jobs.',
                     [], None, chimi.job._list),
             ]),
+    # Database
+    Command('db', ['CMD'], 'Manage the storage backend for the Chimi database.',
+            [], None,
+            subcommands=[
+            Command('import', [], 'Move the database into an indexed SQLite file.',
+                    [],
+                    """
+By default Chimi keeps its database in "chimi.yaml", which must be read in full
+by every command.  This command copies the database into "%s", which Chimi
+will use instead from then on; lookups of builds by name, UUID, branch,
+architecture, or configuration then use the file's indexes.
+""" % chimi.core.SQLiteStore.FILE,
+                    callback=database_import),
+            Command('export', [], 'Write the SQLite database back to "%s".' % PackageSet.SET_FILE,
+                    [Option(None, 'remove', 'Remove the SQLite file afterwards, '
+                            'switching back to the YAML database.').store()],
+                    None, callback=database_export),
+            ]),
+    # Artifact store
+    Command('cache', ['CMD'], 'Manage the store of packed build products.',
+            [], """
+When a Charm++ or ChaNGa build completes from committed sources, Chimi packs its
+products (Charm++'s "bin", "include", and "lib" directories, or the ChaNGa and
+charmrun executables) into the artifact store, keyed by the package, build
+configuration, host, and source commits.  Later builds with the same key -- in
+any workspace -- are unpacked from the store instead of compiled.
+
+The store is off unless CHIMI_ARTIFACT_DIR names its directory (e.g. one on a
+filesystem shared with other users or hosts).
+""",
+            subcommands=[
+            Command('ls', [], 'List the entries in the artifact store.',
+                    [], None, callback=cache_list),
+            Command('gc', [], 'Remove old entries from the artifact store.',
+                    [Option(None, 'max-age', 'Remove entries not used in the last DAYS days.',
+                            'DAYS').store(),
+                     Option(None, 'max-size', 'Then remove the least recently used entries '
+                            'until the store is no larger than SIZE (e.g. "20G").',
+                            'SIZE').store()],
+                    None, callback=cache_gc),
+            Command('export', ['FILE', '[KEY]...'],
+                    'Write entries (default: all) to FILE, for importing elsewhere.',
+                    [], None, callback=cache_export),
+            Command('import', ['FILE'], 'Add the entries in FILE (written by `export\') '
+                    'to the artifact store.',
+                    [], None, callback=cache_import),
+            ]),
     # Status
     Command('status', [], 'List recorded build/package information.',
             [Option('r', 'reltime', 'Use relative time stamps').store() ],
@@ -843,6 +1290,15 @@ The `--type' option accepts several values, which are explained here.
                      Option('a', 'arch', 'Filter by architecture ARCH and descendents.',
                             'ARCH').store(),
                      ], None, callback=show_builds),
+            Command('timings', ['[BUILD]...'], 'Show the time and resources used by '
+                    'each step of the named builds (default: all builds).',
+                    [],
+                    """
+For each configure and compile step, this shows the elapsed time, the CPU time
+used by the step's commands, their average parallelism (CPU time divided by
+elapsed time), and the peak memory use of the largest of those processes.
+Builds may be given by name or UUID.
+""", callback=show_timings),
             Command('options', ['[all|changa|charm]'], 'List available `configure\' options for package(s) [default `all\'].',
                     [],
                     """
@@ -865,11 +1321,14 @@ i.e. *not* using "--enable" or "--with"-style command arguments.
 
 def common(opts, *args):
     chimi.settings.noact = opts['noact'] if 'noact' in opts else False
+    chimi.settings.verify_builds = not ('no-verify' in opts and opts['no-verify'])
 
 chimi_command = Command(basename, ['COMMAND', '[ARGUMENT]...'],
                         'Perform boring ChaNGa-related tasks.',
                         [Option('h', 'help', 'Show this help.').handle(lambda *x: show_help(sys.stdout, True, 0)),
                          Option('n', 'noact', 'Don\'t actually change anything or run any commands.').store(),
+                         Option(None, 'no-verify', 'Don\'t check recorded builds against the filesystem '
+                                'and repositories (faster for read-only commands).').store(),
                          ],
                         None,
                         callback=common,
@@ -888,11 +1347,12 @@ def main():
         return chimi_command.call({}, args=args)
     except CommandError as err:
         sys.stderr.write(str(err)+"\n")
-        sys.stderr.write('Try `%s help%s\' for more information.\n'%\
-                             (chimi_command.name,
-                              ' ' + ' '.join(err.command.full_name_list[1:]) \
-                                  if len(args) > 0 \
-                                  else ''))
+        if 'command' in err.__dict__:
+            sys.stderr.write('Try `%s help%s\' for more information.\n'%\
+                                 (chimi_command.name,
+                                  ' ' + ' '.join(err.command.full_name_list[1:]) \
+                                      if len(args) > 0 \
+                                      else ''))
     except chimi.build.InvalidArchitectureError as err:
         sys.stderr.write(str(err)+"\n")
         sys.stderr.write('Run `%s show arch -l\' for a list of valid architecture names.\n'%\
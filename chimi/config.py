@@ -32,6 +32,13 @@ import chimi.util
 DEFAULT_COMMS_TYPE='net'
 """Default Charm++ communications transport to use"""
 
+MAKE_JOB_MEMORY = 1024 * 1024 * 1024
+"""
+Memory (in bytes) to allow for each parallel `make` job when choosing a job
+count automatically.
+
+"""
+
 def guess_architecture(base_arch=DEFAULT_COMMS_TYPE):
     """Get the likely Charm++ platform/architecture for the current host"""
     osname, hostname, discard, discard, machname = os.uname()
@@ -120,8 +127,20 @@ class HostBuildConfig(object):
 
     """
     def __init__(self, arch=None, components=None):
+        self.make_jobs = None
+        self.max_make_jobs = None
         if isinstance(arch, dict) and components == None:
             d = arch
+            make_dict_keys_snake_case_recursive(d)
+
+            # Default number of parallel `make` jobs, or 'auto'.
+            if 'make_jobs' in d:
+                self.make_jobs = d['make_jobs']
+
+            # Upper limit on parallel `make` jobs, e.g. to respect login-node
+            # usage policies.
+            if 'max_make_jobs' in d:
+                self.max_make_jobs = d['max_make_jobs']
 
             if 'default_architecture' in d:
                 self.default_architecture = d['default_architecture']
@@ -191,6 +210,31 @@ class HostBuildConfig(object):
                         build_config.extras.extend(opt.apply_extras)
         build_config.components.sort()
 
+    def get_make_jobs(self, requested=None):
+        """
+        Choose the number of parallel `make` jobs to use for a build.
+
+        requested: job count given by the user, if any.  Otherwise the host's
+            "make-jobs" value is used, or -- if that is unset or "auto" -- the
+            number of usable CPUs, limited so that each job has at least
+            `MAKE_JOB_MEMORY` bytes of free memory.
+
+        In all cases the count is capped by the host's "max-make-jobs" value.
+
+        """
+        if requested:
+            jobs = int(requested)
+        elif self.make_jobs and self.make_jobs != 'auto':
+            jobs = int(self.make_jobs)
+        else:
+            jobs = chimi.util.cpu_count()
+            memory = chimi.util.available_memory()
+            if memory != None:
+                jobs = min(jobs, memory // MAKE_JOB_MEMORY)
+        if self.max_make_jobs:
+            jobs = min(jobs, int(self.max_make_jobs))
+        return max(1, jobs)
+
     def __str__(self):
         return str(self.__dict__)
 
@@ -260,6 +304,10 @@ class HostConfig(object):
 
     module_system: name of the module system in use on the host, if any.
 
+    fetch: dict mapping package names ("charm", "changa", "utility") to dicts
+        of clone-mode overrides ("depth", "filter", "sparse") for `chimi
+        fetch`; see `chimi.settings.DefaultRepository`.
+
     """
 
     def __init__(self, d=None, aliases=None, build=None, jobs=None):
@@ -288,6 +336,11 @@ class HostConfig(object):
                 self.module_system = d['module_system']
             else:
                 self.module_system = None
+
+            if 'fetch' in d:
+                self.fetch = d['fetch']
+            else:
+                self.fetch = {}
         else:
             hostname = d
             if hostname:
@@ -309,6 +362,8 @@ class HostConfig(object):
                 self.jobs = jobs
             else:
                 self.jobs = HostJobConfig()
+
+            self.fetch = {}
         
     @property
     def matches_current_host(self):
@@ -26,8 +26,13 @@ import sys
 import uuid
 import time
 import copy
+import json
 import shlex
 import shutil
+import hashlib
+import tarfile
+import tempfile
+import urllib
 import datetime
 import textwrap
 import threading
@@ -35,10 +40,18 @@ import subprocess
 
 import chimi
 import chimi.util
+import chimi.cache
+import chimi.autoconf
+import chimi.config
+import chimi.runner
+import chimi.artifacts
+import chimi.journal
+import chimi.repository
 import chimi.settings
 import chimi.transient
 from chimi.build import Build
 from chimi.build import BuildStatus
+from chimi.build import BuildMessage
 from chimi.build import BuildConfig
 from chimi.util import check_call
 
@@ -57,6 +70,27 @@ def get_cuda_dir():
                 return name
         return None
 
+def make_command(args, jobs=None):
+    """
+    Add a parallel-jobs flag to a `make` (or Charm++ `build`) invocation when
+    `jobs` is given.
+
+    """
+    if jobs != None:
+        return args + ['-j%d' % jobs]
+    return args
+
+def step_timing(result):
+    """
+    Get a StepTiming for a build step from the `chimi.runner.Result` of its
+    command, or None if the command's resource usage is unknown.
+
+    """
+    if result == None or result.rusage == None:
+        return None
+    return chimi.build.StepTiming(result.elapsed, result.rusage.ru_utime,
+                                  result.rusage.ru_stime, result.rusage.ru_maxrss)
+
 def build_configure_flags(definition, config):
     """Construct `configure` flags from the given build config."""
     bool_mapping = { 'yes': True, 'on': True,
@@ -154,17 +188,51 @@ class PackageDefinition(object):
         """Get the path to the instance's `configure' script, if it has one."""
         pass
 
+    CONFIGURE_OPTIONS_CACHE = 'configure-options-%s.pickle'
+    """
+    Pattern for the name of the cache file holding a package's parsed
+    `configure' options; see `chimi.cache`.
+
+    """
+
+    _configure_options = {}
+    """In-process cache of parsed `configure' options, by script hash."""
+
     @classmethod
     def get_configure_options(self, instance):
         """
         Get the package and feature options available for a package instance's
-        `configure' script.
+        `configure' script.  Since running the script is slow, results are
+        cached in the workspace's "chimi-tmp" directory and in memory, keyed on
+        the script's contents.
+
+        return: dict
+
+        """
+        script = self.get_configure_path(instance)
+        digest = hashlib.sha1(file(script, 'rb').read()).hexdigest()
+        if digest in PackageDefinition._configure_options:
+            return PackageDefinition._configure_options[digest]
+
+        cache_file = chimi.cache.path(instance.package_set.directory,
+                                      PackageDefinition.CONFIGURE_OPTIONS_CACHE % self.__name__)
+        opts = chimi.cache.load(cache_file, digest)
+        if opts is None:
+            opts = self.read_configure_options(script)
+            chimi.cache.store(cache_file, digest, opts)
+        PackageDefinition._configure_options[digest] = opts
+        return opts
+
+    @classmethod
+    def read_configure_options(self, script):
+        """
+        Run a `configure' script with `--help`, and parse the package and
+        feature options listed in its output.
 
         return: dict
 
         """
         with chimi.transient.message('(Loading %s configure options ... ' % self.name, ')'):
-            script = self.get_configure_path(instance)
             script_help = subprocess.check_output([script, '--help'])
             lre = re.compile(r'^((\s*)--(enable|disable|with|without)-([^\s\[=]+)([=\[]?[^\s]*)\s*)(.*)$')
             lines = script_help.split('\n')
@@ -228,23 +296,275 @@ class PackageDefinition(object):
         """Get the directory in which a build's files should go"""
         pass
 
+    @classmethod
+    def get_source_fingerprint(self, package, _build, exclude=()):
+        """
+        Get a fingerprint of the sources from which `_build` is compiled,
+        recorded when the build completes so that later rebuilds can be
+        skipped if nothing has changed.  The fingerprint maps the names of the
+        build's inputs to their states; here the only input is the package's
+        source tree (see `Package.get_source_state`), less any build
+        directories within it and the paths in `exclude`.
+
+        """
+        srcdir = package.get_source_directory(_build.config.branch)
+        exclude = set(exclude)
+        for b in package.builds + [_build]:
+            path = os.path.relpath(b.directory, srcdir)
+            if not path.startswith(os.pardir):
+                exclude.add(path)
+        return { package.package_set.package_name(package):
+                     package.get_source_state(_build.config.branch, sorted(exclude)) }
+
+    @classmethod
+    def check_sources(self, package, _build, fingerprint):
+        """
+        Compare a source fingerprint with the one recorded when `_build` last
+        completed.  If they differ, the changes are listed in the build's log.
+
+        return: True if the sources are unchanged.
+
+        """
+        old = _build.source_fingerprint
+        if old == None:
+            return False
+        elif old == fingerprint:
+            return True
+
+        ps = package.package_set
+        changes = []
+        for name in sorted(set(old) | set(fingerprint)):
+            if old.get(name) == fingerprint.get(name):
+                continue
+            elif name in ps.packages and old.get(name) and fingerprint.get(name):
+                changes.extend('%s: %s' % (name, c)
+                               for c in ps.packages[name].describe_source_changes(old[name],
+                                                                                  fingerprint[name]))
+            else:
+                changes.append('%s: changed' % name)
+        if len(changes) == 0:
+            # e.g. a new commit that changes no files.
+            return True
+
+        sys.stderr.write('%d source change%s since the last build (listed in %s).\n' %
+                         (len(changes), '' if len(changes) == 1 else 's', _build.log_file))
+        if not chimi.settings.noact:
+            with open(_build.log_file, 'a') as log:
+                log.write('### %s: sources changed since the last build:\n' % time.ctime())
+                for change in changes:
+                    log.write('###   %s\n' % change)
+        return False
+
+    ARTIFACT_PATHS = ()
+    """
+    Paths, relative to a build directory, of the build products kept in the
+    artifact store (see `chimi.artifacts`).
+
+    """
+
+    @classmethod
+    def get_artifact_key(self, package, _build, fingerprint=None):
+        """
+        Get the key under which the products of `_build` are kept in the
+        artifact store: a hash of the package, the build configuration
+        (excluding its branch name), the host, the compilers used (see
+        `get_compiler_identity`), and the source commits in `fingerprint` (by
+        default, the build's current source fingerprint).  Returns None if any
+        of the sources have uncommitted changes, since such builds can't be
+        identified by their commits.
+
+        """
+        if fingerprint == None:
+            fingerprint = self.get_source_fingerprint(package, _build)
+        inputs = {}
+        for name, state in fingerprint.items():
+            if isinstance(state, dict) and 'changes' in state:
+                if len(state['changes']) > 0:
+                    return None
+                inputs[name] = state['commit']
+            else:
+                inputs[name] = state
+        host = chimi.config.HostConfig.load()
+        return hashlib.sha1(json.dumps([self.name,
+                                        BuildConfig.fingerprint_record(self.name,
+                                                                       _build.config.to_record(),
+                                                                       branch=False),
+                                        host.hostname if host != None else None,
+                                        self.get_compiler_identity(package, _build),
+                                        inputs], sort_keys=True)).hexdigest()
+
+    @classmethod
+    def get_compiler_identity(self, package, _build):
+        """
+        Describe the compilers (and MPI installation) with which `_build` is
+        compiled, as for `chimi.autoconf.ConfigureCache.compiler_identity`.
+
+        """
+        return None
+
     def __init__(self, name, repo):
         self.name = name
         self.repository = repo
 
     @classmethod
-    def fetch(self, package):
-        """Fetch or update sources for the given package instance."""
+    def get_fetch_options(self, overrides=None):
+        """
+        Get the clone mode -- a dict with keys "depth", "filter", and "sparse"
+        -- for new clones of the package, applying any `overrides` (e.g. from
+        a host configuration file) to the repository defaults.
+
+        """
+        options = dict((key, self.repository.get(key)) for key in ('depth', 'filter', 'sparse'))
+        if overrides:
+            options.update((key, overrides[key]) for key in options if key in overrides)
+        return options
+
+    @classmethod
+    def get_mirror_path(self):
+        """
+        Get the path of the shared local mirror of the package's repository,
+        or None if mirroring is disabled.
+
+        """
+        if not chimi.settings.mirror_directory:
+            return None
+        # Forks of a repository usually share its name, so the name is
+        # qualified with a hash of the whole URL.
+        url = self.repository.url
+        name = re.sub(r'(?:\.git)?/*$', '', url).rpartition('/')[2]
+        return os.path.join(chimi.settings.mirror_directory,
+                            '%s-%s.git' % (name, hashlib.sha1(url).hexdigest()[:12]))
+
+    @classmethod
+    def update_mirror(self, options=None, out=None, err=None):
+        """
+        Create or refresh the shared local mirror of the package's repository.
+        The mirror is locked while it's updated, since other workspaces may be
+        fetching into it at the same time.
+
+        return: exit status of the Git command, or None if mirroring is
+            disabled.
+
+        """
+        mirror = self.get_mirror_path()
+        if mirror == None:
+            return None
+
+        if chimi.settings.noact:
+            lock = None
+        else:
+            mirror_dir = os.path.dirname(mirror)
+            if not os.path.isdir(mirror_dir):
+                try:
+                    os.makedirs(mirror_dir)
+                except OSError:
+                    if not os.path.isdir(mirror_dir):
+                        raise
+            lock = chimi.util.FileLock(mirror + '.lock')
+            lock.acquire()
+        try:
+            if not os.path.exists(mirror):
+                # The mirror is cloned in the same mode as the workspaces, so
+                # that it doesn't undo their quota savings.
+                options = self.get_fetch_options(options)
+                clone_args = ['git', 'clone', '--mirror']
+                if options['depth']:
+                    clone_args.append('--depth=%d' % int(options['depth']))
+                if options['filter']:
+                    clone_args.append('--filter=%s' % options['filter'])
+                status = check_call(clone_args + [self.repository.url, mirror],
+                                    cwd=os.path.dirname(mirror), out=out, err=err)
+                if status == 0:
+                    # Let shallow and partial clones be made from the mirror.
+                    for key in ('uploadpack.allowFilter', 'uploadpack.allowAnySHA1InWant'):
+                        check_call(['git', 'config', key, 'true'], cwd=mirror, out=out, err=err)
+                return status
+            else:
+                return check_call(['git', 'fetch', '--prune', 'origin'],
+                                  cwd=mirror, out=out, err=err)
+        finally:
+            if lock != None:
+                lock.release()
+
+    @classmethod
+    def deepen_mirror(self, refspec_args):
+        """
+        Fetch missing history into a shallow mirror (see `Package.deepen`).
+
+        refspec_args: arguments to `git fetch` following the remote name's
+            position, e.g. `['--deepen=256', 'origin']`.
+
+        return: exit status of `git fetch`, or None if there is no mirror
+            or it isn't shallow.
+
+        """
+        mirror = self.get_mirror_path()
+        if mirror == None or not os.path.exists(os.path.join(mirror, 'shallow')):
+            return None
+        with chimi.util.FileLock(mirror + '.lock'):
+            with open(os.devnull, 'w') as null:
+                return check_call(['git', 'fetch'] + refspec_args, cwd=mirror, out=null, err=null)
+
+    @classmethod
+    def fetch(self, package, out=None, err=None, options=None):
+        """
+        Fetch or update sources for the given package instance.  Output from
+        Git is written to the files `out` and `err`, if given.
+
+        If mirroring is enabled, the shared mirror of the repository (see
+        `update_mirror`) is refreshed first, and new clones are made from it:
+        the mirror becomes their "origin" remote, so later updates come from
+        local disk, and the repository's real URL is added as the "upstream"
+        remote.  A failure to update the mirror is not fatal.
+
+        options: clone-mode overrides; see `get_fetch_options`.
+
+        return: exit status of the Git command
+
+        """
         srcdir = package.directory
+        self.update_mirror(options, out=out, err=err)
+        mirror = self.get_mirror_path()
 
         if not os.path.exists(srcdir):
             parent_dir = os.path.dirname(srcdir)
             if not os.path.exists(parent_dir) and not chimi.settings.noact:
-                os.makedirs(parent_dir)
-            check_call(['git', 'clone', '-b', self.repository.branch, self.repository.url, srcdir],
-                       cwd=parent_dir)
+                try:
+                    os.makedirs(parent_dir)
+                except OSError:
+                    # Created concurrently by another fetch.
+                    if not os.path.isdir(parent_dir):
+                        raise
+            options = self.get_fetch_options(options)
+            clone_args = ['git', 'clone', '-b', self.repository.branch]
+            if options['depth']:
+                clone_args.append('--depth=%d' % int(options['depth']))
+            if options['filter']:
+                clone_args.append('--filter=%s' % options['filter'])
+            if options['sparse']:
+                clone_args.append('--sparse')
+            use_mirror = mirror != None and (os.path.isdir(mirror) or chimi.settings.noact)
+            # A file:// URL makes Git honour --depth and --filter for a local
+            # source.
+            source = 'file://' + os.path.abspath(mirror) if use_mirror else self.repository.url
+            status = check_call(clone_args + [source, srcdir],
+                                cwd=parent_dir, out=out, err=err)
+            if status == 0 and use_mirror:
+                status = check_call(['git', 'remote', 'add', 'upstream', self.repository.url],
+                                    cwd=srcdir, out=out, err=err)
+                if status == 0 and options['filter']:
+                    # Objects a partial mirror lacks can be fetched from
+                    # upstream on demand.
+                    for key, value in (('remote.upstream.promisor', 'true'),
+                                       ('remote.upstream.partialclonefilter', options['filter'])):
+                        check_call(['git', 'config', key, value], cwd=srcdir, out=out, err=err)
+            if status == 0 and options['sparse']:
+                status = check_call(['git', 'sparse-checkout', 'set'] + list(options['sparse']),
+                                    cwd=srcdir, out=out, err=err)
+            return status
         else:
-            check_call(['git', 'pull', '--ff-only', 'origin'], cwd=srcdir)
+            return check_call(['git', 'pull', '--ff-only', 'origin'], cwd=srcdir,
+                              out=out, err=err)
 
 
 class ChaNGaDefinition(PackageDefinition):
@@ -252,6 +572,8 @@ class ChaNGaDefinition(PackageDefinition):
     name = 'ChaNGa'
     repository = chimi.settings.DEFAULT_REPOSITORIES['changa']
 
+    ARTIFACT_PATHS = ('ChaNGa', 'charmrun')
+
     @classmethod
     def get_configure_path(self, instance):
         return os.path.join(instance.directory, 'configure')
@@ -287,7 +609,74 @@ class ChaNGaDefinition(PackageDefinition):
             return []
 
     @classmethod
-    def build(self, package, config, _continue=False, replace=False, force=False):
+    def get_charm_config(self, package, config):
+        """
+        Create the configuration of the Charm++ build on which a ChaNGa build
+        with configuration `config` should be based.
+
+        """
+        charm = package.package_set['charm']
+        return chimi.build.BuildConfig.create(charm, opts=config.source_opts,
+                                              extras=config.extras,
+                                              branch=config.branch if config.branch in charm.branches else charm.branch,
+                                              ignore_unknown_options=True)
+
+    @classmethod
+    def get_source_fingerprint(self, package, _build, exclude=()):
+        """
+        Get a fingerprint of the sources from which a ChaNGa build is compiled.
+        Besides ChaNGa's own sources, these include those of the `utility`
+        package and the Charm++ build used.
+
+        """
+        fingerprint = super(ChaNGaDefinition, self).get_source_fingerprint(package, _build,
+                                                                           list(exclude) + ['builds'])
+        ps = package.package_set
+        utility = ps.packages['utility'] if 'utility' in ps.packages else None
+        if utility != None and os.path.isdir(utility.directory):
+            fingerprint['utility'] = utility.get_source_state()
+
+        charm_build = ps.packages['charm'].find_build(self.get_charm_config(package, _build.config))
+        if charm_build != None:
+            completed = [m.time for m in charm_build.messages if m.status == BuildStatus.Complete]
+            fingerprint['charm build'] = { 'uuid': str(charm_build.uuid),
+                                           'completed': max(completed) if completed else None }
+        return fingerprint
+
+    @classmethod
+    def get_artifact_key(self, package, _build, fingerprint=None):
+        """
+        Get the artifact-store key for a ChaNGa build.  The Charm++ build used
+        is identified by its own artifact key rather than by its (workspace-
+        specific) UUID, so the key is None if that build has none.
+
+        """
+        if fingerprint == None:
+            fingerprint = self.get_source_fingerprint(package, _build)
+        charm = package.package_set.packages['charm']
+        charm_build = charm.find_build(self.get_charm_config(package, _build.config))
+        if charm_build == None or charm_build.source_fingerprint == None:
+            return None
+        charm_key = CharmDefinition.get_artifact_key(charm, charm_build,
+                                                     charm_build.source_fingerprint)
+        if charm_key == None:
+            return None
+        fingerprint = dict(fingerprint)
+        fingerprint['charm build'] = charm_key
+        return super(ChaNGaDefinition, self).get_artifact_key(package, _build, fingerprint)
+
+    @classmethod
+    def get_compiler_identity(self, package, _build):
+        """Identify the compilers used through the Charm++ build."""
+        charm = package.package_set.packages['charm']
+        charm_build = charm.find_build(self.get_charm_config(package, _build.config))
+        if charm_build == None:
+            return None
+        return chimi.autoconf.ConfigureCache.compiler_identity(charm_build.directory)
+
+    @classmethod
+    def build(self, package, config, _continue=False, replace=False, force=False,
+              jobs=None):
         srcdir = package.directory
         builds_dir = os.path.join(srcdir, 'builds')
         if not os.path.exists(builds_dir) and not chimi.settings.noact:
@@ -295,16 +684,13 @@ class ChaNGaDefinition(PackageDefinition):
 
         # Find a matching Charm++ build.
         charm = package.package_set['charm']
-        charm_config = chimi.build.BuildConfig.create(charm, opts=config.source_opts,
-                                                      extras=config.extras,
-                                                      branch=config.branch if config.branch in charm.branches else charm.branch,
-                                                      ignore_unknown_options=True)
+        charm_config = self.get_charm_config(package, config)
         charm_build = charm.find_build(charm_config)
 
         if charm_build == None:
             sys.stderr.write("No matching Charm++ build found -- building now.\n")
             assert(charm_config.branch in charm.branches)
-            charm_build = charm.build(charm_config)
+            charm_build = charm.build(charm_config, jobs=jobs)
 
             if charm_build.status.failure:
                 sys.stderr.write("\033[1;31mCharm build failed:\033[0m ChaNGa build aborted.\n")
@@ -312,7 +698,18 @@ class ChaNGaDefinition(PackageDefinition):
             else:
                 if not charm.have_build(charm_build):
                     charm.add_build(charm_build, replace=replace)
-                package.package_set.save_flag = True
+        elif charm.is_building(charm_build.config):
+            # The Charm++ build is being compiled in another thread (see
+            # `chimi.scheduler`); configure alongside it, and wait for it to
+            # finish before compiling.
+            sys.stderr.write('Configuring while Charm++ build "%s" finishes.\n' % charm_build.name)
+
+        # ChaNGa's `configure` looks for `utility` next to the source tree.
+        utility_dir = os.path.join(os.path.dirname(package.get_source_directory(config.branch)),
+                                   'utility')
+        if not os.path.isdir(utility_dir) and not chimi.settings.noact:
+            raise ValueError('`utility\' sources not found at %s; fetch them before building ChaNGa.'
+                             % os.path.realpath(utility_dir))
 
         assert(config.branch != None)
         _build = None
@@ -332,37 +729,82 @@ class ChaNGaDefinition(PackageDefinition):
         build_dir = _build.directory
 
         if (not _continue) or not _build.configured:
-            # Build and run a `configure` invocation
-            configure_invocation = ['../../configure']
-            if not 'CHARMC' in os.environ.keys():
+            # Build and run a `configure` invocation, using the source tree
+            # for the build's branch.
+            configure_invocation = [os.path.relpath(os.path.join(package.get_source_directory(config.branch),
+                                                                 'configure'),
+                                                    build_dir)]
+            charmc = os.environ.get('CHARMC')
+            if charmc == None:
                 charmc = os.path.join(charm_build.directory, 'bin/charmc')
                 configure_invocation.append('CHARMC=%s' % charmc)
 
-            configure_invocation.extend(build_configure_flags(self, config))
-
-            _build.update(BuildStatus.Configure, ' '.join(configure_invocation))
+            flags = build_configure_flags(self, config)
+            configure_invocation.extend(flags)
+
+            # Reuse the results of `configure`'s tests from earlier builds
+            # with the same compilers, Charm++ build, and options.
+            cache = chimi.autoconf.ConfigureCache.default()
+            cache_key = None
+            if cache != None and not chimi.settings.noact:
+                host = chimi.config.HostConfig.load()
+                cache_key = cache.get_key(charmc, charm_build.directory, flags,
+                                          host.hostname if host != None else None)
+                configure_invocation.append('--cache-file=%s' % cache.checkout(cache_key, build_dir))
+
+            log = _build.log_file
+            _build.update(BuildStatus.Configure, ' '.join(configure_invocation), log=log)
             try:
-                check_call(configure_invocation, cwd=build_dir)
-            except subprocess.CalledProcessError:
-                _build.update(BuildStatus.ConfigureFailed)
+                result = chimi.runner.run(configure_invocation, cwd=build_dir, log=log,
+                                          echo=chimi.settings.echo_build_output)
+            except subprocess.CalledProcessError as err:
+                # Don't let a bad cached result break later builds too.
+                if cache_key != None:
+                    cache.discard(cache_key)
+                _build.update(BuildStatus.ConfigureFailed, log=log,
+                              timing=step_timing(getattr(err, 'result', None)))
             except KeyboardInterrupt:
-                _build.update(BuildStatus.InterruptedByUser)
+                _build.update(BuildStatus.InterruptedByUser, log=log)
             else:
-                _build.update(BuildStatus.Configured)
+                if cache_key != None:
+                    cache.publish(cache_key, build_dir)
+                _build.update(BuildStatus.Configured, log=log, timing=step_timing(result))
                 assert(_build.status == BuildStatus.Configured)
                 assert(_build.configured == True)
 
-        # Compile
+        # Compile, unless continuing a complete build whose sources haven't
+        # changed.
         if _build.configured:
-            _build.update(BuildStatus.Compile)
+            if charm.is_building(charm_build.config):
+                sys.stderr.write('Waiting for Charm++ build "%s".\n' % charm_build.name)
+                charm.wait_for_build(charm_build.config)
+            if not charm_build.compiled and not chimi.settings.noact:
+                _build.update(BuildStatus.CompileFailed,
+                              'Charm++ build "%s" did not complete.' % charm_build.name)
+                return _build
+
+            fingerprint = None
+            if not chimi.settings.noact:
+                fingerprint = self.get_source_fingerprint(package, _build)
+                if _continue and _build.compiled and \
+                        self.check_sources(package, _build, fingerprint):
+                    sys.stderr.write('Sources unchanged since "%s" was built; skipping make.\n'
+                                     % _build.name)
+                    return _build
+
+            log = _build.log_file
+            _build.update(BuildStatus.Compile, log=log)
             try:
-                check_call(['make'], cwd=_build.directory)
-            except subprocess.CalledProcessError:
-                _build.update(BuildStatus.CompileFailed)
+                result = chimi.runner.run(make_command(['make'], jobs), cwd=_build.directory,
+                                          log=log, echo=chimi.settings.echo_build_output)
+            except subprocess.CalledProcessError as err:
+                _build.update(BuildStatus.CompileFailed, log=log,
+                              timing=step_timing(getattr(err, 'result', None)))
             except KeyboardInterrupt:
-                _build.update(BuildStatus.InterruptedByUser)
+                _build.update(BuildStatus.InterruptedByUser, log=log)
             else:
-                _build.update(BuildStatus.Complete, 'ChaNGa build complete.')
+                _build.update(BuildStatus.Complete, 'ChaNGa build complete.', log=log,
+                              timing=step_timing(result), sources=fingerprint)
                 assert(_build.status == BuildStatus.Complete)
                 assert(_build.compiled == True)
 
@@ -372,6 +814,27 @@ class CharmArchitecture(object):
     """Stores metadata for a Charm++ build architecture"""
     architectures = {}
 
+    CACHE = 'charm-architectures.pickle'
+    """
+    Name of the cache file holding the architecture data loaded from the
+    Charm++ source tree; see `chimi.cache`.
+
+    """
+
+    INHERITED_PROPERTIES = ('_options', '_compilers', '_fortran_compilers')
+    """Properties whose values are inherited from an architecture's parent."""
+
+    NON_ARCHITECTURE_NAMES = frozenset(['shmem', 'mpi', 'sim', 'net', 'multicore', 'util',
+                                        'common', 'uth', 'conv-mach-fix.sh', 'win32',
+                                        'win64', 'paragon', 'lapi', 'cell', 'gemini_gni',
+                                        'pami', 'template', 'cuda'])
+    """
+    Entries in Charm++'s "src/arch" directory that are not build architectures,
+    as listed in Charm++'s `build` script.  Entries whose names start with
+    "CVS" are skipped as well.
+
+    """
+
     def __init__(self, parent, name,
                  options=None, compilers=None, fortran_compilers=None,
                  is_base=False):
@@ -394,39 +857,39 @@ class CharmArchitecture(object):
 
         self.is_base = is_base
 
+        # An architecture's ancestors don't change once it's been created, so
+        # we compute its inherited values up-front instead of walking up the
+        # parent chain each time they're needed.
+        self._inherited = {}
+        for propname in CharmArchitecture.INHERITED_PROPERTIES:
+            own = tuple(getattr(self, propname) or ())
+            self._inherited[propname] = own + (parent._inherited[propname] if parent else ())
+
+        # Names of all options, compilers, and Fortran compilers available for
+        # the architecture, including inherited ones.
+        self.inherited_options = frozenset(self._inherited['_options'])
+        self.inherited_compilers = frozenset(self._inherited['_compilers'])
+        self.inherited_fortran_compilers = frozenset(self._inherited['_fortran_compilers'])
+
+    def __getstate__(self):
+        # `children` refers back to this object through each child's `parent`;
+        # serializing it produces recursive nodes that PyYAML cannot construct.
+        # Only the inheritance chain is needed to use a stored architecture.
+        state = dict(self.__dict__)
+        state['children'] = []
+        return state
+
     def merge_property_with_inherited(self, propnames):
         """
         Get all values for a property as specified in both the current object
         and all ancestors.  If a sequence is passed for `propnames`, a list of
         the results for each specified property name will be returned instead.
-        Using a this method with a sequence of property names should be more
-        efficient than calling the method once for each property name.
 
         """
         if isinstance(propnames, str):
-            propname = propnames
-            out = []
-            ref = self
-            while ref:
-                if hasattr(ref, propname):
-                    rprop = getattr(ref, propname)
-                    if isinstance(rprop, list):
-                        out.extend(rprop)
-                ref = ref.parent
-            return out
+            return list(self._inherited[propnames])
         else:
-            _range = range(len(propnames))
-            out = [[] for i in _range]
-
-            ref = self
-            while ref:
-                for i in _range:
-                    if hasattr(ref, propnames[i]):
-                        rprop = getattr(ref, propnames[i])
-                        if isinstance(rprop, list):
-                            out[i].extend(rprop)
-                ref = ref.parent
-            return out
+            return [list(self._inherited[propname]) for propname in propnames]
 
     @property
     def base(self):
@@ -446,42 +909,44 @@ class CharmArchitecture(object):
         Convenience method for fetching all options, compilers, and fortran
         compilers that may be specified for this architecture.
 
+        return: frozenset
+
         """
-        allprops = self.merge_property_with_inherited(('_options', '_compilers', '_fortran_compilers'))
-        out = allprops[0]
-        for lst in allprops[1:]:
-            out.extend(lst)
-        return out
+        return self.inherited_options | self.inherited_compilers | \
+            self.inherited_fortran_compilers
 
     @property
     def options(self):
-        o = self.merge_property_with_inherited('_options')
-        o.sort()
-        return o
+        return sorted(self.inherited_options)
 
     @property
     def compilers(self):
-        o = self.merge_property_with_inherited('_compilers')
-        o.sort()
-        return o
+        return sorted(self.inherited_compilers)
 
     @property
     def fortran_compilers(self):
-        o = self.merge_property_with_inherited('_fortran_compilers')
-        o.sort()
-        return o
+        return sorted(self.inherited_fortran_compilers)
 
     def has_option(self, optname):
-        if optname in self.options:
-            return True
-        elif self.parent:
-            return self.parent.has_option(optname)
-        else:
-            return False
+        return optname in self.inherited_options
 
     def __str__(self):
         return self.name
 
+    def __eq__(self, other):
+        # Build configurations loaded from the database name their
+        # architecture instead of referencing a CharmArchitecture instance, so
+        # allow comparison with architecture names.
+        if isinstance(other, CharmArchitecture):
+            other = other.name
+        return isinstance(other, basestring) and self.name == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.name)
+
     def __repr__(self):
         opts_string=''
         if hasattr(self, '_options') and self._options and \
@@ -521,79 +986,147 @@ class CharmArchitecture(object):
         arch: name of the architecture for which to load options and compilers
 
         """
-        _dir = os.path.join(package_directory, 'src', 'arch', arch)
-        entries = os.listdir(_dir)
-        compilers = [CharmDefinition.COMPILERS_REGEXP.sub(r'\1', ce) \
-                         for ce in filter(lambda x: CharmDefinition.COMPILERS_REGEXP.match(x),
-                                          entries)]
-        options = [CharmDefinition.OPTIONS_REGEXP.sub(r'\1', ce) \
-                       for ce in filter(lambda x: CharmDefinition.OPTIONS_REGEXP.match(x),
-                                        entries)]
-        fortran_compilers_list = ['g95', 'gfortran', 'absoft', 'pgf90', 'ifc', 'ifort']
+        return self.classify_entries(os.listdir(os.path.join(package_directory,
+                                                             'src', 'arch', arch)))
 
-        fortran_compilers = filter(lambda x: x in fortran_compilers_list, options)
+    @classmethod
+    def classify_entries(self, entries):
+        """
+        Sort the entries of a Charm++ architecture directory into the
+        architecture's options, compilers, and Fortran compilers.
 
-        # Remove fortran compilers from options
-        options = filter(lambda x: not x in fortran_compilers, options)
+        returns: tuple of (options, compilers, fortran_compilers)
 
+        """
+        options = []
+        compilers = []
+        fortran_compilers = []
+        for entry in entries:
+            m = CharmDefinition.COMPILERS_REGEXP.match(entry)
+            if m:
+                compilers.append(m.group(1))
+                continue
+            m = CharmDefinition.OPTIONS_REGEXP.match(entry)
+            if m:
+                if m.group(1) in CharmDefinition.FORTRAN_COMPILERS:
+                    fortran_compilers.append(m.group(1))
+                else:
+                    options.append(m.group(1))
         return (options, compilers, fortran_compilers)
 
     @classmethod
-    def load(self, package):
+    def scan(self, package_directory):
         """
-        Load Charm++ architectures defined within a Charm++ source tree.
-
-        This method loads Charm++ architecture data -- including available
-        build-options and compilers for each architecture -- from a Charm++
-        package tree.
-
-        package: Charm++ package instance.
+        Load all architectures from a Charm++ package tree, reading each
+        architecture directory exactly once.
 
         """
-        if not hasattr(self, 'architectures'):
-            self.architectures = []
-        if len(self.architectures) > 0:
-            return self.architectures
+        arch_dir = os.path.join(package_directory, 'src', 'arch')
+        listings = {}
+        for name in os.listdir(arch_dir):
+            try:
+                listings[name] = os.listdir(os.path.join(arch_dir, name))
+            except OSError:
+                # Not a directory.
+                pass
 
-        directory = package.directory
-        # We *could* make a native Python version of this shell command, but
-        # since we're trying to recreate the same values that Charm++'s "build"
-        # script comes up with, it's probably better to just copy the command
-        # straight out of that script.
-        run = "cd %s ; ls -1 | egrep -v '(^CVS)|(^shmem$)|(^mpi$)|(^sim$)|(^net$)|(^multicore$)|(^util$)|(^common$)|(^uth$)|(^conv-mach-fix.sh$)|(^win32$)|(^win64$)|(^paragon$)|(^lapi$)|(^cell$)|(^gemini_gni$)|(^pami$)|(^template$)|(^cuda$)'" % (os.path.join(directory, 'src', 'arch'))
-        out = subprocess.check_output(run, shell=True)
-        architecture_names = filter(lambda x: len(x) > 0, out.split("\n"))
-
-        # Now fetch the available compilers and options for each Charm++
-        # architecture.
-        common = CharmArchitecture(None, 'common', *self.get_arch_options_and_compilers(directory, 'common'),
+        common = CharmArchitecture(None, 'common',
+                                   *self.classify_entries(listings.get('common', [])),
                                    is_base=True)
         self.architectures['common'] = common
 
-        for name in architecture_names:
+        for name in sorted(listings):
+            if name in CharmArchitecture.NON_ARCHITECTURE_NAMES or name.startswith('CVS'):
+                continue
             parent = common
 
-            base_name=re.sub(r'^([^-]+)-.*$', r'\1', name)
-            if base_name != name \
-                    and os.path.isdir(os.path.join(directory, 'src', 'arch', base_name)):
-                if not base_name in CharmArchitecture.architectures:
+            base_name = name.split('-', 1)[0]
+            if base_name != name and base_name in listings:
+                if not base_name in self.architectures:
                     # Load the "base" compiler/option sets for the architecture.
                     self.architectures[base_name] = \
                         CharmArchitecture(common, base_name,
-                                          *self.get_arch_options_and_compilers(directory, base_name),
+                                          *self.classify_entries(listings[base_name]),
                                           is_base=True)
                 else:
-                    base = self.architectures[base_name]
-                    base.is_base = True
-
+                    self.architectures[base_name].is_base = True
                 parent = self.architectures[base_name]
 
-            arch = CharmArchitecture(parent, name,
-                                     *self.get_arch_options_and_compilers(directory, name))
+            arch = CharmArchitecture(parent, name, *self.classify_entries(listings[name]))
+            self.architectures[name] = arch
+            parent.children.append(arch)
+
+    @classmethod
+    def get_cache_key(self, package_directory):
+        """
+        Compute a key for the architecture data in a Charm++ package tree.
+        Architecture data depends only on the *names* of the files in each
+        architecture directory, so the modification times of "src/arch" and
+        its entries are sufficient to detect changes.
+
+        """
+        arch_dir = os.path.join(package_directory, 'src', 'arch')
+        key = [arch_dir, os.stat(arch_dir).st_mtime]
+        for name in sorted(os.listdir(arch_dir)):
+            key.append((name, os.stat(os.path.join(arch_dir, name)).st_mtime))
+        return key
+
+    @classmethod
+    def to_records(self):
+        """
+        Get a plain-data representation of all loaded architectures, with each
+        architecture listed after its parent.
+
+        """
+        def depth(arch):
+            d = 0
+            while arch.parent:
+                d += 1
+                arch = arch.parent
+            return d
+        return [(arch.name, arch.parent.name if arch.parent else None,
+                 arch._options, arch._compilers, arch._fortran_compilers,
+                 arch.is_base)
+                for arch in sorted(self.architectures.values(), key=depth)]
+
+    @classmethod
+    def from_records(self, records):
+        """Re-create the loaded architectures from the output of `to_records`."""
+        for name, parent_name, options, compilers, fortran_compilers, is_base in records:
+            parent = self.architectures[parent_name] if parent_name else None
+            arch = CharmArchitecture(parent, name, options, compilers,
+                                     fortran_compilers, is_base=is_base)
             self.architectures[name] = arch
             if parent:
                 parent.children.append(arch)
 
+    @classmethod
+    def load(self, package):
+        """
+        Load Charm++ architectures defined within a Charm++ source tree.
+
+        This method loads Charm++ architecture data -- including available
+        build-options and compilers for each architecture -- from a Charm++
+        package tree.  The results are cached in the workspace's "chimi-tmp"
+        directory until the tree's architecture directories change.
+
+        package: Charm++ package instance.
+
+        """
+        if len(self.architectures) > 0:
+            return self.architectures
+
+        directory = package.directory
+        cache_file = chimi.cache.path(package.package_set.directory, CharmArchitecture.CACHE)
+        key = self.get_cache_key(directory)
+        records = chimi.cache.load(cache_file, key)
+        if records != None:
+            self.from_records(records)
+        else:
+            self.scan(directory)
+            chimi.cache.store(cache_file, key, self.to_records())
+        return self.architectures
+
     @classmethod
     def __len__(self):
         return len(self.architectures)
@@ -608,8 +1141,19 @@ class CharmDefinition(PackageDefinition):
     name = 'Charm++'
     repository = chimi.settings.DEFAULT_REPOSITORIES['charm']
 
+    ARTIFACT_PATHS = ('bin', 'include', 'lib', 'lib_so', 'tmp/VERSION')
+
+    CONFIGURE_PREREQUISITES = ('bin/charmc', 'include/charm++.h')
+    """
+    Files, relative to a build directory, that a Charm++ build installs before
+    compiling its libraries and that dependent packages need in order to be
+    configured.
+
+    """
+
     COMPILERS_REGEXP = re.compile(r'^cc-([^.]+).h$')
     OPTIONS_REGEXP = re.compile(r'^conv-mach-([^.]+).h$')
+    FORTRAN_COMPILERS = frozenset(['g95', 'gfortran', 'absoft', 'pgf90', 'ifc', 'ifort'])
 
     ExistingBuild = chimi.util.create_struct(__name__, 'ExistingBuild',
                                              directory=None,
@@ -641,30 +1185,85 @@ class CharmDefinition(PackageDefinition):
 
     @classmethod
     def get_build_directory(self, build):
-        return os.path.join(build.package.directory, build.name)
+        # Charm++ builds go inside the source tree they were built from.
+        return os.path.join(build.package.get_source_directory(build.config.branch),
+                            build.name)
+
+    BUILD_VERSIONS_CACHE = 'charm-build-versions.pickle'
+    """
+    Name of the cache file holding the source versions resolved for Charm++
+    builds; see `chimi.cache`.
+
+    """
+
+    DESCRIBED_VERSION_RE = re.compile(r'^(.+?)(?:-[0-9]+)?(?:-g([0-9a-fA-F]+))?$')
+    """Pattern matching `git describe` output, as written to "tmp/VERSION"."""
+
+    _build_versions = {}
+    _build_versions_mutex = threading.Lock()
 
     @classmethod
     def get_build_version(self, build):
+        """
+        Resolve the commit a build was made from using the "tmp/VERSION" file
+        in its directory.  Results are cached in the workspace's "chimi-tmp"
+        directory, keyed on the version file's modification time.
+
+        """
         version_file = os.path.join(build.directory, 'tmp', 'VERSION')
-        if os.path.exists(version_file):
-            raw = file(version_file, 'r').read().strip()
-            if re.match(r'^[0-9a-fA-F]+$', raw):
-                return raw
-
-            tagged = raw
-            tags = [re.escape(tag.name) for tag in build.package.repository.tags]
-            _re = re.compile(r'^(%s)(?:-[0-9]+)?(?:-g([0-9a-fA-F]+))?'%'|'.join(tags))
-
-            commit = None
-            try_two = False
-            while not commit and not try_two:
-                m = _re.match(tagged)
-                tag, commit = m.groups()
-                if not commit:
-                    tagged = build.package.repository.git.describe(tag, long=True)
-                    try_two = True
+        try:
+            mtime = os.stat(version_file).st_mtime
+        except OSError:
+            return None
+
+        cache_file = chimi.cache.path(build.package.package_set.directory,
+                                      CharmDefinition.BUILD_VERSIONS_CACHE)
+        with CharmDefinition._build_versions_mutex:
+            if not cache_file in CharmDefinition._build_versions:
+                CharmDefinition._build_versions[cache_file] = chimi.cache.load(cache_file, 1) or {}
+            versions = CharmDefinition._build_versions[cache_file]
+            if version_file in versions and versions[version_file][0] == mtime:
+                return versions[version_file][1]
+
+        commit = self.resolve_version(build.package, file(version_file, 'r').read().strip())
+
+        with CharmDefinition._build_versions_mutex:
+            versions[version_file] = (mtime, commit)
+            chimi.cache.store(cache_file, 1, versions)
+        return commit
+
+    @classmethod
+    def resolve_version(self, package, raw):
+        """
+        Resolve the contents of a Charm++ "tmp/VERSION" file -- a commit hash
+        or `git describe` output -- to an abbreviated commit hash.
+
+        """
+        if re.match(r'^[0-9a-fA-F]+$', raw):
+            return raw
+
+        m = CharmDefinition.DESCRIBED_VERSION_RE.match(raw)
+        if not m:
+            return None
+        tag, commit = m.groups()
+        if commit:
             return commit
 
+        # Bare tag name: look it up among the repository's tags.  Shallow
+        # clones may lack the tag, in which case we fetch it.
+        names = [raw] if raw == tag else [raw, tag]
+        tags = package.metadata.tags
+        for name in names:
+            if name in tags:
+                return tags[name][:7]
+        if package.is_shallow:
+            for name in names:
+                if package.deepen(tag=name) == 0:
+                    tags = package.metadata.tags
+                    if name in tags:
+                        return tags[name][:7]
+        return None
+
 
     @classmethod
     def find_existing_build_data(self, package, build_dir=None):
@@ -771,8 +1370,19 @@ class CharmDefinition(PackageDefinition):
         This method is normally called only when the Chimi database file
         is initialized.
 
+        build_dir: directory to search; default: the package directory and
+            its branches' worktrees.
+
         """
-        data = self.find_existing_build_data(package, build_dir)
+        if build_dir == None:
+            data = self.find_existing_build_data(package)
+            for branch, path in package.get_worktrees().items():
+                for eb in self.find_existing_build_data(package, path):
+                    if eb.branch == None:
+                        eb.branch = branch
+                    data.append(eb)
+        else:
+            data = self.find_existing_build_data(package, build_dir)
         builds = []
         for eb in data:
             builds.append(Build(package, BuildConfig(eb.architecture, eb.components, eb.features,
@@ -782,13 +1392,53 @@ class CharmDefinition(PackageDefinition):
         return builds
 
     @classmethod
-    def build(self, package, config, _continue=False, replace=False, force=False):
+    def get_compiler_identity(self, package, _build):
+        """
+        Identify the compilers named in the shell fragments for the build's
+        architecture, which are read from the source tree since the build may
+        not exist yet.
+
+        """
+        arch = _build.config.architecture
+        if isinstance(arch, CharmArchitecture):
+            arch = arch.name
+        return chimi.autoconf.ConfigureCache.compiler_identity(
+            package.get_source_directory(_build.config.branch),
+            (os.path.join('src', 'arch', 'common'), os.path.join('src', 'arch', arch)))
+
+    @classmethod
+    def ready_for_configure(self, _build, since=None):
+        """
+        Check whether a (possibly still compiling) Charm++ build has installed
+        what dependent packages' `configure` scripts need.
+
+        since: time at which the current run of the build started.  Files
+            older than this are left over from an earlier run (e.g. one being
+            continued or replaced), and may not match the headers and
+            libraries the build is about to install, so they don't count.
+
+        """
+        for path in self.CONFIGURE_PREREQUISITES:
+            path = os.path.join(_build.directory, path)
+            if not os.path.exists(path):
+                return False
+            # Allow for file timestamps coarser than the clock.  The change
+            # time is used since copying can preserve modification times.
+            if since != None and os.lstat(path).st_ctime < since - 1:
+                return False
+        return True
+
+    @classmethod
+    def build(self, package, config, _continue=False, replace=False, force=False,
+              jobs=None):
         """
         Build Charm++ for use with ChaNGa.
 
+        jobs: number of parallel `make` jobs to run, if not the default.
+
         """
 
-        srcdir = package.directory
+        srcdir = package.get_source_directory(config.branch)
 
         assert(config.branch != None)
         if len(CharmArchitecture.architectures) == 0:
@@ -808,7 +1458,7 @@ class CharmDefinition(PackageDefinition):
         build_args = None
         if _continue:
             build_cwd = os.path.join(_build.directory, 'tmp')
-            build_args = ['gmake', 'basics', 'ChaNGa']
+            build_args = make_command(['gmake', 'basics', 'ChaNGa'], jobs)
         else:
             build_cwd = srcdir
             build_args = ['./build', 'ChaNGa',
@@ -818,16 +1468,29 @@ class CharmDefinition(PackageDefinition):
             build_args.extend(config.components)
             build_args.extend(build_configure_flags(self, config))
             build_args.extend(config.extras)
+            build_args = make_command(build_args, jobs)
+
+        fingerprint = None
+        if not chimi.settings.noact:
+            fingerprint = self.get_source_fingerprint(package, _build)
+            if _continue and _build.compiled and self.check_sources(package, _build, fingerprint):
+                sys.stderr.write('Sources unchanged since "%s" was built; skipping make.\n'
+                                 % _build.name)
+                return _build
 
-        _build.update(BuildStatus.Compile, ' '.join(build_args))
+        log = _build.log_file
+        _build.update(BuildStatus.Compile, ' '.join(build_args), log=log)
 
         try:
-            check_call(build_args, cwd=build_cwd)
-        except subprocess.CalledProcessError:
-            _build.update(BuildStatus.CompileFailed)
+            result = chimi.runner.run(build_args, cwd=build_cwd, log=log,
+                                      echo=chimi.settings.echo_build_output)
+        except subprocess.CalledProcessError as err:
+            _build.update(BuildStatus.CompileFailed, log=log,
+                          timing=step_timing(getattr(err, 'result', None)))
             return _build
         else:
-            _build.update(BuildStatus.Complete, 'Charm++ build complete.')
+            _build.update(BuildStatus.Complete, 'Charm++ build complete.', log=log,
+                          timing=step_timing(result), sources=fingerprint)
             return _build
 
 class UtilityDefinition(PackageDefinition):
@@ -844,12 +1507,59 @@ class UtilityDefinition(PackageDefinition):
 class Package(object):
     """A single package instance."""
 
+    WORKTREE_DIRECTORY = '.chimi-worktrees'
+    """
+    Directory, relative to the package directory, holding the Git worktrees
+    from which branches other than the checked-out one are built.  Each
+    branch's worktree is placed in a subdirectory of its own next to links to
+    the package directory's siblings, so that paths like "../utility" in the
+    package's build scripts resolve as they do from the package directory.
+
+    """
+
+    _worktree_mutex = threading.Lock()
+
+    _builds_mutex = threading.RLock()
+    """Lock guarding packages' build lists, which concurrent builds update."""
+
+    _compiling = {}
+    """
+    For each build this process is performing, indexed by package directory
+    and configuration fingerprint: an Event set when the build finishes, and
+    the time at which it started.
+
+    """
+
+    DEEPEN_STEP = 256
+    """Number of commits of history fetched at a time by `deepen`."""
+
+    METADATA_CACHE = 'repository-%s.pickle'
+    """
+    Pattern for the name of the cache file holding a package's repository
+    metadata; see `chimi.repository`.
+
+    """
+
+    _store = None
+    """
+    SQLiteStore from which the package's builds are read on demand, for
+    packages created by `from_store`.
+
+    """
+
+    _uuids = None
+    """Map of build UUIDs to builds, built on demand."""
+
     def __init__(self, package_set, definition, directory, builds=None):
         self.package_set = package_set
         self.definition = definition
         self.directory = directory
         self._repository = None
-        self._branches = None
+        self._metadata = None
+        self._fingerprints = None
+        # UUIDs of the package's builds as of when the package was last read
+        # from or written to the database.
+        self.stored_uuids = set()
 
         if builds == None:
             self.builds = []
@@ -859,65 +1569,282 @@ class Package(object):
             self.builds = builds
 
     def __setstate__(self, state):
+        if 'builds' in state:
+            state['_builds'] = state.pop('builds')
         self.__dict__ = state
         self._repository = None
-        self._branches = None
-
-        # Check for build directories that no longer exist, builds with
-        # identical paths, and builds with incorrect branch names.
-        do_save = False
-        builds_to_delete = set()
-        for build in self.builds:
-            build.config = copy.copy(build.config)
-            if not os.path.exists(build.directory):
-                do_save = True
-                builds_to_delete.add(build)
-            elif not build.config.branch in self.branches:
-                do_save = True
-                build.config.branch = \
-                    re.sub(r'^(?:heads/|remotes/([^/]+)/)', '',
-                           self.repository.git.describe(build.version, all=True))
-
-        counts = {}
-        for b in self.builds:
-            if b.directory in counts:
-                counts[b] += 1
-            else:
-                counts[b] = 1
+        self._metadata = None
+        self._fingerprints = None
+        self.stored_uuids = set(str(b.uuid) for b in self.builds)
+        if chimi.settings.verify_builds:
+            self.check_builds()
 
-        for _dir in counts:
-            if counts[_dir] > 1:
-                # Discard all but the most-recently-updated build.
-                _builds = sorted(filter(lambda x: x.directory == _dir, self.builds))
-                builds_to_delete.update(set(_builds[0:-1]))
+    def to_record(self):
+        """
+        Get a plain-data representation of the package and its builds.  The
+        owning package set is not included.
+
+        """
+        return { 'definition': self.definition.__name__,
+                 'directory': self.directory,
+                 'builds': [_build.to_record() for _build in self.builds] }
+
+    @classmethod
+    def from_record(self, package_set, record):
+        """Re-create a package in `package_set` from the output of `to_record`."""
+        package = Package.__new__(Package)
+        package.package_set = package_set
+        package.definition = getattr(sys.modules[__name__], record['definition'])
+        package.directory = record['directory']
+        package._repository = None
+        package._metadata = None
+        package._fingerprints = None
+        package.stored_uuids = set(r['uuid'] for r in record['builds'])
+        package.builds = [Build.from_record(package, r) for r in record['builds']]
+        return package
+
+    @classmethod
+    def from_store(self, package_set, store, name):
+        """
+        Create a package in `package_set` whose builds are read from `store`
+        only as they are needed; see `builds_by_uuid`.
+
+        """
+        definition, directory = store.package_info(name)
+        package = Package.__new__(Package)
+        package.package_set = package_set
+        package.definition = getattr(sys.modules[__name__], definition)
+        package.directory = directory
+        package._repository = None
+        package._metadata = None
+        package._fingerprints = None
+        package.stored_uuids = set()
+        package._store = store
+        package._store_name = name
+        package._builds = None
+        # Builds read from the store before the full list was needed; the
+        # full list reuses them, so that there is only ever one Build instance
+        # per build.
+        package._partial = {}
+        return package
+
+    def _load_builds(self):
+        """Read all of a store-backed package's builds."""
+        with Package._builds_mutex:
+            if self._builds != None:
+                return
+            records = self._store.package_record(self._store_name)['builds']
+            self.stored_uuids = set(r['uuid'] for r in records)
+            self.builds = [self._partial.get(r['uuid']) or Build.from_record(self, r)
+                           for r in records]
+            self._partial = {}
+        if chimi.settings.verify_builds and self.check_builds():
+            self.package_set.save_corrections()
+
+    @property
+    def builds_loaded(self):
+        """Whether the package's full build list has been read."""
+        return self._builds != None
+
+    def builds_by_uuid(self, uuids):
+        """
+        Get the package's builds with the given UUIDs.  If the package's full
+        build list hasn't been read from its store, only these builds are read;
+        those whose directories no longer exist are left out.
+
+        """
+        with Package._builds_mutex:
+            if self._builds == None:
+                missing = [u for u in uuids if not u in self._partial]
+                if len(missing) > 0:
+                    for r in self._store.package_record(self._store_name, missing)['builds']:
+                        self._partial[r['uuid']] = Build.from_record(self, r)
+                return [self._partial[u] for u in uuids if u in self._partial and
+                        not (chimi.settings.verify_builds and
+                             not os.path.isdir(self._partial[u].directory))]
+            if self._uuids is None:
+                self._uuids = dict((str(b.uuid), b) for b in self._builds)
+            return [self._uuids[u] for u in uuids if u in self._uuids]
+
+    def check_builds(self):
+        """
+        Remove or correct invalid build records: builds whose directories no
+        longer exist, all but the most recent of several builds in the same
+        directory, and builds whose recorded branch no longer exists in the
+        repository.  If anything was changed, the owning package set is flagged
+        for saving and True is returned.
 
-        if len(builds_to_delete) > 0:
-            self.builds = list(set(self.builds).difference(builds_to_delete))
+        """
+        if len(self.builds) == 0:
+            return False
 
-        if do_save:
+        # List each directory containing builds once, instead of checking for
+        # each build's directory separately.
+        listings = {}
+        for _build in self.builds:
+            parent = os.path.dirname(_build.directory)
+            if not parent in listings:
+                try:
+                    listings[parent] = set(os.listdir(parent))
+                except OSError:
+                    listings[parent] = set()
+        builds = filter(lambda b: os.path.basename(b.directory) in \
+                            listings[os.path.dirname(b.directory)],
+                        self.builds)
+
+        # Discard all but the most-recently-updated build for each directory.
+        latest = {}
+        for _build in builds:
+            if not _build.directory in latest or latest[_build.directory] < _build:
+                latest[_build.directory] = _build
+        builds = filter(lambda b: latest[b.directory] is b, builds)
+
+        # Find the branches for builds whose recorded branch no longer exists,
+        # using a single call to `git describe`.
+        changed = len(builds) != len(self.builds)
+        stale = filter(lambda b: not b.config.branch in self.branches, builds)
+        if len(stale) > 0:
+            versions = dict((b, b.version) for b in stale)
+            commits = sorted(set(filter(None, versions.values())))
+            described = {}
+            if len(commits) > 0:
+                for attempt in (0, 1):
+                    try:
+                        described = dict(zip(commits,
+                                             self.repository.git.describe(*commits, all=True).split('\n')))
+                        break
+                    except git.GitCommandError:
+                        # A shallow clone may not have the builds' commits;
+                        # fetch more history and try again, once.
+                        if attempt > 0 or not self.is_shallow or self.deepen() != 0:
+                            break
+                if len(described) == 0:
+                    # Some commit is unknown (e.g. garbage-collected), which
+                    # fails the whole call; describe the rest one at a time.
+                    unknown = []
+                    for commit in commits:
+                        try:
+                            described[commit] = self.repository.git.describe(commit, all=True)
+                        except git.GitCommandError:
+                            unknown.append(commit)
+                    if len(unknown) > 0:
+                        sys.stderr.write("\033[31mWARNING:\033[0m can't find the branches of %s "
+                                         "build(s) from unknown commit(s) %s\n" %
+                                         (self.definition.name, ', '.join(c[:12] for c in unknown)))
+            for _build in stale:
+                if versions[_build] in described:
+                    _build.config.branch = re.sub(r'^(?:heads/|remotes/([^/]+)/)', '',
+                                                  described[versions[_build]])
+                    changed = True
+
+        if changed:
+            self.builds = builds
             # Set a flag on the parent package-set to indicate that internal
             # state has changed.  It will save when it's ready -- if we
             # directly called its `save` method here, when it's (possibly) not
             # yet done loading, data would be lost.
             self.package_set.save_flag = True
+        return changed
+
+    @property
+    def builds(self):
+        """List of the package's builds."""
+        if self._builds is None:
+            self._load_builds()
+        return self._builds
+
+    @builds.setter
+    def builds(self, value):
+        self._builds = value
+        self._fingerprints = None
+        self._uuids = None
+
+    def _index_keys(self, _build):
+        """
+        Get the keys under which a build is kept in the fingerprint indexes:
+        its configuration's fingerprint with and without the branch.
+
+        """
+        config = _build.config
+        return (config.fingerprint,
+                BuildConfig.fingerprint_record(self.definition.name, config.to_record(),
+                                               branch=False))
+
+    def _fingerprint_index(self, branch=True):
+        """
+        Get the map of configuration fingerprints (or, if `branch` is False,
+        of fingerprints that ignore the branch) to builds, creating the maps if
+        necessary.
+
+        """
+        with Package._builds_mutex:
+            if self._fingerprints is None:
+                by_fingerprint = {}
+                by_base = {}
+                keys = {}
+                for _build in self.builds:
+                    fingerprint, base = keys[str(_build.uuid)] = self._index_keys(_build)
+                    by_fingerprint.setdefault(fingerprint, []).append(_build)
+                    by_base.setdefault(base, []).append(_build)
+                # Each build's keys are kept so that it can be removed even if
+                # its configuration has changed since.
+                self._fingerprints = (by_fingerprint, by_base, keys)
+            return self._fingerprints[0 if branch else 1]
+
+    def insert_build(self, _build):
+        """
+        Append a build to the package's build list, keeping the fingerprint
+        indexes up to date.  Unlike `add_build`, this does no checking and
+        doesn't record the change in the database.
+
+        """
+        with Package._builds_mutex:
+            self.builds.append(_build)
+            if self._fingerprints != None:
+                by_fingerprint, by_base, keys = self._fingerprints
+                fingerprint, base = keys[str(_build.uuid)] = self._index_keys(_build)
+                by_fingerprint.setdefault(fingerprint, []).append(_build)
+                by_base.setdefault(base, []).append(_build)
+            if self._uuids != None:
+                self._uuids[str(_build.uuid)] = _build
+
+    def discard_build(self, _build):
+        """Remove a build from the package's build list (see `insert_build`)."""
+        with Package._builds_mutex:
+            self.builds.remove(_build)
+            if self._uuids != None:
+                self._uuids.pop(str(_build.uuid), None)
+            if self._fingerprints != None:
+                by_fingerprint, by_base, keys = self._fingerprints
+                if str(_build.uuid) in keys:
+                    fingerprint, base = keys.pop(str(_build.uuid))
+                    for index, key in ((by_fingerprint, fingerprint), (by_base, base)):
+                        if _build in index.get(key, []):
+                            index[key].remove(_build)
+
+    @property
+    def metadata(self):
+        """
+        Cached refs, HEAD, remotes, and tags for the package's repository; see
+        `chimi.repository.RepositoryMetadata`.
+
+        """
+        if self._metadata is None:
+            self._metadata = \
+                chimi.repository.RepositoryMetadata.get(self.directory,
+                                                        chimi.cache.path(self.package_set.directory,
+                                                                         Package.METADATA_CACHE % self.definition.name))
+        return self._metadata
 
     @property
     def branches(self):
         """Fetch the names of all local repository branches"""
-        # We fetch the branch list only once per instantiation of the class,
-        # because we don't expect it to change during a single Chimi run.
-        if not self._branches:
-            repo = self.repository
-            if repo:
-                self._branches = [re.sub(r'^heads/', '', br.name) for br in self.repository.branches]
-            else:
-                self._branches = []
-        return self._branches
+        return self.metadata.branches
 
     @property
     def branch(self):
         """Name of the currently checked-out branch"""
-        o = re.sub(r'^(?:heads|remotes)/', '', self.repository.git.describe(all=True, abbrev=0))
+        o = self.metadata.branch
         assert(o in self.branches)
         return o
 
@@ -935,45 +1862,337 @@ class Package(object):
 
             return self._repository
 
-    def fetch(self):
-        self.definition.fetch(self)
+    def fetch(self, **kwargs):
+        """Fetch or update the package's sources; see `PackageDefinition.fetch`."""
+        try:
+            return self.definition.fetch(self, **kwargs)
+        finally:
+            self.metadata.invalidate()
+
+    @property
+    def is_shallow(self):
+        """Whether the package's repository is a shallow clone."""
+        git_dir = chimi.repository.find_git_dir(self.directory)
+        return git_dir != None and os.path.exists(os.path.join(git_dir, 'shallow'))
+
+    def deepen(self, tag=None):
+        """
+        Fetch history missing from a shallow clone: the named tag if `tag` is
+        given, and otherwise the next `DEEPEN_STEP` commits of each fetched
+        branch.
+
+        return: exit status of `git fetch`
+
+        """
+        if tag != None:
+            args = ['--depth=1', 'origin', 'refs/tags/%s:refs/tags/%s' % (tag, tag)]
+        else:
+            args = ['--deepen=%d' % Package.DEEPEN_STEP, 'origin']
+        try:
+            # A clone of a shallow mirror can only get the history the mirror
+            # has, so deepen the mirror first.
+            mirror = self.definition.get_mirror_path()
+            if mirror != None and \
+                    dict(self.remotes).get('origin') == 'file://' + os.path.abspath(mirror):
+                self.definition.deepen_mirror(args)
+            with open(os.devnull, 'w') as null:
+                return check_call(['git', 'fetch'] + args, cwd=self.directory, out=null, err=null)
+        finally:
+            self.metadata.invalidate()
 
     @property
     def remotes(self):
         """
-        Fetch the names of all Git remote repositories.
+        Fetch the names and URLs of all Git remote repositories.
 
         """
-        cwd = os.getcwd()
-        out = []
-        if os.path.exists(self.directory):
-            os.chdir(self.directory)
-            url_regexp = re.compile(r'^\s*Fetch URL: ')
-            git_remote_names = self.repository.git.remote().split("\n")
-            for name in git_remote_names:
-                if name == '':
-                    continue
-                gitremote = self.repository.git.remote('show', '-n', name)
-                url_line = filter(lambda x: url_regexp.match(x), gitremote.split("\n"))[0]
-                out.append((name, url_regexp.sub('', url_line).strip()))
-            os.chdir(cwd)
+        return self.metadata.remotes
+
+
+    def get_source_directory(self, branch=None):
+        """
+        Get the source tree for the given branch: the package directory if the
+        branch is checked out there, and otherwise the branch's worktree under
+        `WORKTREE_DIRECTORY` (which may not have been created yet; see
+        `prepare_source_directory`).
+
+        """
+        if branch == None or branch == self.metadata.branch:
+            return self.directory
+        return os.path.join(self.directory, Package.WORKTREE_DIRECTORY,
+                            urllib.quote(branch, safe=''), os.path.basename(self.directory))
+
+    def get_worktrees(self):
+        """
+        Find the source trees created for branches other than the checked-out
+        one.
+
+        return: dict mapping branch names to worktree paths.
+
+        """
+        out = {}
+        for branch in self.branches:
+            path = self.get_source_directory(branch)
+            if path != self.directory and os.path.isdir(path):
+                out[branch] = path
         return out
 
+    def prepare_source_directory(self, branch):
+        """
+        Ensure that a source tree for `branch` exists, creating a Git worktree
+        for it if necessary, and return its path.
+
+        """
+        path = self.get_source_directory(branch)
+        with Package._worktree_mutex:
+            if os.path.exists(path) or chimi.settings.noact:
+                return path
+
+            # Keep the worktrees out of `git status` for the main checkout.
+            exclude = os.path.join(chimi.repository.find_git_dir(self.directory), 'info', 'exclude')
+            pattern = '/%s/' % Package.WORKTREE_DIRECTORY
+            if not os.path.exists(exclude) or \
+                    not pattern in file(exclude, 'r').read().split('\n'):
+                if not os.path.isdir(os.path.dirname(exclude)):
+                    os.makedirs(os.path.dirname(exclude))
+                with open(exclude, 'a') as f:
+                    f.write(pattern + '\n')
+
+            # Forget any worktrees whose directories were removed, so the
+            # branch can be checked out again.
+            check_call(['git', 'worktree', 'prune'], cwd=self.directory)
+            if check_call(['git', 'worktree', 'add', path, branch], cwd=self.directory) != 0 \
+                    and not os.path.isdir(path):
+                raise RuntimeError('failed to create a worktree for branch "%s" of %s'
+                                   % (branch, self.definition.name))
+
+            # Mirror the workspace around the worktree (see
+            # `WORKTREE_DIRECTORY`).
+            workspace = os.path.dirname(os.path.abspath(self.directory))
+            parent = os.path.dirname(path)
+            for name in os.listdir(workspace):
+                link = os.path.join(parent, name)
+                if name == os.path.basename(path) or os.path.lexists(link) or \
+                        not os.path.isdir(os.path.join(workspace, name)):
+                    continue
+                os.symlink(os.path.relpath(os.path.join(workspace, name), parent), link)
+        return path
+
+    def get_source_state(self, branch=None, exclude=()):
+        """
+        Get the state of the source tree for `branch`: its HEAD commit, and a
+        content hash for each file that differs from that commit -- including
+        untracked files, but not ignored ones.  Paths in `exclude` (relative to
+        the source tree; e.g. build directories inside it) are not examined.
+
+        return: a dict with keys 'commit' and 'changes', the latter mapping
+            paths to content hashes (or "deleted").
+
+        """
+        srcdir = self.get_source_directory(branch)
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=srcdir).strip()
+        status = subprocess.check_output(['git', 'status', '--porcelain', '-z',
+                                          '--untracked-files=all', '--', '.'] +
+                                         [':(exclude)%s' % path for path in exclude],
+                                         cwd=srcdir)
+        changes = {}
+        entries = status.split('\0')
+        while len(entries) > 0:
+            entry = entries.pop(0)
+            if len(entry) == 0:
+                continue
+            code, path = entry[:2], entry[3:]
+            if code[0] in 'RC':
+                # Renames and copies are followed by the original path.
+                entries.pop(0)
+            full_path = os.path.join(srcdir, path)
+            if os.path.islink(full_path):
+                changes[path] = 'link:' + os.readlink(full_path)
+            elif os.path.isfile(full_path):
+                digest = hashlib.sha1()
+                with open(full_path, 'rb') as f:
+                    for block in iter(lambda: f.read(65536), ''):
+                        digest.update(block)
+                changes[path] = digest.hexdigest()
+            else:
+                changes[path] = 'deleted'
+        return { 'commit': commit, 'changes': changes }
+
+    def describe_source_changes(self, old, new):
+        """
+        List the files that differ between two source states (as returned by
+        `get_source_state`).
+
+        return: list of "STATUS PATH" strings, where STATUS is as for
+            `git diff --name-status`.
+
+        """
+        out = []
+        if old['commit'] != new['commit']:
+            try:
+                diff = subprocess.check_output(['git', 'diff', '--name-status', '-z',
+                                                old['commit'], new['commit']],
+                                               cwd=self.directory, stderr=open(os.devnull, 'w'))
+                fields = diff.split('\0')
+                while len(fields) > 1:
+                    status = fields.pop(0)
+                    paths = [fields.pop(0)]
+                    if status[0] in 'RC':
+                        paths.append(fields.pop(0))
+                    out.append('%s %s' % (status, ' -> '.join(paths)))
+            except subprocess.CalledProcessError:
+                # e.g. the old commit is missing from a shallow clone.
+                out.append('? (commit %s replaced by %s)' % (old['commit'][:7], new['commit'][:7]))
+        old_changes, new_changes = old['changes'], new['changes']
+        for path in sorted(set(old_changes) | set(new_changes)):
+            if old_changes.get(path) != new_changes.get(path):
+                out.append('%s %s (%s)' % ('D' if new_changes.get(path) == 'deleted' else 'M',
+                                           path, 'uncommitted' if path in new_changes
+                                           else 'no longer modified'))
+        return out
 
     def build(self, config, **kwargs):
-        """Build the package."""
+        """
+        Build the package.  Branches other than the one checked out in the
+        package directory are built from their own worktrees, so builds on
+        different branches don't disturb each other.
+
+        """
         if not isinstance(config.branch, str):
             config.branch = self.branch
 
-        old_branch = self.branch
-        if self.branch != config.branch:
-            check_call(['git', 'checkout', config.branch], cwd=self.directory)
+        self.prepare_source_directory(config.branch)
+        key = (self.directory, config.fingerprint)
+        finished = threading.Event()
+        with Package._builds_mutex:
+            Package._compiling[key] = (finished, time.time())
+        try:
+            if not kwargs.get('_continue') and not kwargs.get('force'):
+                _build = self.restore_build(config, replace=kwargs.get('replace', False))
+                if _build != None:
+                    return _build
+
+            _build = self.definition.build(self, config, **kwargs)
+            if _build != None and _build.compiled and not chimi.settings.noact:
+                self.store_build(_build)
+            return _build
+        finally:
+            with Package._builds_mutex:
+                del Package._compiling[key]
+            finished.set()
+
+    def is_building(self, config):
+        """Check whether this process is currently building `config`."""
+        with Package._builds_mutex:
+            return (self.directory, config.fingerprint) in Package._compiling
+
+    def building_since(self, config):
+        """
+        Get the time at which this process started building `config`, or None
+        if it isn't building it.
+
+        """
+        with Package._builds_mutex:
+            entry = Package._compiling.get((self.directory, config.fingerprint))
+        return entry[1] if entry != None else None
+
+    def wait_for_build(self, config):
+        """
+        Wait until this process has finished building `config`, if it is
+        building it.
+
+        """
+        with Package._builds_mutex:
+            entry = Package._compiling.get((self.directory, config.fingerprint))
+        if entry != None:
+            # Wait with a timeout so KeyboardInterrupt is still delivered.
+            while not entry[0].wait(0.5):
+                pass
+
+    def restore_build(self, config, replace=False):
+        """
+        Create a build by unpacking a matching entry from the artifact store.
+
+        return: the new build, or None if there is no matching entry.
+
+        """
+        store = chimi.artifacts.ArtifactStore.default()
+        if store == None:
+            return None
+        _build = Build(self, config)
+        fingerprint = self.definition.get_source_fingerprint(self, _build)
+        key = self.definition.get_artifact_key(self, _build, fingerprint)
+        if key == None or not store.has(key):
+            return None
+        owned = self.find_build(config)
+        if owned != None and owned.directory == _build.directory and not replace:
+            # Let the package definition report the conflict.
+            return None
+
+        message = 'restored from the artifact store (%s).' % key[:12]
+        if chimi.settings.noact:
+            _build.update(BuildStatus.Complete, 'would be ' + message)
+            return _build
 
+        # Unpack beside the build directory, and move the files into place
+        # only once that has succeeded.
+        parent = os.path.dirname(_build.directory)
+        if not os.path.isdir(parent):
+            os.makedirs(parent)
+        staging = tempfile.mkdtemp(prefix='.chimi-restore-', dir=parent)
         try:
-            return self.definition.build(self, config, **kwargs)
+            try:
+                store.restore(key, staging)
+            except (IOError, OSError, tarfile.TarError, chimi.artifacts.ArtifactStoreError) as err:
+                sys.stderr.write('\033[31mWARNING:\033[0m could not restore "%s" from the '
+                                 'artifact store: %s\n' % (_build.name, err))
+                return None
+
+            self.add_build(_build, replace=replace)
+            if not os.path.isdir(_build.directory):
+                os.makedirs(_build.directory)
+            for name in os.listdir(staging):
+                destination = os.path.join(_build.directory, name)
+                if os.path.isdir(destination) and not os.path.islink(destination):
+                    shutil.rmtree(destination)
+                elif os.path.lexists(destination):
+                    os.unlink(destination)
+                os.rename(os.path.join(staging, name), destination)
         finally:
-            if self.branch != old_branch:
-                check_call(['git', 'checkout', old_branch], cwd=self.directory)
+            shutil.rmtree(staging, True)
+
+        _build.update(BuildStatus.Complete, message, sources=fingerprint)
+        return _build
+
+    def store_build(self, _build):
+        """
+        Add the products of a completed build to the artifact store, unless
+        they're already there or the build can't be identified by its source
+        commits.
+
+        """
+        store = chimi.artifacts.ArtifactStore.default()
+        if store == None or _build.source_fingerprint == None:
+            return
+        key = self.definition.get_artifact_key(self, _build, _build.source_fingerprint)
+        if key == None or store.has(key):
+            return
+        paths = [path for path in self.definition.ARTIFACT_PATHS
+                 if os.path.exists(os.path.join(_build.directory, path))]
+        if len(paths) == 0:
+            return
+
+        sys.stderr.write('Saving "%s" to the artifact store... ' % _build.name)
+        try:
+            store.pack(key, _build.directory, paths,
+                       { 'package': self.definition.name,
+                         'name': _build.name,
+                         'config': _build.config.to_record(),
+                         'commit': _build.commit })
+        except (IOError, OSError, tarfile.TarError) as err:
+            sys.stderr.write('failed: %s\n' % err)
+        else:
+            sys.stderr.write('done.\n')
 
 
     def purge_builds(self, config=None, names=None, uuids=None,
@@ -999,19 +2218,34 @@ class Package(object):
                 callback(_build)
             if not chimi.settings.noact:
                 shutil.rmtree(_build.directory)
-                self.builds.remove(_build)
+                self.discard_build(_build)
+                self.package_set.record_build_removed(_build)
 
         return len(_builds)
 
-    def find_builds(self, config):
-        """Find all builds matching `config` for this package instance."""
+    def find_builds(self, config, require_matching_branch=True):
+        """
+        Find all builds matching `config` for this package instance.  If
+        `require_matching_branch` is False, builds of any branch will match.
+
+        """
         if not isinstance(config,chimi.build.BuildConfig):
             raise ValueError('Invalid argument type `%s\' to `find_build`'%type(config))
-        return filter(lambda x: x.config == config, self.builds)
+        with Package._builds_mutex:
+            if require_matching_branch:
+                if not self.builds_loaded:
+                    return self.builds_by_uuid(
+                        self._store.find_build_uuids(self._store_name,
+                                                     fingerprint=config.fingerprint))
+                return list(self._fingerprint_index().get(config.fingerprint, []))
+            else:
+                base = BuildConfig.fingerprint_record(self.definition.name, config.to_record(),
+                                                      branch=False)
+                return list(self._fingerprint_index(branch=False).get(base, []))
 
-    def find_build(self, config):
+    def find_build(self, config, require_matching_branch=True):
         """Find a build matching `config` for this package instance."""
-        matches = self.find_builds(config)
+        matches = self.find_builds(config, require_matching_branch)
 
         if len(matches) > 0:
             return matches[0]
@@ -1032,28 +2266,113 @@ class Package(object):
             raise ValueError('Parameter to `have_build` must be a Build or BuildConfig')
 
     def add_build(self, _build, replace=False):
-        owned = self.find_build(_build.config)
-        if owned == None or owned.directory != _build.directory:
-            self.builds.append(_build)
-            if not chimi.settings.noact:
-                self.package_set.save_flag = True
-        elif replace:
-            sys.stderr.write("\033[31mWARNING:\033[0m replacing build \"%s\" at %s\n" %
-                             (owned.name, os.path.relpath(owned.directory, self.package_set.directory)))
-            idx = self.builds.index(owned)
-            del self.builds[idx]
-            self.builds.append(_build)
-        else:
-            wrapper = textwrap.TextWrapper(break_long_words=False, break_on_hyphens=False, subsequent_indent=' ' * 4)
-            sys.stderr.write(wrapper.fill("\033[91mERROR:\033[0m cannot overwrite build unless --replace is given: %s" %
-                                          os.path.relpath(owned.directory, chimi.run_cwd)) + "\n")
-            raise RuntimeError('Cowardly refusing to overwrite previous build')
+        with Package._builds_mutex:
+            owned = self.find_build(_build.config)
+            if owned == None or owned.directory != _build.directory:
+                self.insert_build(_build)
+                if not chimi.settings.noact:
+                    self.package_set.record_build_added(_build)
+            elif replace:
+                sys.stderr.write("\033[31mWARNING:\033[0m replacing build \"%s\" at %s\n" %
+                                 (owned.name, os.path.relpath(owned.directory, self.package_set.directory)))
+                self.discard_build(owned)
+                self.insert_build(_build)
+                if not chimi.settings.noact:
+                    self.package_set.record_build_removed(owned)
+                    self.package_set.record_build_added(_build)
+            else:
+                wrapper = textwrap.TextWrapper(break_long_words=False, break_on_hyphens=False, subsequent_indent=' ' * 4)
+                sys.stderr.write(wrapper.fill("\033[91mERROR:\033[0m cannot overwrite build unless --replace is given: %s" %
+                                              os.path.relpath(owned.directory, chimi.run_cwd)) + "\n")
+                raise RuntimeError('Cowardly refusing to overwrite previous build')
 
     def add_existing_builds(self):
         for _build in self.definition.find_existing_builds(self):
             self.add_build(_build)
 
 
+class LazyPackageMap(object):
+    """
+    Dictionary-like map of package names to Package instances that creates
+    each package from its database record only when it is first accessed, so
+    that packages a command doesn't use are never deserialized or validated.
+
+    """
+    def __init__(self, package_set, records=None, packages=None):
+        """
+        records: dict mapping package names to records as produced by
+            `Package.to_record`, or to callables returning such records.
+
+        packages: dict mapping package names to already-instantiated packages.
+
+        """
+        self.package_set = package_set
+        self.records = dict(records) if records else {}
+        self.loaded = dict(packages) if packages else {}
+        self.mutex = threading.RLock()
+
+    def is_loaded(self, name):
+        """Check whether the named package has been instantiated."""
+        return name in self.loaded
+
+    def record(self, name):
+        """
+        Get a plain-data record for the named package without instantiating
+        it.
+
+        """
+        with self.mutex:
+            if name in self.loaded:
+                return self.loaded[name].to_record()
+            record = self.records[name]
+            if callable(record):
+                record = self.records[name] = record()
+            return record
+
+    def __getitem__(self, name):
+        with self.mutex:
+            if not name in self.loaded:
+                package = Package.from_record(self.package_set, self.record(name))
+                self.loaded[name] = package
+                del self.records[name]
+                if chimi.settings.verify_builds and package.check_builds():
+                    self.package_set.save_corrections()
+            return self.loaded[name]
+
+    def __setitem__(self, name, package):
+        with self.mutex:
+            self.records.pop(name, None)
+            self.loaded[name] = package
+
+    def __delitem__(self, name):
+        with self.mutex:
+            if not name in self:
+                raise KeyError(name)
+            self.records.pop(name, None)
+            self.loaded.pop(name, None)
+
+    def __contains__(self, name):
+        return name in self.loaded or name in self.records
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        return self.loaded.keys() + [name for name in self.records if not name in self.loaded]
+
+    def values(self):
+        return [self[name] for name in self.keys()]
+
+    def items(self):
+        return [(name, self[name]) for name in self.keys()]
+
+    def get(self, name, default=None):
+        return self[name] if name in self else default
+
+
 class PackageSet(object):
     """
     A set of package instances, including ChaNGa, required to build ChaNGa.
@@ -1062,17 +2381,33 @@ class PackageSet(object):
 
     """
     SET_FILE = 'chimi.yaml'
+    SNAPSHOT_CACHE = 'chimi.yaml.pickle'
+    """
+    Name of the cache file holding the parsed contents of SET_FILE; see
+    `chimi.cache`.
+
+    """
+
+    LOCK_FILE = 'chimi.lock'
+    """
+    File used to coordinate access to the database among concurrent Chimi
+    processes.
+
+    """
+
     def __init__(self, directory):
         self.directory = directory
         self.save_flag = False
         self.mutex = threading.Lock()
+        self.journal = chimi.journal.Journal(directory)
 
-        self.packages = { 'charm': Package(self, CharmDefinition,
-                                           os.path.join(directory, 'charm')),
-                          'changa': Package(self, ChaNGaDefinition,
-                                            os.path.join(directory, 'changa')),
-                          'utility': Package(self, UtilityDefinition,
-                                             os.path.join(directory, 'utility'))}
+        self.packages = LazyPackageMap(self)
+        self.packages['charm'] = Package(self, CharmDefinition,
+                                         os.path.join(directory, 'charm'))
+        self.packages['changa'] = Package(self, ChaNGaDefinition,
+                                          os.path.join(directory, 'changa'))
+        self.packages['utility'] = Package(self, UtilityDefinition,
+                                           os.path.join(directory, 'utility'))
 
     def __del__(self):
         """Write the database file at object destruction, if necessary."""
@@ -1080,63 +2415,601 @@ class PackageSet(object):
             if self.save_flag:
                 self.save()
 
-    def save(self):
-        """Write the database file to disk."""
+    def package_name(self, package):
+        """Get the key under which `package` is stored in this package set."""
+        if not 'packages' in self.__dict__:
+            return None
+        # Only instantiated packages can be passed in, so there's no need to
+        # look at the others.
+        loaded = self.packages.loaded
+        for name in loaded:
+            if loaded[name] is package:
+                return name
+        return None
+
+    def lock(self, shared=False):
+        """
+        Get an inter-process lock on the database.  Changes are journaled under
+        a shared lock; `save` and `load` take an exclusive or shared lock,
+        respectively, while reading (and writing) the database.
+
+        """
+        return chimi.util.FileLock(os.path.join(self.directory, PackageSet.LOCK_FILE),
+                                   shared=shared)
+
+    def _record(self, method, _build, *args):
+        """
+        Append a change to the journal, or flag the package set for saving if
+        the change can't be journaled.
+
+        """
+        name = self.package_name(_build.package)
+        if name == None or not 'journal' in self.__dict__:
+            # Not fully constructed yet (e.g. during `init`); a full save is
+            # needed anyway.
+            self.save_flag = True
+        else:
+            with self.lock(shared=True):
+                getattr(self.journal, method)(name, _build, *args)
+            if self.journal.needs_compaction:
+                self.save_flag = True
+
+    def record_build_added(self, _build):
+        """Journal the addition of a build to one of the set's packages."""
+        self._record('record_add', _build)
+
+    def record_build_removed(self, _build):
+        """Journal the removal of a build from one of the set's packages."""
+        self._record('record_remove', _build)
+
+    def record_message(self, _build, message):
+        """Journal a new status message for a build."""
+        self._record('record_message', _build, message)
+
+    def to_record(self):
+        """
+        Get a plain-data representation of the package set.  Packages that
+        haven't been instantiated are copied from their records as-is.
+
+        """
+        return { 'directory': self.directory,
+                 'packages': dict((name, self.packages.record(name))
+                                  for name in self.packages) }
+
+    @classmethod
+    def from_record(self, record):
+        """
+        Create a package set from the output of `to_record`.  Packages are
+        instantiated lazily, as they are accessed.
+
+        """
+        out = PackageSet.__new__(PackageSet)
+        out.directory = record['directory']
+        out.save_flag = False
+        out.mutex = threading.Lock()
+        out.packages = LazyPackageMap(out, records=record['packages'])
+        return out
+
+    @classmethod
+    def read_snapshot(self, directory):
+        """
+        Read the package-set file in `directory`.  Returns a tuple of the
+        package-set record and a flag indicating whether the file was in an
+        obsolete format and should be rewritten.
+
+        """
+        # Parsing the database is slow, so we keep a pickled copy of the
+        # result keyed on the database file's contents.
+        set_file = os.path.join(directory, PackageSet.SET_FILE)
+        data = file(set_file, 'r').read()
+        key = chimi.cache.file_key(set_file, data)
+        cache_file = chimi.cache.path(directory, PackageSet.SNAPSHOT_CACHE)
+        record = chimi.cache.load(cache_file, key)
+        if record is None:
+            record = yaml.load(data, Loader=getattr(yaml, 'CLoader', yaml.Loader))
+            if isinstance(record, PackageSet):
+                # Database written by an older version of Chimi, which
+                # serialized the package objects themselves.  Convert it to
+                # the record format.
+                old = record
+                old.mutex = threading.Lock()
+                old.packages = LazyPackageMap(old, packages=old.packages)
+                record = old.to_record()
+                # Keep the converted object from trying to save itself.
+                old.__dict__.pop('save_flag', None)
+                return (record, True)
+            chimi.cache.store(cache_file, key, record)
+        return (record, False)
+
+    def read_stored(self):
+        """
+        Read the current contents of the database from disk, including any
+        changes made by other processes since this package set was loaded.
+        The caller should hold the database lock.
+
+        """
+        store = self.__dict__.get('store')
+        if store:
+            return store.read_record(self.directory)
+        elif not os.path.exists(os.path.join(self.directory, PackageSet.SET_FILE)):
+            return { 'directory': self.directory, 'packages': {} }
+
+        record = PackageSet.read_snapshot(self.directory)[0]
+        packages = record['packages']
+        indices = dict((name, chimi.journal.Journal.index_record(packages[name]))
+                       for name in packages)
+        for entry in chimi.journal.Journal(self.directory).entries():
+            if entry['package'] in packages:
+                chimi.journal.Journal.apply_to_record(packages[entry['package']], entry,
+                                                      indices[entry['package']])
+        return record
+
+    def merge_stored(self, stored):
+        """
+        Merge the package set's contents into `stored`, a record of the
+        database's current contents as returned by `read_stored`.  Builds added
+        by this process are kept unless another process has since removed
+        them, and vice versa; message histories are combined.
+
+        Instantiated packages are updated in place to match the result, which
+        is returned.
+
+        """
+        packages = stored['packages']
+        stored['directory'] = self.directory
+        for name in self.packages.keys():
+            if not self.packages.is_loaded(name):
+                # Not touched by this process, so the stored record is at least
+                # as recent as ours.
+                if name in packages:
+                    self.packages.records[name] = packages[name]
+                else:
+                    packages[name] = self.packages.record(name)
+                continue
+
+            package = self.packages[name]
+            if name in packages:
+                stored_builds = dict((b['uuid'], b) for b in packages[name]['builds'])
+                ours = set()
+                builds = []
+                for _build in package.builds:
+                    _uuid = str(_build.uuid)
+                    ours.add(_uuid)
+                    if _uuid in stored_builds:
+                        # Pick up any messages written by other processes.
+                        have = set((m.to_record()['time'], m.status.value)
+                                   for m in _build.messages)
+                        new = [BuildMessage.from_record(m)
+                               for m in stored_builds[_uuid]['messages']
+                               if not (m['time'], m['status']) in have]
+                        if len(new) > 0:
+                            _build.messages.extend(new)
+                            _build.messages.sort()
+                        if _build.commit == None:
+                            _build.commit = stored_builds[_uuid].get('commit')
+                        builds.append(_build)
+                    elif not _uuid in package.stored_uuids:
+                        # Added by this process.
+                        builds.append(_build)
+                    # ...otherwise removed by another process.
+
+                for b in packages[name]['builds']:
+                    if not b['uuid'] in ours and not b['uuid'] in package.stored_uuids:
+                        # Added by another process.
+                        builds.append(Build.from_record(package, b))
+                package.builds = builds
+
+            packages[name] = package.to_record()
+            package.stored_uuids = set(b['uuid'] for b in packages[name]['builds'])
+        return stored
+
+    def save(self, merge=True):
+        """
+        Write the database file to disk.  Changes made by other processes since
+        the package set was loaded are merged in, and any journaled changes are
+        folded into the new snapshot, so the journal is emptied afterwards.
+
+        merge: if False, overwrite the stored contents instead of merging with
+            them (e.g. when the package set was read from a different backend).
+
+        """
         assert(chimi.settings.noact == False)
-        self.mutex.acquire()
-        mtx = self.mutex
-        try:
+        with self.mutex:
             if not 'save_flag' in self.__dict__ or self.save_flag:
-                # Remove some values from stuff to avoid writing those values
-                # to the YAML package-set file.
-                del self.__dict__['mutex']
-                if 'save_flag' in self.__dict__:
-                    del self.__dict__['save_flag']
-                repos = {}
-                branches = {}
-                for pkg in self.packages:
-                    if '_repository' in self.packages[pkg].__dict__:
-                        repos[pkg] = self.packages[pkg]._repository
-                        del self.packages[pkg]._repository
-                    if '_branches' in self.packages[pkg].__dict__:
-                        branches[pkg] = self.packages[pkg]._branches
-                        del self.packages[pkg]._branches
-
-                file(os.path.join(self.directory, PackageSet.SET_FILE),
-                     'w').write(yaml.dump(self))
-
-                for pkg in repos:
-                    self.packages[pkg]._repository = repos[pkg]
-                for pkg in branches:
-                    self.packages[pkg]._branches = branches[pkg]
+                with self.lock():
+                    if merge:
+                        record = self.merge_stored(self.read_stored())
+                    else:
+                        record = self.to_record()
+                    store = self.__dict__.get('store')
+                    if store:
+                        store.write_record(record)
+                    else:
+                        set_file = os.path.join(self.directory, PackageSet.SET_FILE)
+                        data = yaml.dump(record, default_flow_style=False,
+                                         Dumper=getattr(yaml, 'CSafeDumper', yaml.SafeDumper))
+                        chimi.util.write_file_atomically(set_file, data)
+                        chimi.cache.store(chimi.cache.path(self.directory,
+                                                           PackageSet.SNAPSHOT_CACHE),
+                                          chimi.cache.file_key(set_file, data), record)
+                        if 'journal' in self.__dict__:
+                            self.journal.truncate()
                 self.save_flag = False
-                self.mutex = mtx
-        finally:
-            self.mutex = mtx
-            self.mutex.release()
+
+    def save_corrections(self):
+        """
+        Save the package set if it has been flagged as changed while loading or
+        checking its packages.  This happens even if the global `noact` flag is
+        set, since `save_flag` set in such a case indicates that there were
+        e.g. inconsistencies to remove.
+
+        """
+        if 'save_flag' in self.__dict__ and self.save_flag:
+            noact = chimi.settings.noact
+            chimi.settings.noact = False
+            try:
+                self.save()
+            finally:
+                chimi.settings.noact = noact
 
     def __getitem__(self, name):
         return self.packages[name]
 
+    def find_builds(self, package_name, name=None, _uuid=None, branch=None,
+                    architectures=None):
+        """
+        Find builds of the named package matching every given criterion.  If
+        the package set is backed by an SQLiteStore, the store's indexes are
+        queried and only the matching builds are read.
+
+        """
+        package = self.packages[package_name]
+        store = self.__dict__.get('store')
+        if store:
+            return package.builds_by_uuid(store.find_build_uuids(package_name, name=name,
+                                                                 _uuid=_uuid, branch=branch,
+                                                                 architectures=architectures))
+        else:
+            return filter(lambda b: (name == None or b.name == name) and
+                          (_uuid == None or str(b.uuid) == _uuid) and
+                          (branch == None or b.config.branch == branch) and
+                          (architectures == None or
+                           str(b.config.architecture) in architectures),
+                          package.builds)
+
     @classmethod
     def load(self, directory):
         """Load the database file from disk."""
 
-        out = yaml.load(file(os.path.join(directory, PackageSet.SET_FILE),
-                             'r').read())
-        if not 'mutex' in out.__dict__:
-            out.mutex = threading.Lock()
+        with chimi.util.FileLock(os.path.join(directory, PackageSet.LOCK_FILE), shared=True):
+            if SQLiteStore.exists(directory):
+                store = SQLiteStore(directory)
+                out = store.load(directory)
+                out.store = store
+                out.journal = store
+            else:
+                record, convert = PackageSet.read_snapshot(directory)
+                out = PackageSet.from_record(record)
+                if convert:
+                    out.save_flag = True
+
+                # Apply changes recorded since the snapshot was written, and
+                # fold them back into the snapshot if there are many of them.
+                out.journal = chimi.journal.Journal(directory)
+                if out.journal.replay(out) > 0 and out.journal.needs_compaction:
+                    out.save_flag = True
+
+        out.save_corrections()
+        return out
 
 
-        if 'save_flag' in out.__dict__:
-            # Allow saving immediately after loading even if the global `noact`
-            # flag is set; `save_flag` set in such a case indicates that there
-            # were e.g. inconsistencies to remove.
-            noact = chimi.settings.noact
-            chimi.settings.noact = False
+class SQLiteStore(object):
+    """
+    Optional SQLite-backed storage for a package set.  When a workspace
+    contains a store file, it is used in place of "chimi.yaml" and its journal;
+    builds are indexed by UUID, name, branch, architecture, and configuration
+    fingerprint so that build queries don't need to scan every build.
+
+    The store implements the same `record_*` interface as
+    `chimi.journal.Journal`, so changes are written as they happen.
+
+    """
+    FILE = 'chimi.sqlite'
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS package_set (
+        directory TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS packages (
+        name TEXT PRIMARY KEY,
+        definition TEXT NOT NULL,
+        directory TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS builds (
+        uuid TEXT PRIMARY KEY,
+        package TEXT NOT NULL REFERENCES packages(name),
+        name TEXT NOT NULL,
+        directory TEXT NOT NULL,
+        architecture TEXT,
+        branch TEXT,
+        fingerprint TEXT NOT NULL,
+        config TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS builds_name ON builds(package, name);
+    CREATE INDEX IF NOT EXISTS builds_branch ON builds(package, branch);
+    CREATE INDEX IF NOT EXISTS builds_architecture ON builds(package, architecture);
+    CREATE INDEX IF NOT EXISTS builds_fingerprint ON builds(package, fingerprint);
+    CREATE TABLE IF NOT EXISTS messages (
+        build TEXT NOT NULL REFERENCES builds(uuid) ON DELETE CASCADE,
+        time REAL NOT NULL,
+        status INTEGER NOT NULL,
+        message TEXT
+    );
+    CREATE INDEX IF NOT EXISTS messages_build ON messages(build, time);
+    CREATE TABLE IF NOT EXISTS build_commits (
+        build TEXT PRIMARY KEY REFERENCES builds(uuid) ON DELETE CASCADE,
+        hash TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS message_logs (
+        build TEXT NOT NULL REFERENCES builds(uuid) ON DELETE CASCADE,
+        time REAL NOT NULL,
+        path TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS message_logs_build ON message_logs(build, time);
+    CREATE TABLE IF NOT EXISTS message_timings (
+        build TEXT NOT NULL REFERENCES builds(uuid) ON DELETE CASCADE,
+        time REAL NOT NULL,
+        wall REAL,
+        user REAL,
+        system REAL,
+        max_rss INTEGER
+    );
+    CREATE INDEX IF NOT EXISTS message_timings_build ON message_timings(build, time);
+    CREATE TABLE IF NOT EXISTS message_sources (
+        build TEXT NOT NULL REFERENCES builds(uuid) ON DELETE CASCADE,
+        time REAL NOT NULL,
+        fingerprint TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS message_sources_build ON message_sources(build, time);
+    """
+
+    needs_compaction = False
+    """Changes are written in place, so there is never a journal to fold."""
+
+    @classmethod
+    def exists(self, directory):
+        """Check whether `directory` contains a package-set store."""
+        return os.path.exists(os.path.join(directory, SQLiteStore.FILE))
 
-            out.save()
+    def __init__(self, directory):
+        import sqlite3
+        self.path = os.path.join(directory, SQLiteStore.FILE)
+        self.mutex = threading.Lock()
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.connection.text_factory = str
+        self.connection.execute('PRAGMA foreign_keys = ON')
+        self.connection.executescript(SQLiteStore.SCHEMA)
+
+    @classmethod
+    def timing_row(self, timing):
+        """Get the `message_timings` columns for a message's timing record."""
+        return tuple(timing.get(k) for k in ('wall', 'user', 'system', 'max_rss'))
+
+    def _insert_build(self, package, definition, record):
+        config = record['config']
+        self.connection.execute('INSERT OR REPLACE INTO builds VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                                (record['uuid'], package, record['name'],
+                                 record['directory'], config['architecture'],
+                                 config['branch'],
+                                 BuildConfig.fingerprint_record(definition.name, config),
+                                 json.dumps(config)))
+        self.connection.execute('DELETE FROM messages WHERE build = ?', (record['uuid'],))
+        self.connection.executemany('INSERT INTO messages VALUES (?, ?, ?, ?)',
+                                    [(record['uuid'], m['time'], m['status'], m['message'])
+                                     for m in record['messages']])
+        self.connection.execute('DELETE FROM message_logs WHERE build = ?', (record['uuid'],))
+        self.connection.executemany('INSERT INTO message_logs VALUES (?, ?, ?)',
+                                    [(record['uuid'], m['time'], m['log'])
+                                     for m in record['messages'] if m.get('log') != None])
+        self.connection.execute('DELETE FROM message_timings WHERE build = ?', (record['uuid'],))
+        self.connection.executemany('INSERT INTO message_timings VALUES (?, ?, ?, ?, ?, ?)',
+                                    [(record['uuid'], m['time']) + self.timing_row(m['timing'])
+                                     for m in record['messages'] if m.get('timing') != None])
+        self.connection.execute('DELETE FROM message_sources WHERE build = ?', (record['uuid'],))
+        self.connection.executemany('INSERT INTO message_sources VALUES (?, ?, ?)',
+                                    [(record['uuid'], m['time'], json.dumps(m['sources']))
+                                     for m in record['messages'] if m.get('sources') != None])
+        self.connection.execute('DELETE FROM build_commits WHERE build = ?', (record['uuid'],))
+        if record.get('commit') != None:
+            self.connection.execute('INSERT INTO build_commits VALUES (?, ?)',
+                                    (record['uuid'], record['commit']))
+
+    def write(self, package_set):
+        """Replace the store's contents with those of `package_set`."""
+        # Fetch every package's record before clearing the tables, since
+        # records for packages that haven't been instantiated may still need
+        # to be read from the store.
+        self.write_record(package_set.to_record())
+
+    def write_record(self, record):
+        """
+        Replace the store's contents with those of a package-set record (as
+        produced by `PackageSet.to_record`).
+
+        """
+        packages = record['packages']
+        with self.mutex:
+            with self.connection:
+                for table in ('messages', 'message_logs', 'message_timings', 'message_sources',
+                              'build_commits', 'builds', 'packages', 'package_set'):
+                    self.connection.execute('DELETE FROM %s' % table)
+                self.connection.execute('INSERT INTO package_set VALUES (?)',
+                                        (record['directory'],))
+                for name in packages:
+                    package = packages[name]
+                    self.connection.execute('INSERT INTO packages VALUES (?, ?, ?)',
+                                            (name, package['definition'], package['directory']))
+                    definition = getattr(sys.modules[__name__], package['definition'])
+                    for build_record in package['builds']:
+                        self._insert_build(name, definition, build_record)
+
+    def package_info(self, name):
+        """Get the definition-class name and directory of a stored package."""
+        with self.mutex:
+            return self.connection.execute('SELECT definition, directory FROM packages '
+                                           'WHERE name = ?', (name,)).fetchone()
+
+    def package_record(self, name, uuids=None):
+        """
+        Read the record (as produced by `Package.to_record`) for a single
+        package from the store.
 
-            chimi.settings.noact = noact
+        uuids: if given, only the builds with these UUIDs are included.
 
+        """
+        definition, directory = self.package_info(name)
+        if uuids == None:
+            builds = self._build_records(name, '', [])
+        else:
+            builds = []
+            uuids = list(uuids)
+            # Stay well below SQLite's limit on the number of query parameters.
+            for start in range(0, len(uuids), 500):
+                chunk = uuids[start:start + 500]
+                builds.extend(self._build_records(name, ' AND b.uuid IN (%s)' %
+                                                  ','.join('?' * len(chunk)), chunk))
+        return { 'definition': definition, 'directory': directory, 'builds': builds }
+
+    def _build_records(self, name, condition, params):
+        """
+        Read the records of the builds of package `name` that satisfy the SQL
+        `condition` (on the `builds` table, as "b").
+
+        """
+        params = [name] + list(params)
+        with self.mutex:
+            logs = dict(((row[0], row[1]), row[2])
+                        for row in self.connection.execute('SELECT l.build, l.time, l.path '
+                                                           'FROM message_logs l JOIN builds b '
+                                                           'ON l.build = b.uuid WHERE b.package = ?'
+                                                           + condition, params))
+            timings = dict(((row[0], row[1]), dict(zip(('wall', 'user', 'system', 'max_rss'),
+                                                         row[2:])))
+                           for row in self.connection.execute('SELECT t.build, t.time, t.wall, '
+                                                              't.user, t.system, t.max_rss '
+                                                              'FROM message_timings t JOIN builds b '
+                                                              'ON t.build = b.uuid WHERE b.package = ?'
+                                                              + condition, params))
+            sources = dict(((row[0], row[1]), row[2])
+                           for row in self.connection.execute('SELECT s.build, s.time, s.fingerprint '
+                                                              'FROM message_sources s JOIN builds b '
+                                                              'ON s.build = b.uuid WHERE b.package = ?'
+                                                              + condition, params))
+            messages = {}
+            for row in self.connection.execute('SELECT m.build, m.time, m.status, m.message '
+                                               'FROM messages m JOIN builds b ON m.build = b.uuid '
+                                               'WHERE b.package = ?' + condition +
+                                               ' ORDER BY m.build, m.time', params):
+                message = {'time': row[1], 'status': row[2], 'message': row[3]}
+                if (row[0], row[1]) in logs:
+                    message['log'] = logs[(row[0], row[1])]
+                if (row[0], row[1]) in timings:
+                    message['timing'] = timings[(row[0], row[1])]
+                if (row[0], row[1]) in sources:
+                    message['sources'] = chimi.util.json_loads(sources[(row[0], row[1])])
+                messages.setdefault(row[0], []).append(message)
+            commits = dict(self.connection.execute('SELECT c.build, c.hash '
+                                                   'FROM build_commits c JOIN builds b ON c.build = b.uuid '
+                                                   'WHERE b.package = ?' + condition, params))
+            return [{ 'uuid': row[0],
+                      'name': row[1],
+                      'directory': row[2],
+                      'config': chimi.util.json_loads(row[3]),
+                      'commit': commits.get(row[0]),
+                      'messages': messages.get(row[0], []) }
+                    for row in self.connection.execute('SELECT b.uuid, b.name, b.directory, b.config '
+                                                       'FROM builds b WHERE b.package = ?' + condition,
+                                                       params)]
+
+    def package_names(self):
+        """Get the names of all packages in the store."""
+        return [row[0] for row in self.connection.execute('SELECT name FROM packages')]
+
+    def read_record(self, directory):
+        """Read the store's entire contents as a package-set record."""
+        return { 'directory': directory,
+                 'packages': dict((name, self.package_record(name))
+                                  for name in self.package_names()) }
+
+    def load(self, directory):
+        """
+        Create a package set from the store's contents.  Builds are read from
+        the store only as they are needed: lookups by configuration, name, or
+        UUID read just the matching builds, and the rest are read when a
+        package's full build list is first used.
+
+        """
+        out = PackageSet.from_record({ 'directory': directory, 'packages': {} })
+        for name in self.package_names():
+            out.packages[name] = Package.from_store(out, self, name)
         return out
+
+    def find_build_uuids(self, package, name=None, _uuid=None, branch=None,
+                         architectures=None, fingerprint=None):
+        """
+        Find the UUIDs of all builds of `package` that match every given
+        criterion.
+
+        """
+        query = 'SELECT uuid FROM builds WHERE package = ?'
+        params = [package]
+        for column, value in (('name', name), ('uuid', _uuid), ('branch', branch),
+                              ('fingerprint', fingerprint)):
+            if value != None:
+                query += ' AND %s = ?' % column
+                params.append(value)
+        if architectures != None:
+            architectures = list(architectures)
+            query += ' AND architecture IN (%s)' % ','.join('?' * len(architectures))
+            params.extend(architectures)
+        with self.mutex:
+            return [row[0] for row in self.connection.execute(query, params)]
+
+    def record_add(self, package, _build):
+        """Add a build to the store."""
+        with self.mutex:
+            with self.connection:
+                self._insert_build(package, _build.package.definition,
+                                   _build.to_record())
+
+    def record_remove(self, package, _build):
+        """Remove a build and its messages from the store."""
+        with self.mutex:
+            with self.connection:
+                self.connection.execute('DELETE FROM builds WHERE uuid = ?', (str(_build.uuid),))
+
+    def record_message(self, package, _build, message):
+        """Add a status message for a build to the store."""
+        m = message.to_record()
+        with self.mutex:
+            with self.connection:
+                self.connection.execute('INSERT INTO messages VALUES (?, ?, ?, ?)',
+                                        (str(_build.uuid), m['time'], m['status'], m['message']))
+                if m.get('log') != None:
+                    self.connection.execute('INSERT INTO message_logs VALUES (?, ?, ?)',
+                                            (str(_build.uuid), m['time'], m['log']))
+                if m.get('timing') != None:
+                    self.connection.execute('INSERT INTO message_timings VALUES (?, ?, ?, ?, ?, ?)',
+                                            (str(_build.uuid), m['time']) +
+                                            self.timing_row(m['timing']))
+                if m.get('sources') != None:
+                    self.connection.execute('INSERT INTO message_sources VALUES (?, ?, ?)',
+                                            (str(_build.uuid), m['time'],
+                                             json.dumps(m['sources'])))
+                if _build.commit != None:
+                    self.connection.execute('INSERT OR REPLACE INTO build_commits VALUES (?, ?)',
+                                            (str(_build.uuid), _build.commit))
+
+    def truncate(self):
+        """Provided for compatibility with `chimi.journal.Journal`."""
+        pass
@@ -543,9 +543,9 @@ def run(opts, *args, **kwargs):
     if 'build' in opts:
         # A build was specified by the user; see if we have one with that name
         # or UUID.
-        matches = filter(lambda x: x.name == opts['build'], ps.packages['changa'].builds)
+        matches = ps.find_builds('changa', name=opts['build'])
         if len(matches) == 0:
-            matches = filter(lambda x: str(x.uuid) == opts['build'], ps.packages['changa'].builds)
+            matches = ps.find_builds('changa', _uuid=opts['build'])
 
         if len(matches) == 0:
             sys.stderr.write('no builds with that name or UUID: ')
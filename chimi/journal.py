@@ -0,0 +1,259 @@
+# chimi: a companion tool for ChaNGa: package-set change journal
+# Copyright (C) 2014 Collin J. Sutton
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# The GNU General Public License version 2 may be found at
+# <http://www.gnu.org/licenses/gpl-2.0.html>.
+
+"""
+Append-only journal of changes made to a package set since the last time its
+database file was written.
+
+Rewriting the whole database every time a build reports its status is
+expensive for workspaces with many builds, so build additions, removals and
+status messages are instead appended -- one JSON object per line -- to a
+journal file next to the database.  `chimi.core.PackageSet.load` replays the
+journal on top of the database snapshot, and `chimi.core.PackageSet.save`
+folds it back into the snapshot.
+
+"""
+
+__author__    = 'Collin J. Sutton'
+__copyright__ = 'Copyright (C) 2014 Collin J. Sutton'
+__license__   = 'GPLv2'
+
+import os
+import sys
+import json
+import threading
+
+import chimi
+import chimi.util
+import chimi.settings
+from chimi.build import Build
+from chimi.build import BuildMessage
+
+__all__ = ['Journal']
+
+
+class Journal(object):
+    """
+    Append-only log of build additions, removals, and status messages for a
+    package set.
+
+    """
+    FILE = 'chimi.journal'
+
+    COMPACT_THRESHOLD = 256
+    """
+    Number of journal entries beyond which the journal should be folded back
+    into the database snapshot.
+
+    """
+
+    def __init__(self, directory):
+        self.path = os.path.join(directory, Journal.FILE)
+        self.mutex = threading.Lock()
+        self.length = self.count_entries()
+
+    def count_entries(self):
+        """Count the (complete) entries in the journal file without parsing them."""
+        if not os.path.exists(self.path):
+            return 0
+        count = 0
+        with open(self.path, 'rb') as f:
+            while True:
+                chunk = f.read(65536)
+                if len(chunk) == 0:
+                    break
+                count += chunk.count('\n')
+        return count
+
+    @property
+    def needs_compaction(self):
+        """Whether the journal has grown past `COMPACT_THRESHOLD` entries."""
+        return self.length != None and self.length > Journal.COMPACT_THRESHOLD
+
+    def append(self, event, package, **data):
+        """
+        Append an entry to the journal.
+
+        event: one of 'add', 'remove', or 'message'.
+
+        package: key of the affected package in the package set.
+
+        """
+        assert(chimi.settings.noact == False)
+        data['event'] = event
+        data['package'] = package
+        line = json.dumps(data, sort_keys=True) + '\n'
+
+        with self.mutex:
+            # A single `write` on a descriptor opened with O_APPEND keeps
+            # entries from separate processes from interleaving.
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0644)
+            try:
+                os.write(fd, line)
+            finally:
+                os.close(fd)
+            if self.length != None:
+                self.length += 1
+
+    def record_add(self, package, _build):
+        """Record the addition of a build to a package."""
+        self.append('add', package, build=_build.to_record())
+
+    def record_remove(self, package, _build):
+        """Record the removal of a build from a package."""
+        self.append('remove', package, uuid=str(_build.uuid))
+
+    def record_message(self, package, _build, message):
+        """
+        Record a new status message for a build, along with the build's
+        resolved source commit if it has one.
+
+        """
+        if _build.commit != None:
+            self.append('message', package, uuid=str(_build.uuid),
+                        message=message.to_record(), commit=_build.commit)
+        else:
+            self.append('message', package, uuid=str(_build.uuid),
+                        message=message.to_record())
+
+    def entries(self):
+        """
+        Read all entries from the journal.  A truncated final line (as left by
+        an interrupted write) is ignored.
+
+        """
+        out = []
+        if not os.path.exists(self.path):
+            return out
+        for line in file(self.path, 'r'):
+            if not line.endswith('\n'):
+                break
+            try:
+                out.append(chimi.util.json_loads(line))
+            except ValueError:
+                sys.stderr.write("\033[31mWARNING:\033[0m ignoring corrupt entry in %s\n" %
+                                 self.path)
+        return out
+
+    def replay(self, package_set):
+        """
+        Apply all journal entries to `package_set`, which should have been
+        freshly loaded from the database snapshot.  Entries for packages that
+        haven't been instantiated are applied to the packages' records.
+        Returns the number of entries read.
+
+        """
+        entries = self.entries()
+        # Builds of each package by UUID, built once and kept up to date as
+        # entries are applied.
+        indices = {}
+        for entry in entries:
+            name = entry['package']
+            if not name in package_set.packages:
+                continue
+            if package_set.packages.is_loaded(name):
+                package = package_set.packages[name]
+                if not name in indices:
+                    indices[name] = Journal.index(package)
+                self.apply(package, entry, indices[name])
+            else:
+                record = package_set.packages.record(name)
+                if not name in indices:
+                    indices[name] = Journal.index_record(record)
+                self.apply_to_record(record, entry, indices[name])
+        self.length = len(entries)
+        return self.length
+
+    @classmethod
+    def index(self, package):
+        """Map the UUIDs of a Package instance's builds to the builds."""
+        return dict((str(b.uuid), b) for b in package.builds)
+
+    @classmethod
+    def index_record(self, record):
+        """Map the UUIDs of the builds in a package record to their records."""
+        return dict((b['uuid'], b) for b in record['builds'])
+
+    @classmethod
+    def apply(self, package, entry, by_uuid=None):
+        """
+        Apply a single journal entry to a Package instance.
+
+        by_uuid: index of the package's builds as returned by `index`, which
+            is updated to reflect the entry.  Built on demand if not given.
+
+        """
+        if by_uuid == None:
+            by_uuid = Journal.index(package)
+        event = entry['event']
+
+        if event == 'add':
+            record = entry['build']
+            if not record['uuid'] in by_uuid:
+                _build = Build.from_record(package, record)
+                package.insert_build(_build)
+                by_uuid[record['uuid']] = _build
+        elif event == 'remove':
+            if entry['uuid'] in by_uuid:
+                package.discard_build(by_uuid.pop(entry['uuid']))
+        elif event == 'message':
+            if entry['uuid'] in by_uuid:
+                _build = by_uuid[entry['uuid']]
+                msg = BuildMessage.from_record(entry['message'])
+                if not any(m.time == msg.time and m.status == msg.status
+                           for m in _build.messages):
+                    _build.messages.append(msg)
+                if 'commit' in entry:
+                    _build.commit = entry['commit']
+
+    @classmethod
+    def apply_to_record(self, record, entry, by_uuid=None):
+        """
+        Apply a single journal entry to a package record (as produced by
+        `chimi.core.Package.to_record`).
+
+        by_uuid: index of the record's builds as returned by `index_record`,
+            which is updated to reflect the entry.  Built on demand if not
+            given.
+
+        """
+        if by_uuid == None:
+            by_uuid = Journal.index_record(record)
+        event = entry['event']
+
+        if event == 'add':
+            if not entry['build']['uuid'] in by_uuid:
+                record['builds'].append(entry['build'])
+                by_uuid[entry['build']['uuid']] = entry['build']
+        elif event == 'remove':
+            if entry['uuid'] in by_uuid:
+                record['builds'].remove(by_uuid.pop(entry['uuid']))
+        elif event == 'message':
+            if entry['uuid'] in by_uuid:
+                messages = by_uuid[entry['uuid']]['messages']
+                msg = entry['message']
+                if not any(m['time'] == msg['time'] and m['status'] == msg['status']
+                           for m in messages):
+                    messages.append(msg)
+                if 'commit' in entry:
+                    by_uuid[entry['uuid']]['commit'] = entry['commit']
+
+    def truncate(self):
+        """Discard all journal entries, e.g. after writing a new snapshot."""
+        with self.mutex:
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+            self.length = 0
@@ -0,0 +1,252 @@
+# chimi: a companion tool for ChaNGa: cached git repository metadata
+# Copyright (C) 2014 Collin J. Sutton
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# The GNU General Public License version 2 may be found at
+# <http://www.gnu.org/licenses/gpl-2.0.html>.
+
+"""
+Cached metadata -- refs, HEAD, remotes, and tags -- for a package's git
+repository.
+
+Querying these through GitPython costs one or more `git` processes per
+question, and Chimi asks the same questions many times per run.
+`RepositoryMetadata` instead reads everything with one `git for-each-ref` and
+one `git config` invocation, reads HEAD directly, and keeps the result until
+the repository's HEAD, packed-refs, refs, or config files change.  The "refs"
+tree is walked only once per process (and again after `invalidate`), since
+walking it on every lookup is slow on parallel filesystems; changes Chimi makes
+to refs itself are followed by a call to `invalidate`.
+
+"""
+
+__author__    = 'Collin J. Sutton'
+__copyright__ = 'Copyright (C) 2014 Collin J. Sutton'
+__license__   = 'GPLv2'
+
+import os
+import re
+import threading
+import subprocess
+
+import chimi.cache
+
+__all__ = ['RepositoryMetadata', 'find_git_dir']
+
+
+def find_git_dir(directory):
+    """
+    Find the git directory for the work tree at `directory`, following
+    "gitdir:" links as used by linked worktrees.  Returns None if `directory`
+    is not a git work tree.
+
+    """
+    dotgit = os.path.join(directory, '.git')
+    if os.path.isdir(dotgit):
+        return dotgit
+    elif os.path.isfile(dotgit):
+        m = re.match(r'^gitdir:\s*(.*?)\s*$', file(dotgit, 'r').read())
+        if m:
+            return os.path.normpath(os.path.join(directory, m.group(1)))
+    return None
+
+
+class RepositoryMetadata(object):
+    """
+    Refs, HEAD, remotes, and tags for a git repository, read in a single batch
+    and cached both in memory and (if `cache_file` is given) on disk.
+
+    """
+
+    _instances = {}
+    _instances_mutex = threading.Lock()
+
+    @classmethod
+    def get(self, directory, cache_file=None):
+        """
+        Get the (shared) metadata object for the work tree at `directory`.
+
+        """
+        directory = os.path.abspath(directory)
+        with self._instances_mutex:
+            if not directory in self._instances:
+                self._instances[directory] = RepositoryMetadata(directory, cache_file)
+            return self._instances[directory]
+
+    def __init__(self, directory, cache_file=None):
+        self.directory = directory
+        self.cache_file = cache_file
+        self.mutex = threading.Lock()
+        self._key = None
+        self._data = None
+        self._refs_key = None
+
+    @property
+    def git_dir(self):
+        return find_git_dir(self.directory)
+
+    def get_key(self, git_dir):
+        """
+        Compute a key that changes whenever the repository's refs, HEAD, or
+        configuration change.  Ref updates replace files inside the "refs"
+        directories, so those directories' modification times are included;
+        apart from the top-level ones, they're read only once per process.
+
+        """
+        common_dir = git_dir
+        commondir_file = os.path.join(git_dir, 'commondir')
+        if os.path.exists(commondir_file):
+            common_dir = os.path.normpath(os.path.join(git_dir,
+                                                       file(commondir_file, 'r').read().strip()))
+
+        key = [git_dir]
+        for path in (os.path.join(git_dir, 'HEAD'),
+                     os.path.join(common_dir, 'packed-refs'),
+                     os.path.join(common_dir, 'config')):
+            try:
+                key.append(os.stat(path).st_mtime)
+            except OSError:
+                key.append(None)
+        refs = os.path.join(common_dir, 'refs')
+        for path in (refs, os.path.join(refs, 'heads'), os.path.join(refs, 'tags'),
+                     os.path.join(refs, 'remotes')):
+            try:
+                key.append(os.stat(path).st_mtime)
+            except OSError:
+                key.append(None)
+        if self._refs_key == None:
+            self._refs_key = []
+            for dirpath, dirnames, filenames in os.walk(refs):
+                dirnames.sort()
+                self._refs_key.append((dirpath, os.stat(dirpath).st_mtime))
+        key.append(self._refs_key)
+        return key
+
+    def _git(self, *args):
+        return subprocess.check_output(('git',) + args, cwd=self.directory)
+
+    def read(self, git_dir):
+        """Read the repository's metadata."""
+        data = { 'head_ref': None, 'head_commit': None,
+                 'branches': {}, 'remote_branches': {}, 'tags': {}, 'remotes': [] }
+
+        head = file(os.path.join(git_dir, 'HEAD'), 'r').read().strip()
+        if head.startswith('ref:'):
+            data['head_ref'] = head[4:].strip()
+        else:
+            data['head_commit'] = head
+
+        refs = self._git('for-each-ref', '--format=%(refname)%00%(objectname)%00%(*objectname)')
+        for line in refs.split('\n'):
+            if len(line) == 0:
+                continue
+            refname, objectname, peeled = line.split('\0')
+            if refname.startswith('refs/heads/'):
+                data['branches'][refname[len('refs/heads/'):]] = objectname
+            elif refname.startswith('refs/remotes/'):
+                if not refname.endswith('/HEAD'):
+                    data['remote_branches'][refname[len('refs/remotes/'):]] = objectname
+            elif refname.startswith('refs/tags/'):
+                # Annotated tags refer to tag objects; use the tagged commit.
+                data['tags'][refname[len('refs/tags/'):]] = peeled if peeled else objectname
+
+        if data['head_ref'] != None and data['head_ref'].startswith('refs/heads/'):
+            data['head_commit'] = data['branches'].get(data['head_ref'][len('refs/heads/'):])
+
+        try:
+            config = self._git('config', '-z', '--get-regexp', r'^remote\..*\.url$')
+        except subprocess.CalledProcessError:
+            # No remotes configured.
+            config = ''
+        for entry in config.split('\0'):
+            if len(entry) == 0:
+                continue
+            name, url = entry.split('\n', 1)
+            data['remotes'].append((name[len('remote.'):-len('.url')], url))
+        data['remotes'].sort()
+        return data
+
+    @property
+    def data(self):
+        """All metadata, refreshed if the repository has changed."""
+        with self.mutex:
+            git_dir = self.git_dir
+            if git_dir == None:
+                return None
+            key = self.get_key(git_dir)
+            if key != self._key:
+                data = None
+                if self.cache_file:
+                    data = chimi.cache.load(self.cache_file, key)
+                if data == None:
+                    data = self.read(git_dir)
+                    if self.cache_file:
+                        chimi.cache.store(self.cache_file, key, data)
+                self._key = key
+                self._data = data
+            return self._data
+
+    def invalidate(self):
+        """Forget the cached metadata, e.g. after changing the repository."""
+        with self.mutex:
+            self._key = None
+            self._data = None
+            self._refs_key = None
+
+    @property
+    def branches(self):
+        """Names of all local branches."""
+        data = self.data
+        return sorted(data['branches'].keys()) if data else []
+
+    @property
+    def remote_branches(self):
+        """Map of remote-tracking branch names ("REMOTE/BRANCH") to commits."""
+        data = self.data
+        return dict(data['remote_branches']) if data else {}
+
+    @property
+    def tags(self):
+        """Map of tag names to the commits they refer to."""
+        data = self.data
+        return dict(data['tags']) if data else {}
+
+    @property
+    def remotes(self):
+        """List of (name, URL) tuples for the repository's remotes."""
+        data = self.data
+        return list(data['remotes']) if data else []
+
+    @property
+    def head_commit(self):
+        """Commit currently checked out."""
+        data = self.data
+        return data['head_commit'] if data else None
+
+    @property
+    def branch(self):
+        """
+        Name of the currently checked-out branch.  If HEAD is detached, the
+        name of a local branch pointing at the same commit is returned if there
+        is one, and None otherwise.
+
+        """
+        data = self.data
+        if not data:
+            return None
+        head_ref = data['head_ref']
+        if head_ref != None and head_ref.startswith('refs/heads/'):
+            return head_ref[len('refs/heads/'):]
+        for name in sorted(data['branches']):
+            if data['branches'][name] == data['head_commit']:
+                return name
+        return None
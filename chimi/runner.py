@@ -0,0 +1,281 @@
+# chimi: a companion tool for ChaNGa: external command execution
+# Copyright (C) 2014 Collin J. Sutton
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# The GNU General Public License version 2 may be found at
+# <http://www.gnu.org/licenses/gpl-2.0.html>.
+
+"""
+Execution of external commands.
+
+Commands run through this module are given their working directory directly
+(Chimi's own working directory is never changed), so any number of them may be
+run from different threads at once.  All of them obey `chimi.settings.noact`,
+and all of them can be cancelled together with `cancel_all` -- which `run_all`
+does automatically when interrupted.
+
+"""
+
+__author__    = 'Collin J. Sutton'
+__copyright__ = 'Copyright (C) 2014 Collin J. Sutton'
+__license__   = 'GPLv2'
+
+import os
+import sys
+import time
+import errno
+import signal
+import threading
+import subprocess
+
+import chimi
+import chimi.util
+import chimi.settings
+
+__all__ = ['CommandFailedError', 'CommandTimeoutError', 'Result',
+           'run', 'run_all', 'cancel_all']
+
+
+class CommandFailedError(chimi.Error, subprocess.CalledProcessError):
+    """
+    Raised when a command exits with a non-zero status.  Since this is also a
+    `subprocess.CalledProcessError`, code written for `subprocess.check_call`
+    handles it as expected.  The command's `Result` is available as `result`.
+
+    """
+    def __init__(self, returncode, cmd, output=None, errors=None, result=None):
+        subprocess.CalledProcessError.__init__(self, returncode, cmd, output)
+        self.errors = errors
+        self.result = result
+        self.message = 'command `%s\' failed with exit status %d' % (' '.join(cmd), returncode)
+
+class CommandTimeoutError(CommandFailedError):
+    """Raised when a command is killed for exceeding its time limit."""
+    def __init__(self, returncode, cmd, timeout, output=None, errors=None, result=None):
+        CommandFailedError.__init__(self, returncode, cmd, output, errors, result)
+        self.timeout = timeout
+        self.message = 'command `%s\' timed out after %g seconds' % (' '.join(cmd), timeout)
+
+
+LOG_CHUNK_SIZE = 65536
+"""
+Maximum number of bytes of a command's output held in memory at once when
+copying it to a log file.
+
+"""
+
+Result = chimi.util.create_struct(__name__, 'Result', 'returncode', 'output', 'errors',
+                                  'elapsed', 'rusage', elapsed=None, rusage=None)
+"""
+Outcome of a command run with `run`.  `output` and `errors` hold the command's
+standard output and standard error if they were captured, and are None
+otherwise.  `elapsed` is the command's wall-clock run time in seconds, and
+`rusage` the resource usage (as from `resource.getrusage`) of the command and
+the processes it waited for; `rusage` is None for captured commands.
+
+"""
+
+_active = {}
+_active_mutex = threading.Lock()
+
+
+def _terminate(process, group):
+    try:
+        if group:
+            os.killpg(process.pid, signal.SIGTERM)
+        else:
+            process.terminate()
+    except OSError:
+        # Already exited.
+        pass
+
+def cancel_all():
+    """Terminate all commands currently running through this module."""
+    with _active_mutex:
+        for process, group in _active.items():
+            _terminate(process, group)
+
+def _tee(process, log, echo):
+    """
+    Copy a process's (combined) output to the open file `log`, and to the
+    stream `echo` unless it is None, as it is produced.
+
+    """
+    fd = process.stdout.fileno()
+    while True:
+        chunk = os.read(fd, LOG_CHUNK_SIZE)
+        if len(chunk) == 0:
+            break
+        log.write(chunk)
+        log.flush()
+        if echo != None:
+            echo.write(chunk)
+            echo.flush()
+    process.stdout.close()
+
+def _wait(process):
+    """
+    Wait for a process to exit, and get its resource usage.  Unlike
+    `resource.getrusage(resource.RUSAGE_CHILDREN)`, this counts only the given
+    process (and its own children), so it is accurate even when other threads
+    are running commands at the same time.
+
+    """
+    while True:
+        try:
+            pid, status, rusage = os.wait4(process.pid, 0)
+            break
+        except OSError as err:
+            if err.errno != errno.EINTR:
+                raise
+    if os.WIFSIGNALED(status):
+        process.returncode = -os.WTERMSIG(status)
+    else:
+        process.returncode = os.WEXITSTATUS(status)
+    return rusage
+
+def run(args, cwd=None, out=None, err=None, capture=False, timeout=None,
+        check=True, env=None, log=None, echo=True):
+    """
+    Run (or pretend to run, depending on the value of `chimi.settings.noact`) a
+    command.
+
+    cwd: directory in which to run the command.  Default: the current
+        directory.
+
+    out, err: files to which the command's standard output and error streams
+        should be written.  Ignored if `capture` is set.
+
+    capture: if True, the command's output and error streams are collected
+        and returned in the Result.
+
+    timeout: number of seconds after which the command (and any processes it
+        started) should be killed.
+
+    check: if True, raise CommandFailedError if the command fails; otherwise
+        return its exit status in the Result.  CommandTimeoutError is raised
+        regardless.
+
+    env: environment for the command, if not Chimi's own.
+
+    log: path of a file to which the command's combined output and error
+        streams should be appended, preceded by a line naming the command.
+        The output is streamed to the file as it is produced.  Ignored if
+        `capture` is set.
+
+    echo: if True and `log` is given, also copy the command's output to `out`
+        (or to standard output, if `out` is None).
+
+    return: a Result instance.
+
+    """
+    args = list(args)
+    if cwd == None:
+        cwd = os.getcwd()
+
+    if chimi.settings.noact:
+        sys.stderr.write('would execute [in %s]: %s\n' % (os.path.relpath(cwd, os.getcwd()),
+                                                           ' '.join(args)))
+        return Result(0, '' if capture else None, '' if capture else None)
+
+    start = time.time()
+
+    # Commands with a time limit get their own session, so that everything
+    # they start can be killed along with them.
+    group = timeout != None
+    stdout, stderr = out, err
+    log_file = None
+    if capture:
+        stdout, stderr = subprocess.PIPE, subprocess.PIPE
+    elif log != None:
+        if not os.path.isdir(os.path.dirname(log)):
+            os.makedirs(os.path.dirname(log))
+        log_file = open(log, 'ab')
+        log_file.write('### %s [in %s]: %s\n' % (time.ctime(), cwd, ' '.join(args)))
+        log_file.flush()
+        stdout, stderr = subprocess.PIPE, subprocess.STDOUT
+    process = subprocess.Popen(args, cwd=cwd, env=env, close_fds=True,
+                               stdout=stdout, stderr=stderr,
+                               preexec_fn=os.setsid if group else None)
+    with _active_mutex:
+        _active[process] = group
+
+    expired = []
+    timer = None
+    if timeout != None:
+        def expire():
+            expired.append(True)
+            _terminate(process, group)
+        timer = threading.Timer(timeout, expire)
+        timer.daemon = True
+        timer.start()
+
+    output, errors, rusage = None, None, None
+    try:
+        if capture:
+            output, errors = process.communicate()
+        else:
+            if log_file != None:
+                _tee(process, log_file, (out or sys.stdout) if echo else None)
+            rusage = _wait(process)
+    except KeyboardInterrupt:
+        _terminate(process, group)
+        process.wait()
+        raise
+    finally:
+        if timer != None:
+            timer.cancel()
+        if log_file != None:
+            log_file.close()
+        with _active_mutex:
+            del _active[process]
+
+    result = Result(process.returncode, output, errors, time.time() - start, rusage)
+    if len(expired) > 0:
+        raise CommandTimeoutError(process.returncode, args, timeout, output, errors, result)
+    elif check and process.returncode != 0:
+        raise CommandFailedError(process.returncode, args, output, errors, result)
+    return result
+
+def run_all(commands, max_workers=None, **kwargs):
+    """
+    Run several commands concurrently, capturing their output.
+
+    commands: list of argument lists, or of dicts of keyword arguments for
+        `run` (with the argument list under 'args').
+
+    max_workers: maximum number of commands to run at once.  Default: the
+        number of usable CPUs.
+
+    Other keyword arguments are passed to `run` for every command.  If Chimi
+    is interrupted, all of the commands are cancelled.
+
+    return: list of `(result, exception)` pairs as for
+        `chimi.util.parallel_map`.
+
+    """
+    kwargs.setdefault('capture', True)
+    def run_one(command):
+        options = dict(kwargs)
+        if isinstance(command, dict):
+            options.update(command)
+        else:
+            options['args'] = command
+        return run(**options)
+
+    if max_workers == None:
+        max_workers = chimi.util.cpu_count()
+    try:
+        return chimi.util.parallel_map(run_one, commands, max_workers)
+    except KeyboardInterrupt:
+        cancel_all()
+        raise
@@ -0,0 +1,222 @@
+# chimi: a companion tool for ChaNGa: concurrent build scheduling
+# Copyright (C) 2014 Collin J. Sutton
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# The GNU General Public License version 2 may be found at
+# <http://www.gnu.org/licenses/gpl-2.0.html>.
+
+"""
+Scheduling of several package builds at once.
+
+A `BuildScheduler` holds a graph of builds to perform -- e.g. ChaNGa builds and
+the Charm++ builds they depend on -- and runs every build whose dependencies
+have completed concurrently, sharing a fixed budget of `make` job slots among
+the running builds.  Builds may also be pipelined: a build can start while a
+dependency is still running, once that dependency has produced what the early
+part of the dependent build needs.
+
+"""
+
+__author__    = 'Collin J. Sutton'
+__copyright__ = 'Copyright (C) 2014 Collin J. Sutton'
+__license__   = 'GPLv2'
+
+import sys
+import threading
+
+__all__ = ['BuildNode', 'BuildScheduler']
+
+
+class BuildNode(object):
+    """
+    A single build in a BuildScheduler's graph.
+
+    state: one of 'pending', 'running', 'complete', 'failed', or 'skipped'.
+
+    build: the `chimi.build.Build` produced by running the node, if any.
+
+    jobs: number of job slots given to the build while it runs.
+
+    lender: the running dependency whose job slots this node was started
+        with, if it was started early for lack of free slots.  The slots are
+        counted as the lender's until the lender finishes.
+
+    """
+    def __init__(self, package_name, package, config, dependencies=None):
+        self.package_name = package_name
+        self.package = package
+        self.config = config
+        self.dependencies = list(dependencies) if dependencies else []
+        self.state = 'pending'
+        self.build = None
+        self.error = None
+        self.jobs = 0
+        self.lender = None
+
+    @property
+    def description(self):
+        """Human-readable description of the build configuration."""
+        config = self.config
+        arch = config.architecture if isinstance(config.architecture, basestring) \
+            else config.architecture.name
+        return '%s %s%s (%s)' % (self.package.definition.name, arch,
+                                 ''.join(' +' + c for c in sorted(set(config.components))),
+                                 config.branch)
+
+
+class BuildScheduler(object):
+    """
+    Runs a graph of builds, each as soon as its dependencies have completed,
+    with at most `slots` `make` jobs running at once across all builds.
+
+    """
+
+    def __init__(self, slots, run, early_start=None):
+        """
+        slots: total number of job slots to share among concurrent builds.
+
+        run: callable taking a BuildNode and a job count, which performs the
+            build and returns the resulting `chimi.build.Build` (or None on
+            failure).
+
+        early_start: optional callable taking a running BuildNode, which
+            returns True if builds that depend on it may start before it
+            completes.  Such builds must themselves wait for whatever they
+            need from it.
+
+        """
+        self.slots = max(1, slots)
+        self.run_node = run
+        self.early_start = early_start
+        self.nodes = []
+        self._by_key = {}
+        self.condition = threading.Condition()
+        self.free_slots = self.slots
+
+    def add(self, package_name, package, config, dependencies=None):
+        """
+        Add a build to the graph, or get the node already added for the same
+        package and configuration.
+
+        """
+        key = (package_name, config.fingerprint)
+        if key in self._by_key:
+            node = self._by_key[key]
+            for dep in dependencies or []:
+                if not dep in node.dependencies:
+                    node.dependencies.append(dep)
+            return node
+        node = BuildNode(package_name, package, config, dependencies)
+        self._by_key[key] = node
+        self.nodes.append(node)
+        return node
+
+    @property
+    def running(self):
+        """Nodes currently being built."""
+        return filter(lambda n: n.state == 'running', self.nodes)
+
+    def _borrowers(self, node):
+        """Running nodes started with `node`'s job slots."""
+        return filter(lambda n: n.lender is node and n.state == 'running', self.nodes)
+
+    def _dependency_satisfied(self, dep):
+        return dep.state == 'complete' or \
+            (dep.state == 'running' and self.early_start != None and self.early_start(dep))
+
+    def _execute(self, node):
+        try:
+            node.build = self.run_node(node, node.jobs)
+        except Exception as err:
+            node.error = err
+            sys.stderr.write('\033[1;31mERROR:\033[0m %s: %s\n' %
+                             (node.description, str(err) or err.__class__.__name__))
+        with self.condition:
+            if node.build != None and node.build.status.completion:
+                node.state = 'complete'
+            else:
+                node.state = 'failed'
+            # Slots borrowed from a still-running dependency stay counted as
+            # its own.  Of this node's slots, those lent to running dependents
+            # become theirs, and the rest go back to the pool.
+            if node.lender == None or node.lender.state != 'running':
+                freed = node.jobs
+                for borrower in self._borrowers(node):
+                    borrower.lender = None
+                    freed -= borrower.jobs
+                self.free_slots += max(0, freed)
+            self.condition.notify()
+
+    def _start(self, node):
+        node.state = 'running'
+        thread = threading.Thread(target=self._execute, args=(node,))
+        thread.daemon = True
+        thread.start()
+
+    def run(self):
+        """
+        Run all builds in the graph.  Builds whose dependencies failed are
+        skipped.
+
+        return: True if every build completed successfully.
+
+        """
+        with self.condition:
+            while True:
+                pending = filter(lambda n: n.state == 'pending', self.nodes)
+                ready = []
+                for node in pending:
+                    states = set(dep.state for dep in node.dependencies)
+                    if 'failed' in states or 'skipped' in states:
+                        node.state = 'skipped'
+                        sys.stderr.write('Skipping %s: a build it depends on failed.\n' %
+                                         node.description)
+                    elif all(self._dependency_satisfied(dep) for dep in node.dependencies):
+                        ready.append(node)
+
+                if self.free_slots == 0:
+                    # A build started early spends its first steps waiting on
+                    # its running dependency, so it may start without free
+                    # slots by borrowing the dependency's, which are divided
+                    # among all of the dependents ready to start.
+                    lenders = {}
+                    for node in ready:
+                        running = [dep for dep in node.dependencies if dep.state == 'running']
+                        if len(running) > 0:
+                            lenders.setdefault(running[0], []).append(node)
+                    for lender, borrowers in lenders.items():
+                        available = lender.jobs - sum(n.jobs for n in self._borrowers(lender))
+                        while len(borrowers) > 0 and available > 0:
+                            node = borrowers.pop(0)
+                            ready.remove(node)
+                            node.jobs = max(1, available // (len(borrowers) + 1))
+                            node.lender = lender
+                            available -= node.jobs
+                            self._start(node)
+
+                while len(ready) > 0 and self.free_slots > 0:
+                    node = ready.pop(0)
+                    # Divide the free slots among the builds that could start
+                    # now.
+                    node.jobs = max(1, self.free_slots // (len(ready) + 1))
+                    self.free_slots -= node.jobs
+                    self._start(node)
+
+                if len(self.running) == 0:
+                    # Nothing left that can run.
+                    for node in filter(lambda n: n.state == 'pending', self.nodes):
+                        node.state = 'skipped'
+                    break
+                # Wait with a timeout so KeyboardInterrupt is still delivered.
+                self.condition.wait(0.5)
+
+        return all(n.state == 'complete' for n in self.nodes)
@@ -19,9 +19,19 @@ associated with any one Chimi module.
 
 """
 
+import os
 import chimi.util
 DefaultRepository = chimi.util.create_struct(__name__, 'DefaultRepository',
-                                             'url', 'branch')
+                                             'url', 'branch', 'depth', 'filter', 'sparse',
+                                             depth=None, filter=None, sparse=None)
+"""
+Remote repository and clone mode for a package.  If set, `depth` (number of
+commits) makes new clones shallow, `filter` (e.g. "blob:none") makes them
+partial, and `sparse` (a list of paths) limits the checked-out files to those
+paths.  Any of these may be overridden by the "fetch" section of a host
+configuration file.
+
+"""
 
 DEFAULT_REPOSITORIES={
     'charm'   : DefaultRepository('http://charm.cs.illinois.edu/gerrit/charm.git',     'master'),
@@ -32,6 +42,35 @@ DEFAULT_REPOSITORIES={
 
 
 
+mirror_directory = os.environ.get('CHIMI_MIRROR_DIR') or None
+"""
+Directory holding bare mirrors of package repositories, shared by all of the
+user's (or, if `CHIMI_MIRROR_DIR` points somewhere common, the site's) Chimi
+workspaces.  New clones are made from these mirrors, and `chimi fetch` refreshes
+them.  Mirroring is off unless `CHIMI_MIRROR_DIR` is set to a non-empty value.
+
+"""
+
+artifact_directory = os.environ.get('CHIMI_ARTIFACT_DIR') or None
+"""
+Directory holding the packed products of completed builds (see
+`chimi.artifacts`), shared like `mirror_directory` -- e.g. between all of a
+user's workspaces, or between users.  Builds matching a stored entry are
+unpacked from it rather than compiled.  The store is off unless
+`CHIMI_ARTIFACT_DIR` is set to a non-empty value.
+
+"""
+
+configure_cache_directory = os.environ.get('CHIMI_CONFIGURE_CACHE_DIR') or None
+"""
+Directory holding the autoconf cache files shared by ChaNGa builds that use the
+same compilers, Charm++ build, and options (see `chimi.autoconf`).  `configure`
+runs without a shared cache unless `CHIMI_CONFIGURE_CACHE_DIR` is set to a
+non-empty value.
+
+"""
+
+
 noact = False
 """
 Dry-run flag.  When `noact' is set, no files will be changed and no external
@@ -58,3 +97,25 @@ When converting build messages to strings, should we use a relative time for
 the timestamp?  Default False.
 
 """
+
+verify_builds = True
+"""
+Check packages' build records against the filesystem and repository (removing
+records of builds that no longer exist and correcting stale branch names) when
+the packages are loaded.  Default True; cleared by `chimi --no-verify`.
+
+"""
+
+fetch_jobs = 4
+"""
+Maximum number of packages fetched concurrently by `chimi fetch`.
+
+"""
+
+echo_build_output = True
+"""
+Copy the output of build steps to the terminal as well as to the builds' log
+files.  Cleared by `chimi build` when it runs several builds at once, so that
+their output isn't interleaved.
+
+"""
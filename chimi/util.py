@@ -25,6 +25,7 @@ import re
 import sys
 import fcntl
 import struct
+import threading
 import termios
 import datetime
 
@@ -182,40 +183,93 @@ def wrap_text(_in, start_col=0, max_col=75, respect_newlines=True):
 def check_call(call, cwd=None, out=None, err=None):
     """
     Run (or pretend to run, depending on the value of `chimi.settings.noact`) a
-    command using `subprocess.check_call`.
+    command, returning its exit status.  Use `chimi.runner.run` instead where
+    failures should raise an exception.
 
     """
-    import subprocess
-    import chimi.settings
-    oldcwd = os.getcwd();
-
-    if cwd != None and cwd != oldcwd:
-        # the directory might not even exist if no-act is enabled, so don't
-        # actually switch directory if it is [enabled].
-        if not chimi.settings.noact:
-            os.chdir(cwd)
-    else:
-        cwd = oldcwd
+    import chimi.runner
 
     if len(call) == 1 and isinstance(call[0], list):
         call = call[0]
 
-    result = 0
+    return chimi.runner.run(call, cwd=cwd, out=out, err=err, check=False).returncode
 
-    if chimi.settings.noact:
-        sys.stderr.write('would execute [in %s]: %s\n' % (os.path.relpath(cwd, oldcwd), ' '.join(call)))
-    else:
-        try:
-            subprocess.check_call(call, stdout=out, stderr=err)
-        except subprocess.CalledProcessError as error:
-            result = error.returncode
-        except TypeError:
-            print(call)
+def cpu_count():
+    """
+    Get the number of CPUs this process may run on, respecting any CPU
+    affinity mask (e.g. as set by a batch system) where that can be determined.
 
-    if not chimi.settings.noact:
-        os.chdir(oldcwd)
+    """
+    try:
+        for line in file('/proc/self/status', 'r'):
+            if line.startswith('Cpus_allowed_list:'):
+                count = 0
+                for part in line.split(':', 1)[1].strip().split(','):
+                    first, sep, last = part.partition('-')
+                    count += int(last) - int(first) + 1 if sep else 1
+                return count
+    except (IOError, ValueError):
+        pass
+    import multiprocessing
+    return multiprocessing.cpu_count()
+
+def available_memory():
+    """
+    Get the amount of memory, in bytes, available for new processes without
+    swapping, or None if it can't be determined.
 
-    return result
+    """
+    try:
+        info = {}
+        for line in file('/proc/meminfo', 'r'):
+            name, value = line.split(':', 1)
+            info[name] = int(value.split()[0]) * 1024
+    except (IOError, ValueError):
+        return None
+    if 'MemAvailable' in info:
+        return info['MemAvailable']
+    elif 'MemFree' in info:
+        return info['MemFree'] + info.get('Buffers', 0) + info.get('Cached', 0)
+    return None
+
+def parallel_map(function, items, max_workers):
+    """
+    Call `function` on each of `items` using at most `max_workers` threads.
+
+    return: list of `(result, exception)` pairs, in the same order as
+        `items`.  `exception` is None for calls that returned normally.
+
+    """
+    import Queue
+    import threading
+
+    items = list(items)
+    results = [None] * len(items)
+    queue = Queue.Queue()
+    for i in xrange(len(items)):
+        queue.put(i)
+
+    def worker():
+        while True:
+            try:
+                i = queue.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                results[i] = (function(items[i]), None)
+            except Exception as err:
+                results[i] = (None, err)
+
+    threads = [threading.Thread(target=worker)
+               for n in xrange(max(1, min(max_workers, len(items))))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        # Join with a timeout so that KeyboardInterrupt is still delivered.
+        while thread.is_alive():
+            thread.join(0.1)
+    return results
 
 
 # This function was copied from a Stack Overflow answer at
@@ -378,6 +432,197 @@ def relative_datetime_string(time, significant_units=FORMAT_DURATION_DEFAULT_SIG
     return format_duration(diff, significant_units)
 
 
+def tail_offset(fileobj, lines, block_size=8192):
+    """
+    Find the offset at which the last `lines` lines of a file begin, reading
+    the file backwards from its end a block at a time.
+
+    """
+    fileobj.seek(0, os.SEEK_END)
+    offset = fileobj.tell()
+    if offset == 0 or lines == 0:
+        return offset
+    # A trailing newline ends the last line rather than starting a new one.
+    fileobj.seek(offset - 1)
+    newlines = -1 if fileobj.read(1) == '\n' else 0
+    while offset > 0:
+        start = max(0, offset - block_size)
+        fileobj.seek(start)
+        block = fileobj.read(offset - start)
+        index = len(block)
+        while True:
+            index = block.rfind('\n', 0, index)
+            if index < 0:
+                break
+            newlines += 1
+            if newlines == lines:
+                return start + index + 1
+        offset = start
+    return 0
+
+def json_loads(s):
+    """
+    Decode a JSON string, converting the unicode strings produced by
+    `json.loads` into plain strings (the rest of Chimi expects `str`
+    instances).
+
+    """
+    import json
+    def to_str(obj):
+        if isinstance(obj, unicode):
+            return obj.encode('utf-8')
+        elif isinstance(obj, list):
+            return [to_str(x) for x in obj]
+        elif isinstance(obj, dict):
+            return dict((to_str(k), to_str(v)) for k, v in obj.iteritems())
+        else:
+            return obj
+    return to_str(json.loads(s))
+
+
+def write_file_atomically(filename, data):
+    """
+    Write `data` to `filename` by way of a temporary file that is renamed
+    over the destination once complete, so that concurrent readers see either
+    the old contents or the new, but never a partially-written file.
+
+    """
+    import stat
+    import tempfile
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix='.%s.' % os.path.basename(filename))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        if os.path.exists(filename):
+            os.chmod(tmp, stat.S_IMODE(os.stat(filename).st_mode))
+        else:
+            os.chmod(tmp, 0644)
+        os.rename(tmp, filename)
+    except:
+        os.unlink(tmp)
+        raise
+
+
+class _FileLockState(object):
+    """Per-process state of the lock on one lock file; see FileLock."""
+    def __init__(self):
+        self.condition = threading.Condition(threading.Lock())
+        self.fd = None
+        self.mode = None
+        self.exclusive_owner = None
+        self.exclusive_count = 0
+        self.shared = {}
+
+    def _flock(self, path, mode):
+        if self.fd == None:
+            try:
+                self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0644)
+            except OSError:
+                # Read-only workspace; nobody can be writing to it through us,
+                # but we can still wait on anyone who can.
+                if not os.path.exists(path):
+                    return
+                self.fd = os.open(path, os.O_RDONLY)
+        if mode != self.mode:
+            fcntl.flock(self.fd, mode)
+            self.mode = mode
+
+    def _unlock(self):
+        if self.fd != None:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+            os.close(self.fd)
+            self.fd = None
+            self.mode = None
+
+
+class FileLock(object):
+    """
+    Advisory inter-process lock based on `flock(2)`, for use as a context
+    manager.  Shared locks may be held by any number of processes at once, and
+    exclude exclusive locks.
+
+    Within a process, all FileLock instances for a file share a single
+    descriptor.  A thread that holds a lock may take it again (in either mode)
+    without blocking, and a thread holding the only shared locks in the
+    process may upgrade to an exclusive one; other threads wait for an
+    exclusive holder just as other processes do.
+
+    """
+    _states = {}
+    _states_mutex = threading.Lock()
+
+    def __init__(self, path, shared=False):
+        self.path = path
+        self.shared = shared
+        self.held = None
+
+    def _state(self):
+        key = os.path.realpath(self.path)
+        with FileLock._states_mutex:
+            if not key in FileLock._states:
+                FileLock._states[key] = _FileLockState()
+            return FileLock._states[key]
+
+    def acquire(self):
+        state = self._state()
+        me = threading.current_thread().ident
+        with state.condition:
+            if state.exclusive_owner == me:
+                # Anything this thread takes while holding the exclusive lock
+                # is covered by it.
+                state.exclusive_count += 1
+                self.held = 'exclusive'
+                return
+            if self.shared:
+                while state.exclusive_owner != None:
+                    state.condition.wait(0.5)
+                state.shared[me] = state.shared.get(me, 0) + 1
+                self.held = 'shared'
+                state._flock(self.path, fcntl.LOCK_SH)
+            else:
+                while state.exclusive_owner != None or \
+                        any(thread != me for thread in state.shared):
+                    state.condition.wait(0.5)
+                state.exclusive_owner = me
+                state.exclusive_count = 1
+                self.held = 'exclusive'
+                state._flock(self.path, fcntl.LOCK_EX)
+
+    def release(self):
+        if self.held == None:
+            return
+        state = self._state()
+        me = threading.current_thread().ident
+        with state.condition:
+            if self.held == 'exclusive':
+                state.exclusive_count -= 1
+                if state.exclusive_count == 0:
+                    state.exclusive_owner = None
+                    if len(state.shared) > 0:
+                        # Downgrade to the shared lock this thread still holds.
+                        state._flock(self.path, fcntl.LOCK_SH)
+                    else:
+                        state._unlock()
+            else:
+                state.shared[me] -= 1
+                if state.shared[me] == 0:
+                    del state.shared[me]
+                if len(state.shared) == 0 and state.exclusive_owner == None:
+                    state._unlock()
+            self.held = None
+            state.condition.notify_all()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
 def list_excluding_index(lst, idx):
     """Get a copy of `lst` without the value at `idx`."""
     if idx == 0: